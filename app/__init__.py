@@ -1,12 +1,49 @@
 from flask import Flask
 from app.config import Config
 
-def create_app():
+def create_app(iniciar_hilos=True):
+    """
+    Crea la app de Flask. Con `iniciar_hilos=False` no arranca el consumidor de la cola,
+    para poder precargarla antes de hacer fork (ver `serve.py`) y arrancarlo en cada worker.
+    """
     app = Flask(__name__)
     app.config.from_object(Config)
+    app.config["MAX_CONTENT_LENGTH"] = Config.WEBHOOK_MAX_BYTES
 
     # Importar rutas
-    from app.routes import webhook_bp
+    from app.routes import webhook_bp, metricas_bp
     app.register_blueprint(webhook_bp)
 
+    # Métricas de Prometheus: tiempos por etapa más el estado del pool, el despachador y la cola
+    if Config.METRICAS_ACTIVAS:
+        registrar_recolectores()
+        app.register_blueprint(metricas_bp)
+
+    if iniciar_hilos:
+        iniciar_procesamiento()
+
     return app
+
+
+def registrar_recolectores():
+    """
+    Agrega a `/metrics` el estado del pool de conexiones, el despachador y la cola persistente.
+    """
+    from app.metricas import registrar_recolector
+    from app.database import metricas_pool
+    from app.despachador import metricas_despachador
+    from app.cola import metricas_cola
+
+    registrar_recolector("db_pool", metricas_pool)
+    registrar_recolector("despachador", metricas_despachador)
+    registrar_recolector("cola_webhooks", metricas_cola)
+
+
+def iniciar_procesamiento():
+    """
+    Arranca en este proceso el consumidor de la cola persistente de webhooks (una sola vez):
+    registra cada lote de una vez y atiende cada mensaje.
+    """
+    from app.routes import registrar_mensajes, atender_mensaje
+    from app.cola import iniciar_consumidor
+    iniciar_consumidor(atender_mensaje, registrar=registrar_mensajes)
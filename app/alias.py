@@ -0,0 +1,206 @@
+import threading
+import time
+from app.almacen import conexion_local
+from app.cache import suscribir, avisar_cambio
+from app.config import Config
+from app.indices import normalizar_texto
+
+# 📌 Alias aprendidos: texto normalizado tal como lo escribe el cliente -> idProducto / idCliente.
+# Se consultan en memoria antes de la búsqueda difusa, así las líneas que se repiten
+# ("8 cloro 1/2 gal") no se vuelven a puntuar y se resuelven siempre igual.
+# - 'automatico': se guardan solos cuando la búsqueda difusa supera `Config.ALIAS_SIMILITUD_MIN`.
+# - 'manual': correcciones con `corregir_alias`; las búsquedas nunca las sobrescriben.
+# Los tipos son "producto" y "cliente".
+# Los alias aprendidos en una búsqueda por lotes guardan también la segunda mejor opción, que
+# `buscar_productos_por_nombres` devuelve como "alternativa" aunque la línea no se vuelva a puntuar.
+# Cada alias nuevo, corregido o borrado se avisa por la caché compartida y los demás procesos lo aplican
+# en su memoria y en su almacén local, así un nodo no sigue resolviendo un texto con un alias viejo.
+
+_tablas_creadas = False
+_lock_tablas = threading.Lock()
+
+_alias = None  # {(tipo, texto): id}
+_alternativas = {}  # {(tipo, texto): (id, similitud)} de los alias que la tienen
+_cargado_en = 0.0
+_lock_alias = threading.Lock()
+
+
+def _crear_tablas():
+    global _tablas_creadas
+
+    with _lock_tablas:
+        if _tablas_creadas:
+            return
+        conexion_local().executescript("""
+            CREATE TABLE IF NOT EXISTS alias_texto (
+                tipo TEXT NOT NULL,
+                texto TEXT NOT NULL,
+                id_destino INTEGER NOT NULL,
+                origen TEXT NOT NULL,
+                similitud REAL,
+                actualizado_en REAL NOT NULL,
+                id_alternativa INTEGER,
+                similitud_alternativa REAL,
+                PRIMARY KEY (tipo, texto)
+            );
+        """)
+        columnas = [fila[1] for fila in conexion_local().execute("PRAGMA table_info(alias_texto)")]
+        if "id_alternativa" not in columnas:  # Almacenes creados antes de guardar la segunda opción
+            conexion_local().executescript("""
+                ALTER TABLE alias_texto ADD COLUMN id_alternativa INTEGER;
+                ALTER TABLE alias_texto ADD COLUMN similitud_alternativa REAL;
+            """)
+        _tablas_creadas = True
+
+
+def _obtener_alias():
+    """
+    Devuelve el diccionario de alias en memoria, recargándolo del almacén local cuando vence
+    `Config.ALIAS_TTL_SEGUNDOS` (para ver los alias aprendidos o corregidos por otros procesos).
+    """
+    global _alias, _alternativas, _cargado_en
+
+    with _lock_alias:
+        ttl = Config.ALIAS_TTL_SEGUNDOS
+        if _alias is None or (ttl > 0 and time.monotonic() - _cargado_en > ttl):
+            _crear_tablas()
+            filas = conexion_local().execute(
+                "SELECT tipo, texto, id_destino, id_alternativa, similitud_alternativa FROM alias_texto"
+            ).fetchall()
+            _alias = {(tipo, texto): id_destino for tipo, texto, id_destino, _, _ in filas}
+            _alternativas = {
+                (tipo, texto): (id_alternativa, similitud_alternativa)
+                for tipo, texto, _, id_alternativa, similitud_alternativa in filas if id_alternativa is not None
+            }
+            _cargado_en = time.monotonic()
+        return _alias
+
+
+def _clave(texto):
+    # Espacios simples: "cloro 3   1 2 galon" y "cloro 3 1 2 galon" son el mismo alias
+    return " ".join(texto.split())
+
+
+def buscar_alias(tipo, texto):
+    """
+    Devuelve el ID asociado al texto ya normalizado (`normalizar_texto`), o None si no hay alias.
+    """
+    return _obtener_alias().get((tipo, _clave(texto)))
+
+
+def buscar_alternativa(tipo, texto):
+    """
+    Devuelve (ID, similitud) de la segunda mejor opción guardada con el alias del texto, o None
+    (alias manual o aprendido en una búsqueda individual, que no la calcula).
+    """
+    _obtener_alias()
+    return _alternativas.get((tipo, _clave(texto)))
+
+
+def aprender_alias(tipo, texto, id_destino, similitud, alternativa=None):
+    """
+    Guarda el resultado de una búsqueda difusa (texto ya normalizado) como alias
+    si la similitud alcanza `Config.ALIAS_SIMILITUD_MIN`. No reemplaza alias corregidos a mano.
+    `alternativa` es (ID, similitud) de la segunda mejor opción, si la búsqueda la calculó.
+    """
+    texto = _clave(texto)
+    if not texto or similitud < Config.ALIAS_SIMILITUD_MIN:
+        return
+    if _obtener_alias().get((tipo, texto)) == id_destino and (alternativa is None or (tipo, texto) in _alternativas):
+        return
+
+    if _guardar_automatico(tipo, texto, id_destino, similitud, alternativa):
+        avisar_cambio("alias", ("automatico", tipo, texto, id_destino, similitud, alternativa))
+
+
+def corregir_alias(tipo, texto, id_destino):
+    """
+    Asocia manualmente un texto (tal como lo escribe el cliente) a un producto o cliente.
+    """
+    texto = _clave(normalizar_texto(texto))
+    _guardar_manual(tipo, texto, id_destino)
+    avisar_cambio("alias", ("manual", tipo, texto, id_destino, None, None))
+
+
+def eliminar_alias(tipo, texto):
+    """
+    Borra el alias de un texto, para que la próxima vez se vuelva a resolver con la búsqueda difusa.
+    """
+    texto = _clave(normalizar_texto(texto))
+    _borrar(tipo, texto)
+    avisar_cambio("alias", ("eliminado", tipo, texto, None, None, None))
+
+
+def _guardar_automatico(tipo, texto, id_destino, similitud, alternativa=None):
+    """
+    Guarda un alias aprendido salvo que el texto tenga un alias manual. Devuelve True si se guardó.
+    """
+    alias = _obtener_alias()
+    id_alternativa, similitud_alternativa = (int(alternativa[0]), float(alternativa[1])) if alternativa else (None, None)
+    cursor = conexion_local().execute(
+        """
+        INSERT INTO alias_texto
+            (tipo, texto, id_destino, origen, similitud, actualizado_en, id_alternativa, similitud_alternativa)
+        VALUES (?, ?, ?, 'automatico', ?, ?, ?, ?)
+        ON CONFLICT (tipo, texto) DO UPDATE SET
+            id_destino = excluded.id_destino, similitud = excluded.similitud, actualizado_en = excluded.actualizado_en,
+            id_alternativa = excluded.id_alternativa, similitud_alternativa = excluded.similitud_alternativa
+        WHERE alias_texto.origen = 'automatico'
+        """,
+        (tipo, texto, int(id_destino), float(similitud), time.time(), id_alternativa, similitud_alternativa)
+    )
+    if cursor.rowcount > 0:
+        with _lock_alias:
+            alias[(tipo, texto)] = id_destino
+            if alternativa:
+                _alternativas[(tipo, texto)] = (id_alternativa, similitud_alternativa)
+            else:
+                _alternativas.pop((tipo, texto), None)
+        return True
+    return False
+
+
+def _guardar_manual(tipo, texto, id_destino):
+    alias = _obtener_alias()
+    conexion_local().execute(
+        """
+        INSERT OR REPLACE INTO alias_texto (tipo, texto, id_destino, origen, similitud, actualizado_en)
+        VALUES (?, ?, ?, 'manual', NULL, ?)
+        """,
+        (tipo, texto, int(id_destino), time.time())
+    )
+    with _lock_alias:
+        alias[(tipo, texto)] = id_destino
+        _alternativas.pop((tipo, texto), None)
+
+
+def _borrar(tipo, texto):
+    alias = _obtener_alias()
+    conexion_local().execute("DELETE FROM alias_texto WHERE tipo = ? AND texto = ?", (tipo, texto))
+    with _lock_alias:
+        alias.pop((tipo, texto), None)
+        _alternativas.pop((tipo, texto), None)
+
+
+def _al_cambiar_alias(cambio):
+    """
+    Aviso de otro proceso: aplica el alias nuevo, corregido o borrado. Si pudieron perderse avisos,
+    fuerza la recarga desde el almacén local.
+    """
+    global _alias
+
+    if cambio is None:
+        with _lock_alias:
+            _alias = None
+        return
+
+    origen, tipo, texto, id_destino, similitud, alternativa = cambio
+    if origen == "automatico":
+        _guardar_automatico(tipo, texto, id_destino, similitud, alternativa)
+    elif origen == "manual":
+        _guardar_manual(tipo, texto, id_destino)
+    else:
+        _borrar(tipo, texto)
+
+
+suscribir("alias", _al_cambiar_alias)
@@ -0,0 +1,33 @@
+import os
+import socket
+import sqlite3
+import threading
+from app.config import Config
+
+# 📌 Una conexión SQLite por hilo (y por proceso, por si el servidor hace fork)
+_local = threading.local()
+
+# 📌 Identifica el almacén local entre nodos: los procesos de un mismo nodo comparten el archivo
+ID_ALMACEN = f"{socket.gethostname()}:{os.path.abspath(Config.ALMACEN_LOCAL_PATH)}"
+
+
+def conexion_local():
+    """
+    Devuelve la conexión SQLite del hilo actual al almacén local (`Config.ALMACEN_LOCAL_PATH`).
+    Usa modo WAL para que lectores y escritores de varios hilos/procesos no se bloqueen,
+    y autocommit para que cada módulo abra sus transacciones con `BEGIN` explícito.
+    """
+    pid = os.getpid()
+    if getattr(_local, "pid", None) != pid:
+        directorio = os.path.dirname(Config.ALMACEN_LOCAL_PATH)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+
+        conexion = sqlite3.connect(Config.ALMACEN_LOCAL_PATH, timeout=30, isolation_level=None)
+        conexion.execute("PRAGMA journal_mode=WAL")
+        conexion.execute("PRAGMA synchronous=NORMAL")
+
+        _local.conexion = conexion
+        _local.pid = pid
+
+    return _local.conexion
@@ -0,0 +1,105 @@
+import asyncio
+import json
+from app.config import Config
+from app.metricas import contar, exponer
+from app.routes import firma_valida, cargar_json, encolar_entrega
+
+# 📌 Variante ASGI del webhook para el servidor de producción (`SERVIDOR_MODO=asgi`).
+# Lee el cuerpo sin bloquear, valida la firma, decodifica con orjson y pasa la escritura en la cola
+# a un hilo con `asyncio.to_thread`, así el event loop sigue aceptando entregas mientras SQLite escribe.
+# El consumidor de la cola se arranca en el evento `startup`, es decir, en cada worker después del fork.
+
+if Config.METRICAS_ACTIVAS:
+    from app import registrar_recolectores
+    registrar_recolectores()
+
+
+async def app(scope, receive, send):
+    """
+    Aplicación ASGI: `POST /webhook`, `GET /metrics` (si las métricas están activas) y el ciclo de vida.
+    """
+    if scope["type"] == "lifespan":
+        await _ciclo_de_vida(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    if scope["path"] == "/webhook" and scope["method"] == "POST":
+        await _webhook(scope, receive, send)
+    elif scope["path"] == "/metrics" and scope["method"] == "GET" and Config.METRICAS_ACTIVAS:
+        await _responder(send, 200, exponer().encode(), "text/plain; version=0.0.4")
+    else:
+        await _responder_json(send, 404, {"error": "No encontrado"})
+
+
+async def _ciclo_de_vida(receive, send):
+    while True:
+        mensaje = await receive()
+        if mensaje["type"] == "lifespan.startup":
+            from app import iniciar_procesamiento
+            iniciar_procesamiento()
+            await send({"type": "lifespan.startup.complete"})
+        elif mensaje["type"] == "lifespan.shutdown":
+            # El consumidor y el despachador se detienen con `atexit` al terminar el proceso
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def _webhook(scope, receive, send):
+    cuerpo = await _leer_cuerpo(receive)
+    if cuerpo is None:
+        await _responder_json(send, 413, {"error": "Cuerpo demasiado grande"})
+        return
+
+    encabezados = dict(scope.get("headers") or [])
+    if not firma_valida(cuerpo, encabezados.get(b"x-hub-signature-256", b"").decode("latin-1")):
+        contar("webhooks_recibidos_total", resultado="firma_invalida")
+        await _responder_json(send, 403, {"error": "Firma inválida"})
+        return
+
+    data = cargar_json(cuerpo)
+    if not data:
+        await _responder_json(send, 400, {"error": "No se recibió información"})
+        return
+
+    # 📌 Guardar en la cola persistente antes de responder, sin bloquear el event loop
+    try:
+        await asyncio.to_thread(encolar_entrega, data)
+    except Exception:
+        await _responder_json(send, 503, {"error": "No se pudo registrar el mensaje"})  # Meta reintentará la entrega
+        return
+
+    await _responder_json(send, 200, {"status": "success"})
+
+
+async def _leer_cuerpo(receive):
+    """
+    Lee el cuerpo completo de la solicitud. Devuelve None si supera `Config.WEBHOOK_MAX_BYTES`.
+    """
+    partes = []
+    tamano = 0
+    while True:
+        mensaje = await receive()
+        if mensaje["type"] == "http.disconnect":
+            break
+        parte = mensaje.get("body", b"")
+        tamano += len(parte)
+        if tamano > Config.WEBHOOK_MAX_BYTES:
+            return None
+        partes.append(parte)
+        if not mensaje.get("more_body"):
+            break
+    return b"".join(partes)
+
+
+async def _responder_json(send, estado, contenido):
+    await _responder(send, estado, json.dumps(contenido).encode(), "application/json")
+
+
+async def _responder(send, estado, cuerpo, tipo):
+    await send({
+        "type": "http.response.start",
+        "status": estado,
+        "headers": [(b"content-type", tipo.encode()), (b"content-length", str(len(cuerpo)).encode())]
+    })
+    await send({"type": "http.response.body", "body": cuerpo})
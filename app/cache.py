@@ -0,0 +1,249 @@
+import os
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from app.config import Config
+
+try:
+    import redis  # Solo hace falta con CACHE_BACKEND=redis
+except ImportError:
+    redis = None
+
+
+class CacheLRU:
+    """
+    Caché en memoria acotada por cantidad de elementos (LRU) y, opcionalmente, por antigüedad.
+    Es segura para usarse desde varios hilos.
+    """
+
+    def __init__(self, max_elementos, ttl_segundos=None):
+        self.max_elementos = max_elementos
+        self.ttl_segundos = ttl_segundos
+        self._datos = OrderedDict()  # clave -> (valor, vence_en)
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def obtener(self, clave, por_defecto=None):
+        with self._lock:
+            elemento = self._datos.get(clave)
+            if elemento is None or self._vencido(elemento):
+                if elemento is not None:
+                    del self._datos[clave]
+                self.fallos += 1
+                return por_defecto
+
+            self._datos.move_to_end(clave)
+            self.aciertos += 1
+            return elemento[0]
+
+    def guardar(self, clave, valor, ttl_segundos=None):
+        """
+        Guarda un valor. `ttl_segundos` reemplaza el TTL general para esta clave (0 = no vence).
+        """
+        ttl = self.ttl_segundos if ttl_segundos is None else ttl_segundos
+        vence_en = time.monotonic() + ttl if ttl else None
+
+        with self._lock:
+            self._datos[clave] = (valor, vence_en)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.max_elementos:
+                self._datos.popitem(last=False)
+
+    def contiene(self, clave):
+        return self.obtener(clave, _AUSENTE) is not _AUSENTE
+
+    def eliminar(self, clave):
+        with self._lock:
+            self._datos.pop(clave, None)
+
+    def eliminar_si(self, condicion):
+        """
+        Elimina las claves para las que `condicion(clave)` es verdadera.
+        """
+        with self._lock:
+            for clave in [clave for clave in self._datos if condicion(clave)]:
+                del self._datos[clave]
+
+    def limpiar(self):
+        with self._lock:
+            self._datos.clear()
+
+    def __len__(self):
+        return len(self._datos)
+
+    @staticmethod
+    def _vencido(elemento):
+        return elemento[1] is not None and time.monotonic() > elemento[1]
+
+
+_AUSENTE = object()
+
+
+# 📌 Caché compartida entre procesos y nodos (`Config.CACHE_BACKEND`): IDs de webhooks ya registrados,
+# versión y copia del catálogo, y avisos de cambios (catálogo, alias, clientes) para el resto de procesos.
+# - "local": en memoria, solo para un proceso (desarrollo o un único worker).
+# - "redis": cualquier servidor con protocolo Redis; los avisos viajan por pub/sub.
+
+_cache_compartida = None
+_pid_cache = None
+_lock_cache = threading.Lock()
+
+_suscriptores = {}  # canal -> [funcion(datos)]; `datos` es None si pudieron perderse avisos
+
+
+class CacheLocal:
+    """
+    Caché compartida en memoria del proceso. Los avisos no salen del proceso (no hay a quién avisar).
+    """
+    es_compartida = False
+
+    def __init__(self, max_elementos):
+        self._datos = CacheLRU(max_elementos)
+        self._contadores = {}  # Aparte, para que el LRU nunca los descarte
+        self._lock = threading.Lock()
+
+    def obtener(self, clave):
+        return self._datos.obtener(clave)
+
+    def guardar(self, clave, valor, ttl_segundos=None):
+        self._datos.guardar(clave, valor, ttl_segundos or 0)
+
+    def guardar_si_no_existe(self, clave, valor, ttl_segundos=None):
+        with self._lock:
+            if self._datos.contiene(clave):
+                return False
+            self._datos.guardar(clave, valor, ttl_segundos or 0)
+            return True
+
+    def eliminar(self, clave):
+        self._datos.eliminar(clave)
+
+    def incrementar(self, clave):
+        with self._lock:
+            self._contadores[clave] = self._contadores.get(clave, 0) + 1
+            return self._contadores[clave]
+
+    def leer_contador(self, clave):
+        return self._contadores.get(clave, 0)
+
+    def publicar(self, canal, datos):
+        pass
+
+
+class CacheRedis:
+    """
+    Caché compartida en un servidor Redis (`Config.REDIS_URL`). Los valores se guardan con pickle
+    bajo el prefijo `Config.CACHE_PREFIJO`; los avisos se publican en un solo canal y un hilo
+    los reparte a los suscriptores de este proceso, ignorando los que publicó él mismo.
+    """
+    es_compartida = True
+
+    def __init__(self, url):
+        self._redis = redis.Redis.from_url(url, socket_timeout=Config.CACHE_TIMEOUT_SEGUNDOS,
+                                           socket_connect_timeout=Config.CACHE_TIMEOUT_SEGUNDOS)
+        self._origen = uuid.uuid4().hex  # Identifica los avisos de este proceso
+        self._canal = Config.CACHE_PREFIJO + "avisos"
+        threading.Thread(target=self._escuchar, name="cache-avisos", daemon=True).start()
+
+    def _clave(self, clave):
+        return Config.CACHE_PREFIJO + clave
+
+    def obtener(self, clave):
+        valor = self._redis.get(self._clave(clave))
+        return None if valor is None else pickle.loads(valor)
+
+    def guardar(self, clave, valor, ttl_segundos=None):
+        self._redis.set(self._clave(clave), pickle.dumps(valor), ex=_segundos(ttl_segundos))
+
+    def guardar_si_no_existe(self, clave, valor, ttl_segundos=None):
+        return bool(self._redis.set(self._clave(clave), pickle.dumps(valor), nx=True, ex=_segundos(ttl_segundos)))
+
+    def eliminar(self, clave):
+        self._redis.delete(self._clave(clave))
+
+    def incrementar(self, clave):
+        return self._redis.incr(self._clave(clave))
+
+    def leer_contador(self, clave):
+        return int(self._redis.get(self._clave(clave)) or 0)
+
+    def publicar(self, canal, datos):
+        self._redis.publish(self._canal, pickle.dumps((self._origen, canal, datos)))
+
+    def _escuchar(self):
+        conectado_antes = False
+        while True:
+            try:
+                pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self._canal)
+                if conectado_antes:
+                    # Los avisos publicados mientras no había conexión se perdieron
+                    print("⚠️ Reconectado al canal de avisos de la caché, se descartan las copias locales")
+                    for canal in list(_suscriptores):
+                        _avisar(canal, None)
+                conectado_antes = True
+
+                while True:
+                    mensaje = pubsub.get_message(timeout=Config.CACHE_TIMEOUT_SEGUNDOS)
+                    if mensaje is None or mensaje["type"] != "message":
+                        continue
+                    origen, canal, datos = pickle.loads(mensaje["data"])
+                    if origen != self._origen:
+                        _avisar(canal, datos)
+            except Exception as e:
+                print(f"⚠️ Se perdió la conexión al canal de avisos de la caché: {e}")
+                time.sleep(1)
+
+
+def _segundos(ttl_segundos):
+    return max(1, int(ttl_segundos)) if ttl_segundos else None
+
+
+def _avisar(canal, datos):
+    for funcion in _suscriptores.get(canal, []):
+        try:
+            funcion(datos)
+        except Exception as e:
+            print(f"⚠️ Error al aplicar un aviso de '{canal}': {e}")
+
+
+def obtener_cache():
+    """
+    Devuelve la caché compartida de este proceso, creándola la primera vez (y de nuevo después de un fork,
+    porque el hilo que escucha los avisos no sobrevive al fork).
+    Si se pidió Redis pero el paquete `redis` no está instalado, usa la caché local.
+    """
+    global _cache_compartida, _pid_cache
+
+    with _lock_cache:
+        if _cache_compartida is None or _pid_cache != os.getpid():
+            if Config.CACHE_BACKEND == "redis" and redis is not None:
+                _cache_compartida = CacheRedis(Config.REDIS_URL)
+            else:
+                if Config.CACHE_BACKEND == "redis":
+                    print("⚠️ CACHE_BACKEND=redis pero el paquete 'redis' no está instalado, se usa la caché local")
+                _cache_compartida = CacheLocal(Config.DEDUP_MAX_IDS)
+            _pid_cache = os.getpid()
+        return _cache_compartida
+
+
+def suscribir(canal, funcion):
+    """
+    Registra `funcion(datos)` para los avisos de `canal` publicados por otros procesos.
+    Recibe None si la conexión se cortó y pudieron perderse avisos (conviene descartar lo que haya en memoria).
+    """
+    _suscriptores.setdefault(canal, []).append(funcion)
+
+
+def avisar_cambio(canal, datos):
+    """
+    Publica un cambio para los demás procesos. Un fallo solo se registra: cada proceso
+    termina viendo el cambio cuando vence su copia en memoria.
+    """
+    try:
+        obtener_cache().publicar(canal, datos)
+    except Exception as e:
+        print(f"⚠️ No se pudo avisar el cambio de '{canal}' a los demás procesos: {e}")
@@ -1,5 +1,57 @@
+import re
+import threading
 import requests
 import json
+from app.config import Config
+from app.cache import CacheLRU
+from app.cliente_http import solicitar
+from app.fechas import interpretar_fecha, interpretar_rango
+
+# 📌 Gramática de los tres formatos de mensaje (compilada una sola vez)
+RE_LINEA_PRODUCTO = re.compile(r"^(\d+) +(\S.*)$")
+RE_ESPACIOS = re.compile(r"\s+")
+
+# 📌 Límites para las llamadas al modelo local
+_semaforo_llm = threading.BoundedSemaphore(Config.LLM_CONCURRENCIA)
+_respuestas_llm = CacheLRU(Config.LLM_CACHE_MAX, Config.LLM_CACHE_TTL_SEGUNDOS)
+
+
+def analizar_mensaje(mensaje):
+    """
+    Valida el mensaje contra los formatos conocidos sin usar IA.
+    Devuelve un diccionario con la estructura del mensaje, o None si no cumple ningún formato:
+    - {"tipo": "pedido", "cliente": ..., "fecha_entrega": date, "lineas": [(cantidad, articulo), ...]}
+    - {"tipo": "reporte", "fecha_inicio": date, "fecha_fin": date}
+    - {"tipo": "agregar articulo"}
+    """
+    lineas = [linea.strip() for linea in mensaje.strip().split("\n")]
+    encabezado = lineas[0].lower()
+
+    if encabezado == "pedido:":
+        fecha_entrega = interpretar_fecha(lineas[2]) if len(lineas) >= 4 else None
+        if fecha_entrega is None or not lineas[1]:
+            return None
+
+        productos = []
+        for linea in lineas[3:]:
+            coincidencia = RE_LINEA_PRODUCTO.match(linea)
+            if not coincidencia:
+                return None
+            productos.append((int(coincidencia.group(1)), coincidencia.group(2)))
+
+        return {"tipo": "pedido", "cliente": lineas[1], "fecha_entrega": fecha_entrega, "lineas": productos}
+
+    if encabezado == "reporte:":
+        fecha_inicio, fecha_fin = interpretar_rango(lineas[1]) if len(lineas) == 2 else (None, None)
+        if fecha_inicio is None:
+            return None
+        return {"tipo": "reporte", "fecha_inicio": fecha_inicio, "fecha_fin": fecha_fin}
+
+    if encabezado.startswith("agregar articulo"):
+        return {"tipo": "agregar articulo"}
+
+    return None
+
 
 def verificar_intencion_y_formato(mensaje):
     """
@@ -8,7 +60,16 @@ def verificar_intencion_y_formato(mensaje):
     - Si la intención y el formato están correctos, devuelve "true".
     - Si la intención es correcta, pero el formato es incorrecto, devuelve el mensaje corregido.
     - Si la intención es incorrecta, devuelve "false".
+    Los mensajes que ya cumplen el formato se resuelven con `analizar_mensaje` sin llamar a la IA;
+    las respuestas de la IA se guardan en caché por texto normalizado.
     """
+    if analizar_mensaje(mensaje) is not None:
+        return "true"
+
+    clave = RE_ESPACIOS.sub(" ", mensaje.strip().lower())
+    respuesta = _respuestas_llm.obtener(clave)
+    if respuesta is not None:
+        return respuesta
 
     # 📌 Definir el prompt para la IA
     prompt = f"""
@@ -45,27 +106,34 @@ def verificar_intencion_y_formato(mensaje):
     """
 
     # 📌 Hacer el request a la API local
-    url = "http://localhost:11434/api/generate"
+    url = Config.LLM_URL
     payload = {
-        "model": "deepseek-r1:7b",
+        "model": Config.LLM_MODELO,
         "prompt": prompt,
         "stream": False,
         "format": "json"  # Para asegurar que la respuesta sea JSON
     }
 
+    # 📌 No saturar el modelo local: como máximo `LLM_CONCURRENCIA` consultas a la vez
+    if not _semaforo_llm.acquire(timeout=Config.LLM_TIMEOUT_SEGUNDOS):
+        return {"error": "Fallo en la API local: demasiadas consultas en curso"}
+
     try:
-        response = requests.post(url, json=payload)
+        response = solicitar("POST", url, reintentos=0, timeout=Config.LLM_TIMEOUT_SEGUNDOS, json=payload)
         response.raise_for_status()  # Lanza error si el request falla
         data = response.json()
 
         # 📌 Extraer la respuesta generada
         if "response" in data:
             resultado = data["response"].strip()
-            if resultado.lower() == "true" or resultado.lower() == "false":
-                return resultado
-            return resultado  # Devuelve el mensaje corregido si el formato estaba mal
-        
-        return "false"  # Si no se entiende el mensaje, devuelve falso
+        else:
+            resultado = "false"  # Si no se entiende el mensaje, devuelve falso
+
+        # Devuelve "true"/"false" o el mensaje corregido si el formato estaba mal
+        _respuestas_llm.guardar(clave, resultado)
+        return resultado
     
     except requests.RequestException as e:
         return {"error": f"Fallo en la API local: {str(e)}"}
+    finally:
+        _semaforo_llm.release()
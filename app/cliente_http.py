@@ -0,0 +1,110 @@
+import random
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+from app.config import Config
+
+# 📌 Respuestas de la Graph API que vale la pena reintentar
+ESTADOS_REINTENTABLES = {429, 500, 502, 503, 504}
+
+# 📌 Métodos que se pueden repetir sin efectos dobles. Un POST (p. ej. enviar un mensaje por /messages)
+# solo se reintenta si no llegó al servidor (error al conectar) o si este lo rechazó con 429:
+# tras un timeout de lectura o un 5xx, Graph pudo haberlo aceptado y el cliente recibiría el mensaje dos veces.
+METODOS_IDEMPOTENTES = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+_sesion = None
+_lock_sesion = threading.Lock()
+
+
+def obtener_sesion():
+    """
+    Devuelve la sesión HTTP compartida del proceso: reutiliza conexiones (keep-alive)
+    en lugar de hacer un handshake TLS por cada llamada.
+    """
+    global _sesion
+
+    with _lock_sesion:
+        if _sesion is None:
+            sesion = requests.Session()
+            adaptador = HTTPAdapter(pool_connections=Config.HTTP_POOL_CONEXIONES, pool_maxsize=Config.HTTP_POOL_MAX)
+            sesion.mount("https://", adaptador)
+            sesion.mount("http://", adaptador)
+            _sesion = sesion
+        return _sesion
+
+
+class LimitadorTasa:
+    """
+    Token bucket: permite `por_segundo` solicitudes en promedio con ráfagas de hasta `rafaga`.
+    `esperar()` bloquea el hilo lo necesario para respetar el límite.
+    """
+
+    def __init__(self, por_segundo, rafaga=None):
+        self.por_segundo = por_segundo
+        self.rafaga = rafaga or por_segundo
+        self._fichas = float(self.rafaga)
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def esperar(self):
+        while True:
+            with self._lock:
+                ahora = time.monotonic()
+                self._fichas = min(self.rafaga, self._fichas + (ahora - self._ultimo) * self.por_segundo)
+                self._ultimo = ahora
+
+                if self._fichas >= 1:
+                    self._fichas -= 1
+                    return
+                faltante = (1 - self._fichas) / self.por_segundo
+
+            time.sleep(faltante)
+
+
+def solicitar(metodo, url, limitador=None, reintentos=None, **kwargs):
+    """
+    Hace una solicitud HTTP con la sesión compartida, timeout por defecto y reintentos
+    con espera exponencial y jitter ante errores de red, 429 y 5xx (respeta `Retry-After`).
+    Los métodos no idempotentes (POST) solo se reintentan ante errores al conectar y 429.
+    Devuelve la última respuesta obtenida o lanza la última excepción de red.
+    """
+    kwargs.setdefault("timeout", (Config.HTTP_TIMEOUT_CONEXION, Config.HTTP_TIMEOUT_LECTURA))
+    reintentos = Config.HTTP_REINTENTOS if reintentos is None else reintentos
+    idempotente = metodo.upper() in METODOS_IDEMPOTENTES
+    sesion = obtener_sesion()
+
+    for intento in range(reintentos + 1):
+        if limitador:
+            limitador.esperar()
+
+        espera = None
+        try:
+            response = sesion.request(metodo, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if intento == reintentos or not (idempotente or _sin_enviar(e)):
+                raise
+        else:
+            reintentable = response.status_code in ESTADOS_REINTENTABLES if idempotente else response.status_code == 429
+            if not reintentable or intento == reintentos:
+                return response
+
+            retry_after = response.headers.get("Retry-After", "")
+            if retry_after.isdigit():
+                espera = min(float(retry_after), Config.HTTP_BACKOFF_MAX)
+            response.close()
+
+        if espera is None:
+            espera = random.uniform(0, min(Config.HTTP_BACKOFF_MAX, Config.HTTP_BACKOFF_BASE * 2 ** intento))
+        time.sleep(espera)
+
+
+def _sin_enviar(error):
+    """
+    True si la solicitud falló antes de llegar al servidor (no se pudo abrir la conexión).
+    """
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    causa = error.args[0] if error.args else None
+    return isinstance(getattr(causa, "reason", causa), NewConnectionError)
@@ -0,0 +1,376 @@
+import atexit
+import json
+import random
+import threading
+import time
+from app.almacen import conexion_local
+from app.config import Config
+from app.despachador import obtener_despachador
+
+# 📌 Cola persistente de webhooks: el mensaje se guarda en disco antes de responder 200 a Meta,
+# así un reinicio del proceso no pierde pedidos. Entrega "al menos una vez" con reintentos.
+# `registrado` indica que el mensaje ya pasó por `RegistrarWebhook`: los reintentos y los trabajos
+# liberados o recuperados tras una caída no vuelven a la deduplicación (los vería como repetidos).
+
+_tablas_creadas = False
+_lock_tablas = threading.Lock()
+_hay_trabajo = threading.Event()
+
+
+def _crear_tablas():
+    global _tablas_creadas
+
+    with _lock_tablas:
+        if _tablas_creadas:
+            return
+        conexion_local().executescript("""
+            CREATE TABLE IF NOT EXISTS cola_webhooks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                message_id TEXT NOT NULL UNIQUE,
+                telefono TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                estado TEXT NOT NULL DEFAULT 'pendiente',
+                intentos INTEGER NOT NULL DEFAULT 0,
+                disponible_en REAL NOT NULL,
+                creado_en REAL NOT NULL,
+                actualizado_en REAL NOT NULL,
+                error TEXT,
+                registrado INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS ix_cola_webhooks_estado ON cola_webhooks (estado, disponible_en);
+        """)
+        columnas = [fila[1] for fila in conexion_local().execute("PRAGMA table_info(cola_webhooks)")]
+        if "registrado" not in columnas:  # Almacenes creados antes de agregar la columna
+            conexion_local().execute("ALTER TABLE cola_webhooks ADD COLUMN registrado INTEGER NOT NULL DEFAULT 0")
+        _tablas_creadas = True
+
+
+def encolar(message_id, telefono, payload):
+    """
+    Guarda un webhook en la cola. Si ya existe un trabajo con el mismo `message_id`
+    (reenvío de Meta) no lo duplica. Devuelve True si se agregó un trabajo nuevo.
+    """
+    _crear_tablas()
+    ahora = time.time()
+
+    cursor = conexion_local().execute(
+        """
+        INSERT OR IGNORE INTO cola_webhooks (message_id, telefono, payload, disponible_en, creado_en, actualizado_en)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """,
+        (message_id, telefono, payload, ahora, ahora, ahora)
+    )
+
+    nuevo = cursor.rowcount > 0
+    if nuevo:
+        _hay_trabajo.set()
+    return nuevo
+
+
+def encolar_lote(trabajos):
+    """
+    Guarda varios webhooks [(message_id, telefono, payload)] en una sola transacción,
+    p. ej. todos los mensajes de una misma entrega de Meta. Devuelve cuántos trabajos nuevos se agregaron.
+    """
+    _crear_tablas()
+    conexion = conexion_local()
+    ahora = time.time()
+
+    conexion.execute("BEGIN IMMEDIATE")
+    try:
+        antes = conexion.total_changes
+        conexion.executemany(
+            """
+            INSERT OR IGNORE INTO cola_webhooks (message_id, telefono, payload, disponible_en, creado_en, actualizado_en)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            [(message_id, telefono, payload, ahora, ahora, ahora) for message_id, telefono, payload in trabajos]
+        )
+        nuevos = conexion.total_changes - antes
+        conexion.execute("COMMIT")
+    except Exception:
+        conexion.execute("ROLLBACK")
+        raise
+
+    if nuevos:
+        _hay_trabajo.set()
+    return nuevos
+
+
+def reclamar(limite):
+    """
+    Toma hasta `limite` trabajos listos (pendientes, o en proceso con el plazo vencido porque
+    su consumidor murió) y los marca en proceso por `Config.COLA_PLAZO_SEGUNDOS`.
+    No toma mensajes de un teléfono que ya tiene un trabajo en proceso, para que con varios procesos
+    consumiendo la misma cola los mensajes de un cliente se sigan atendiendo en orden.
+    """
+    _crear_tablas()
+    conexion = conexion_local()
+    ahora = time.time()
+
+    conexion.execute("BEGIN IMMEDIATE")  # Evita que dos procesos reclamen el mismo trabajo
+    try:
+        filas = conexion.execute(
+            """
+            SELECT id, message_id, telefono, payload, intentos, registrado FROM cola_webhooks
+            WHERE estado IN ('pendiente', 'en_proceso') AND disponible_en <= ?
+              AND telefono NOT IN (
+                  SELECT telefono FROM cola_webhooks WHERE estado = 'en_proceso' AND disponible_en > ?
+              )
+            ORDER BY id LIMIT ?
+            """,
+            (ahora, ahora, limite)
+        ).fetchall()
+
+        conexion.executemany(
+            """
+            UPDATE cola_webhooks SET estado = 'en_proceso', intentos = intentos + 1,
+                disponible_en = ?, actualizado_en = ?
+            WHERE id = ?
+            """,
+            [(ahora + Config.COLA_PLAZO_SEGUNDOS, ahora, fila[0]) for fila in filas]
+        )
+        conexion.execute("COMMIT")
+    except Exception:
+        conexion.execute("ROLLBACK")
+        raise
+
+    return [
+        {
+            "id": id_trabajo, "message_id": message_id, "telefono": telefono, "payload": payload,
+            "intento": intentos + 1, "registrado": bool(registrado)
+        }
+        for id_trabajo, message_id, telefono, payload, intentos, registrado in filas
+    ]
+
+
+def marcar_registrados(ids_trabajos):
+    """
+    Anota que los trabajos ya se registraron con `RegistrarWebhook`, para no volver a deduplicarlos.
+    """
+    conexion_local().executemany(
+        "UPDATE cola_webhooks SET registrado = 1 WHERE id = ?", [(id_trabajo,) for id_trabajo in ids_trabajos]
+    )
+
+
+def renovar(ids_trabajos):
+    """
+    Extiende por `Config.COLA_PLAZO_SEGUNDOS` el plazo de trabajos que este proceso todavía tiene
+    (esperando en el despachador o ejecutándose), para que ningún consumidor los reclame otra vez.
+    """
+    if not ids_trabajos:
+        return
+    conexion = conexion_local()
+    ahora = time.time()
+
+    conexion.execute("BEGIN IMMEDIATE")
+    try:
+        conexion.executemany(
+            "UPDATE cola_webhooks SET disponible_en = ?, actualizado_en = ? WHERE id = ? AND estado = 'en_proceso'",
+            [(ahora + Config.COLA_PLAZO_SEGUNDOS, ahora, id_trabajo) for id_trabajo in ids_trabajos]
+        )
+        conexion.execute("COMMIT")
+    except Exception:
+        conexion.execute("ROLLBACK")
+        raise
+
+
+def completar(id_trabajo):
+    """
+    Marca un trabajo como terminado. Se conserva un tiempo para ignorar reenvíos del mismo mensaje.
+    """
+    conexion_local().execute(
+        "UPDATE cola_webhooks SET estado = 'hecho', error = NULL, actualizado_en = ? WHERE id = ?",
+        (time.time(), id_trabajo)
+    )
+    _hay_trabajo.set()  # Puede haber mensajes del mismo teléfono esperando a que este termine
+
+
+def reintentar(trabajo, error):
+    """
+    Reprograma un trabajo fallido con espera exponencial y jitter, o lo marca como 'fallido'
+    si ya agotó `Config.COLA_MAX_INTENTOS`.
+    """
+    ahora = time.time()
+
+    if trabajo["intento"] >= Config.COLA_MAX_INTENTOS:
+        estado, disponible_en = "fallido", ahora
+        print(f"❌ Mensaje {trabajo['message_id']} descartado tras {trabajo['intento']} intentos: {error}")
+    else:
+        espera = min(Config.COLA_BACKOFF_MAX, Config.COLA_BACKOFF_BASE * 2 ** (trabajo["intento"] - 1))
+        estado, disponible_en = "pendiente", ahora + random.uniform(espera / 2, espera)
+
+    conexion_local().execute(
+        "UPDATE cola_webhooks SET estado = ?, disponible_en = ?, actualizado_en = ?, error = ? WHERE id = ?",
+        (estado, disponible_en, ahora, str(error), trabajo["id"])
+    )
+    _hay_trabajo.set()
+
+
+def liberar(id_trabajo):
+    """
+    Devuelve un trabajo reclamado a la cola sin contarlo como intento (p. ej. despachador lleno).
+    """
+    conexion_local().execute(
+        """
+        UPDATE cola_webhooks SET estado = 'pendiente', intentos = intentos - 1,
+            disponible_en = ?, actualizado_en = ?
+        WHERE id = ?
+        """,
+        (time.time(), time.time(), id_trabajo)
+    )
+
+
+def purgar(antiguedad_segundos):
+    """
+    Elimina los trabajos terminados o fallidos más viejos que `antiguedad_segundos`.
+    """
+    conexion_local().execute(
+        "DELETE FROM cola_webhooks WHERE estado IN ('hecho', 'fallido') AND actualizado_en < ?",
+        (time.time() - antiguedad_segundos,)
+    )
+
+
+def metricas_cola():
+    """
+    Cantidad de trabajos por estado.
+    """
+    _crear_tablas()
+    filas = conexion_local().execute("SELECT estado, COUNT(*) FROM cola_webhooks GROUP BY estado").fetchall()
+
+    metricas = {"pendiente": 0, "en_proceso": 0, "hecho": 0, "fallido": 0}
+    metricas.update(dict(filas))
+    return metricas
+
+
+class ConsumidorCola:
+    """
+    Hilo que vacía la cola por lotes y entrega cada trabajo al despachador
+    (un hilo por remitente). El trabajo se marca como hecho solo cuando `procesar` termina sin error.
+    Si se indica `registrar`, se llama una vez por lote con los payloads reclamados que aún no se registraron
+    y debe devolver, alineado con ellos, si cada mensaje es nuevo (o la excepción si no se pudo registrar
+    ese mensaje, que se reintenta solo); los repetidos se completan sin pasar por el despachador.
+    Los ya registrados (reintentos, trabajos liberados) se despachan directamente.
+    El plazo de los trabajos despachados se renueva mientras esperan en el despachador o se ejecutan,
+    así una espera larga (o una llamada lenta a Graph) no hace que otro consumidor los vuelva a tomar.
+    """
+
+    def __init__(self, procesar, registrar=None):
+        self._procesar = procesar
+        self._registrar = registrar
+        self._detener = threading.Event()
+        self._hilo = None
+        self._ultima_purga = 0.0
+        self._en_curso = set()  # IDs despachados que aún no terminan
+        self._lock_en_curso = threading.Lock()
+        self._ultima_renovacion = 0.0
+
+    def iniciar(self):
+        self._hilo = threading.Thread(target=self._ciclo, name="consumidor-cola", daemon=True)
+        self._hilo.start()
+
+    def detener(self, timeout=None):
+        self._detener.set()
+        _hay_trabajo.set()
+        if self._hilo:
+            self._hilo.join(timeout)
+
+    def _ciclo(self):
+        despachador = obtener_despachador()
+
+        while not self._detener.is_set():
+            _hay_trabajo.clear()
+            trabajos = []
+            try:
+                self._renovar_en_curso()
+                with self._lock_en_curso:
+                    # Por si el plazo venció antes de renovarlo: lo que sigue en el despachador no se despacha de nuevo
+                    trabajos = [trabajo for trabajo in reclamar(Config.COLA_LOTE) if trabajo["id"] not in self._en_curso]
+
+                for trabajo in self._registrar_lote(trabajos):
+                    with self._lock_en_curso:
+                        self._en_curso.add(trabajo["id"])
+                    if not despachador.enviar(trabajo["telefono"], self._ejecutar, trabajo, timeout=Config.WEBHOOK_ENCOLAR_TIMEOUT):
+                        with self._lock_en_curso:
+                            self._en_curso.discard(trabajo["id"])
+                        liberar(trabajo["id"])
+
+                if time.time() - self._ultima_purga > 3600:
+                    purgar(Config.COLA_RETENCION_HORAS * 3600)
+                    self._ultima_purga = time.time()
+            except Exception as e:
+                print(f"⚠️ Error en el consumidor de la cola de webhooks: {e}")
+
+            if len(trabajos) < Config.COLA_LOTE:
+                # Esperar a que llegue algo nuevo (o a que venza algún reintento)
+                _hay_trabajo.wait(Config.COLA_INTERVALO_SEGUNDOS)
+
+    def _registrar_lote(self, trabajos):
+        """
+        Registra con una sola llamada a `registrar` los trabajos del lote que aún no se registraron
+        y devuelve, en el orden del lote, los trabajos a despachar.
+        """
+        por_registrar = [trabajo for trabajo in trabajos if not trabajo["registrado"]]
+        if not por_registrar or self._registrar is None:
+            return trabajos
+
+        try:
+            nuevos = self._registrar([json.loads(trabajo["payload"]) for trabajo in por_registrar])
+        except Exception as e:
+            print(f"⚠️ No se pudo registrar el lote de {len(por_registrar)} mensajes: {e}")
+            for trabajo in por_registrar:
+                reintentar(trabajo, e)
+            return [trabajo for trabajo in trabajos if trabajo["registrado"]]
+
+        descartados = set()
+        for trabajo, nuevo in zip(por_registrar, nuevos):
+            if isinstance(nuevo, Exception):
+                descartados.add(trabajo["id"])
+                reintentar(trabajo, nuevo)
+            elif nuevo:
+                trabajo["registrado"] = True
+            else:
+                descartados.add(trabajo["id"])
+                completar(trabajo["id"])
+        marcar_registrados([trabajo["id"] for trabajo in por_registrar if trabajo["registrado"]])
+
+        return [trabajo for trabajo in trabajos if trabajo["id"] not in descartados]
+
+    def _renovar_en_curso(self):
+        if time.time() - self._ultima_renovacion < Config.COLA_PLAZO_SEGUNDOS / 3:
+            return
+        with self._lock_en_curso:
+            ids_trabajos = list(self._en_curso)
+        renovar(ids_trabajos)
+        self._ultima_renovacion = time.time()
+
+    def _ejecutar(self, trabajo):
+        try:
+            self._procesar(json.loads(trabajo["payload"]))
+        except Exception as e:
+            reintentar(trabajo, e)
+        else:
+            completar(trabajo["id"])
+        finally:
+            with self._lock_en_curso:
+                self._en_curso.discard(trabajo["id"])
+
+
+_consumidor = None
+_lock_consumidor = threading.Lock()
+
+
+def iniciar_consumidor(procesar, registrar=None):
+    """
+    Arranca (una sola vez por proceso) el hilo que consume la cola con la función `procesar`
+    y, opcionalmente, la función `registrar` que se aplica a cada lote antes de despacharlo.
+    """
+    global _consumidor
+
+    with _lock_consumidor:
+        if _consumidor is None:
+            obtener_despachador()  # Se crea antes para que al salir se detenga el consumidor primero
+            _consumidor = ConsumidorCola(procesar, registrar)
+            _consumidor.iniciar()
+            atexit.register(_consumidor.detener, Config.WEBHOOK_APAGADO_TIMEOUT)
+        return _consumidor
@@ -13,11 +13,109 @@ class Config:
     DB_PASSWORD = os.getenv("DB_PASSWORD", "Chismosear01")
     DB_NAME = os.getenv("DB_NAME", "facturas_monrachem")
 
+    # Pool de conexiones MySQL
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))  # Máximo de conexiones abiertas
+    DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 5))  # Segundos esperando una conexión libre
+    DB_POOL_VERIFICAR_SEGUNDOS = float(os.getenv("DB_POOL_VERIFICAR_SEGUNDOS", 30))  # Inactividad antes de hacer ping
+
     # WhatsApp API
     WHATSAPP_API_TOKEN = os.getenv("WHATSAPP_API_TOKEN")
     WHATSAPP_PHONE_NUMBER_ID = os.getenv("WHATSAPP_PHONE_NUMBER_ID")
+    WHATSAPP_APP_SECRET = os.getenv("WHATSAPP_APP_SECRET")  # Valida X-Hub-Signature-256 (sin valor no se valida)
+    WHATSAPP_MENSAJES_POR_SEGUNDO = float(os.getenv("WHATSAPP_MENSAJES_POR_SEGUNDO", 80))  # Límite de Meta por número
+    WHATSAPP_ENVIOS_CONCURRENTES = int(os.getenv("WHATSAPP_ENVIOS_CONCURRENTES", 8))
+    WHATSAPP_MAX_CARACTERES = int(os.getenv("WHATSAPP_MAX_CARACTERES", 4096))  # Límite del cuerpo de un mensaje
+
+    # Cliente HTTP saliente (Graph API)
+    HTTP_POOL_CONEXIONES = int(os.getenv("HTTP_POOL_CONEXIONES", 4))  # Hosts distintos en el pool
+    HTTP_POOL_MAX = int(os.getenv("HTTP_POOL_MAX", 20))  # Conexiones keep-alive por host
+    HTTP_TIMEOUT_CONEXION = float(os.getenv("HTTP_TIMEOUT_CONEXION", 5))
+    HTTP_TIMEOUT_LECTURA = float(os.getenv("HTTP_TIMEOUT_LECTURA", 30))
+    HTTP_REINTENTOS = int(os.getenv("HTTP_REINTENTOS", 3))
+    HTTP_BACKOFF_BASE = float(os.getenv("HTTP_BACKOFF_BASE", 0.5))  # Segundos, se duplica en cada intento
+    HTTP_BACKOFF_MAX = float(os.getenv("HTTP_BACKOFF_MAX", 10))
 
     # Puerto de la aplicación
     FLASK_RUN_PORT = int(os.getenv("FLASK_RUN_PORT", 80))  # Cambiar 5000 a 80 como default
 
+    # Servidor de producción (serve.py, gunicorn con la app precargada)
+    SERVIDOR_MODO = os.getenv("SERVIDOR_MODO", "wsgi")  # "wsgi" (Flask) o "asgi" (webhook asíncrono con uvicorn)
+    SERVIDOR_WORKERS = int(os.getenv("SERVIDOR_WORKERS", 4))  # Procesos; cada uno tiene su pool MySQL y sus hilos
+    SERVIDOR_HILOS = int(os.getenv("SERVIDOR_HILOS", 8))  # Hilos por proceso en modo wsgi
+    SERVIDOR_TIMEOUT = int(os.getenv("SERVIDOR_TIMEOUT", 30))  # Segundos antes de reiniciar un worker colgado
+    SERVIDOR_KEEPALIVE = int(os.getenv("SERVIDOR_KEEPALIVE", 5))
+
     OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+
+    # Modelo local (Ollama) para corregir mensajes mal formados
+    LLM_URL = os.getenv("LLM_URL", "http://localhost:11434/api/generate")
+    LLM_MODELO = os.getenv("LLM_MODELO", "deepseek-r1:7b")
+    LLM_TIMEOUT_SEGUNDOS = float(os.getenv("LLM_TIMEOUT_SEGUNDOS", 30))
+    LLM_CONCURRENCIA = int(os.getenv("LLM_CONCURRENCIA", 2))  # Consultas simultáneas al modelo
+    LLM_CACHE_MAX = int(os.getenv("LLM_CACHE_MAX", 1000))
+    LLM_CACHE_TTL_SEGUNDOS = float(os.getenv("LLM_CACHE_TTL_SEGUNDOS", 3600))
+
+    # Procesamiento de webhooks
+    WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", 8))  # Hilos que procesan mensajes
+    WEBHOOK_COLA_MAX = int(os.getenv("WEBHOOK_COLA_MAX", 1000))  # Mensajes pendientes como máximo
+    WEBHOOK_ENCOLAR_TIMEOUT = float(os.getenv("WEBHOOK_ENCOLAR_TIMEOUT", 1))  # Segundos antes de responder 503
+    WEBHOOK_APAGADO_TIMEOUT = float(os.getenv("WEBHOOK_APAGADO_TIMEOUT", 30))  # Espera máxima al apagar
+    WEBHOOK_MAX_BYTES = int(os.getenv("WEBHOOK_MAX_BYTES", 1024 * 1024))  # Cuerpo máximo aceptado por /webhook
+
+    # Archivos locales (documentos descargados, almacén SQLite)
+    DATA_DIR = os.getenv("DATA_DIR", "C:\\temp" if os.name == "nt" else "/mnt/data")
+    ALMACEN_LOCAL_PATH = os.getenv("ALMACEN_LOCAL_PATH", os.path.join(DATA_DIR, "almacen_local.db"))
+
+    # Importación de artículos desde Excel
+    IMPORTACION_MAX_BYTES = int(os.getenv("IMPORTACION_MAX_BYTES", 20 * 1024 * 1024))  # Tamaño máximo del archivo
+    IMPORTACION_LOTE = int(os.getenv("IMPORTACION_LOTE", 1000))  # Filas leídas por bloque
+
+    # Resumen diario de pedidos por artículo
+    REPORTE_HOY_REFRESCO_SEGUNDOS = float(os.getenv("REPORTE_HOY_REFRESCO_SEGUNDOS", 300))  # Resincronizar el día actual
+    REPORTE_CACHE_MAX = int(os.getenv("REPORTE_CACHE_MAX", 256))  # Reportes generados en caché (por rango)
+    REPORTE_MAX_LINEAS_TEXTO = int(os.getenv("REPORTE_MAX_LINEAS_TEXTO", 200))  # Más artículos: se envía como CSV
+
+    # Cola persistente de webhooks
+    COLA_LOTE = int(os.getenv("COLA_LOTE", 50))  # Trabajos reclamados por vuelta
+    COLA_PLAZO_SEGUNDOS = float(os.getenv("COLA_PLAZO_SEGUNDOS", 300))  # Tiempo antes de reintentar un trabajo colgado
+    COLA_MAX_INTENTOS = int(os.getenv("COLA_MAX_INTENTOS", 5))
+    COLA_BACKOFF_BASE = float(os.getenv("COLA_BACKOFF_BASE", 2))  # Segundos, se duplica en cada intento
+    COLA_BACKOFF_MAX = float(os.getenv("COLA_BACKOFF_MAX", 300))
+    COLA_INTERVALO_SEGUNDOS = float(os.getenv("COLA_INTERVALO_SEGUNDOS", 1))  # Espera cuando la cola está vacía
+    COLA_RETENCION_HORAS = float(os.getenv("COLA_RETENCION_HORAS", 72))  # Historial para ignorar reenvíos
+
+    # Confirmación de facturas: se arma en memoria; con 1 además se relee con ObtenerFacturaCompleta y se compara
+    FACTURA_VERIFICAR_BD = os.getenv("FACTURA_VERIFICAR_BD", "0") == "1"
+
+    # Caché compartida entre procesos y nodos: IDs de webhooks, catálogo y avisos de cambios
+    CACHE_BACKEND = os.getenv("CACHE_BACKEND", "local")  # "local" (un solo proceso) o "redis"
+    REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+    CACHE_PREFIJO = os.getenv("CACHE_PREFIJO", "facturas:")  # Prefijo de las claves y del canal de avisos
+    CACHE_TIMEOUT_SEGUNDOS = float(os.getenv("CACHE_TIMEOUT_SEGUNDOS", 2))
+
+    # Caché de IDs de mensajes ya registrados (antes de llamar a RegistrarWebhook)
+    DEDUP_MAX_IDS = int(os.getenv("DEDUP_MAX_IDS", 50000))
+    DEDUP_TTL_SEGUNDOS = float(os.getenv("DEDUP_TTL_SEGUNDOS", 24 * 3600))
+    DEDUP_RESERVA_SEGUNDOS = float(os.getenv("DEDUP_RESERVA_SEGUNDOS", 15))  # Mientras otro nodo lo registra
+
+    # Caché del catálogo de productos (segundos, 0 = sin expiración)
+    CATALOGO_TTL_SEGUNDOS = int(os.getenv("CATALOGO_TTL_SEGUNDOS", 600))
+
+    # Caché del índice de clientes (segundos, 0 = sin expiración)
+    CLIENTES_TTL_SEGUNDOS = int(os.getenv("CLIENTES_TTL_SEGUNDOS", 3600))
+
+    # Métricas de Prometheus en /metrics (0 = no se registra ni se expone nada)
+    METRICAS_ACTIVAS = os.getenv("METRICAS_ACTIVAS", "1") == "1"
+    METRICAS_DIR = os.getenv("METRICAS_DIR", os.path.join(DATA_DIR, "metricas"))  # Volcados de cada worker (serve.py)
+    METRICAS_VOLCADO_SEGUNDOS = float(os.getenv("METRICAS_VOLCADO_SEGUNDOS", 5))
+
+    # Hilos para la coincidencia difusa por lotes (-1 = todos los núcleos)
+    MATCH_WORKERS = int(os.getenv("MATCH_WORKERS", -1))
+
+    # Prefiltro por trigramas: con catálogos grandes solo se puntúan los productos que comparten más trigramas
+    MATCH_PREFILTRO_MIN_PRODUCTOS = int(os.getenv("MATCH_PREFILTRO_MIN_PRODUCTOS", 5000))  # Menos: se recorre todo
+    MATCH_CANDIDATOS = int(os.getenv("MATCH_CANDIDATOS", 200))  # Candidatos por línea del pedido
+
+    # Alias aprendidos (texto del cliente -> producto/cliente), consultados antes de la búsqueda difusa
+    ALIAS_SIMILITUD_MIN = float(os.getenv("ALIAS_SIMILITUD_MIN", 95))  # Similitud mínima para aprender un alias
+    ALIAS_TTL_SEGUNDOS = float(os.getenv("ALIAS_TTL_SEGUNDOS", 300))  # Recarga para ver alias de otros procesos
@@ -1,5 +1,14 @@
 import mysql.connector
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from mysql.connector.errors import PoolError, InterfaceError, OperationalError
 from app.config import Config
+from app.metricas import contar, medir, observar
+
+# 📌 Errores de la conexión (no de los datos): reintentar de a uno no ayuda
+ERRORES_CONEXION = (PoolError, InterfaceError, OperationalError)
 
 def get_db_connection():
     try:
@@ -14,27 +23,231 @@ def get_db_connection():
         print(f"Error de conexión a MySQL: {err}")
         return None
 
-def ejecutar_sp(nombre_sp, parametros):
+
+class PoolConexiones:
     """
-    Ejecuta un procedimiento almacenado en MySQL.
+    Pool acotado de conexiones MySQL reutilizables.
+    - Nunca abre más de `tamano` conexiones a la vez.
+    - Si todas están ocupadas espera hasta `timeout` segundos y luego lanza `PoolError`.
+    - Verifica con un ping las conexiones que llevan más de `verificar_despues` segundos sin usarse.
+    - Las conexiones siempre vuelven al pool (o se descartan si quedaron dañadas), aunque haya errores.
     """
-    conexion = get_db_connection()
-    if not conexion:
-        return None
 
+    def __init__(self, tamano, timeout, verificar_despues):
+        self.tamano = tamano
+        self.timeout = timeout
+        self.verificar_despues = verificar_despues
+
+        self._libres = deque()  # [(conexion, momento en que se devolvió)]
+        self._condicion = threading.Condition()
+        self._abiertas = 0
+        self._en_uso = 0
+        self._esperando = 0
+        self._total_creadas = 0
+        self._total_descartadas = 0
+        self._total_timeouts = 0
+
+    def obtener(self):
+        """
+        Saca una conexión del pool (o abre una nueva si aún hay cupo).
+        """
+        limite = time.monotonic() + self.timeout
+        conexion = None
+        devuelta_en = None
+
+        with self._condicion:
+            while True:
+                if self._libres:
+                    conexion, devuelta_en = self._libres.pop()
+                    break
+                if self._abiertas < self.tamano:
+                    self._abiertas += 1  # Reservar el cupo antes de conectar fuera del lock
+                    break
+
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    self._total_timeouts += 1
+                    raise PoolError(f"No hay conexiones libres tras esperar {self.timeout}s")
+
+                self._esperando += 1
+                try:
+                    self._condicion.wait(restante)
+                finally:
+                    self._esperando -= 1
+
+            self._en_uso += 1
+
+        try:
+            if conexion is not None and time.monotonic() - devuelta_en > self.verificar_despues:
+                if not self._esta_sana(conexion):
+                    self._cerrar(conexion)
+                    with self._condicion:
+                        self._total_descartadas += 1
+                    conexion = None
+
+            if conexion is None:
+                conexion = self._crear()
+
+            return conexion
+        except Exception:
+            with self._condicion:
+                self._abiertas -= 1
+                self._en_uso -= 1
+                self._condicion.notify()
+            raise
+
+    def devolver(self, conexion, con_error=False):
+        """
+        Regresa una conexión al pool. Si hubo un error se deshace la transacción pendiente;
+        si la conexión no responde se descarta y se libera su cupo.
+        """
+        sana = True
+        if con_error:
+            try:
+                conexion.rollback()
+            except Exception:
+                sana = False
+
+        with self._condicion:
+            self._en_uso -= 1
+            if sana:
+                self._libres.append((conexion, time.monotonic()))
+            else:
+                self._abiertas -= 1
+                self._total_descartadas += 1
+            self._condicion.notify()
+
+        if not sana:
+            self._cerrar(conexion)
+
+    def metricas(self):
+        """
+        Estado del pool para dimensionarlo en producción.
+        """
+        with self._condicion:
+            return {
+                "tamano": self.tamano,
+                "abiertas": self._abiertas,
+                "en_uso": self._en_uso,
+                "libres": len(self._libres),
+                "esperando": self._esperando,
+                "creadas": self._total_creadas,
+                "descartadas": self._total_descartadas,
+                "timeouts": self._total_timeouts
+            }
+
+    def _crear(self):
+        conexion = get_db_connection()
+        if not conexion:
+            raise mysql.connector.Error("No hay conexión a MySQL")
+
+        with self._condicion:
+            self._total_creadas += 1
+        return conexion
+
+    @staticmethod
+    def _esta_sana(conexion):
+        try:
+            conexion.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _cerrar(conexion):
+        try:
+            conexion.close()
+        except Exception:
+            pass
+
+
+_pool = None
+_lock_pool = threading.Lock()
+
+
+def obtener_pool():
+    """
+    Devuelve el pool de conexiones del proceso, creándolo con los valores de `Config` la primera vez.
+    """
+    global _pool
+
+    with _lock_pool:
+        if _pool is None:
+            _pool = PoolConexiones(Config.DB_POOL_SIZE, Config.DB_POOL_TIMEOUT, Config.DB_POOL_VERIFICAR_SEGUNDOS)
+        return _pool
+
+
+def metricas_pool():
+    """
+    Métricas del pool de conexiones (en uso, esperando, creadas, ...).
+    """
+    return obtener_pool().metricas()
+
+
+@contextmanager
+def conexion_db():
+    """
+    Presta una conexión del pool durante el bloque y la devuelve siempre al terminar.
+    """
+    pool = obtener_pool()
+    inicio = time.perf_counter()
+    conexion = pool.obtener()
+    observar("db_pool_espera_segundos", time.perf_counter() - inicio)
     try:
-        cursor = conexion.cursor()
-        cursor.callproc(nombre_sp, parametros)
-        
-        resultados = []
-        for resultado in cursor.stored_results():
-            resultados.append(resultado.fetchall())
+        yield conexion
+    except Exception:
+        pool.devolver(conexion, con_error=True)
+        raise
+    else:
+        pool.devolver(conexion)
 
-        conexion.commit()
-        cursor.close()
-        conexion.close()
+
+def ejecutar_sp(nombre_sp, parametros):
+    """
+    Ejecuta un procedimiento almacenado en MySQL usando una conexión del pool.
+    """
+    try:
+        with conexion_db() as conexion, medir("db_sp_duracion_segundos", sp=nombre_sp):
+            cursor = conexion.cursor()
+            try:
+                cursor.callproc(nombre_sp, parametros)
+
+                resultados = []
+                for resultado in cursor.stored_results():
+                    resultados.append(resultado.fetchall())
+
+                conexion.commit()
+            finally:
+                cursor.close()
 
         return resultados
     except mysql.connector.Error as err:
+        contar("db_sp_errores_total", sp=nombre_sp)
         print(f"Error ejecutando {nombre_sp}: {err}")
         return None
+
+@contextmanager
+def transaccion():
+    """
+    Toma una conexión del pool y abre una transacción para ejecutar varios procedimientos con `llamar_sp`.
+    Hace commit una sola vez al terminar el bloque, o rollback si ocurre cualquier error,
+    para no dejar datos a medias (p. ej. una factura sin todas sus líneas).
+    """
+    with conexion_db() as conexion:
+        cursor = conexion.cursor()
+        try:
+            conexion.start_transaction()
+            yield cursor
+            conexion.commit()
+        finally:
+            cursor.close()
+
+
+def llamar_sp(cursor, nombre_sp, parametros):
+    """
+    Ejecuta un procedimiento almacenado dentro de una transacción abierta con `transaccion()`.
+    Devuelve los result sets igual que `ejecutar_sp`, pero sin hacer commit.
+    """
+    with medir("db_sp_duracion_segundos", sp=nombre_sp):
+        cursor.callproc(nombre_sp, parametros)
+        return [resultado.fetchall() for resultado in cursor.stored_results()]
@@ -0,0 +1,153 @@
+import atexit
+import queue
+import threading
+import time
+import zlib
+from app.config import Config
+
+
+class Despachador:
+    """
+    Pool acotado de hilos para procesar los webhooks fuera del request.
+    - Cada clave (número de teléfono) va siempre al mismo hilo, así los mensajes
+      de un mismo cliente se procesan en el orden en que llegaron.
+    - Cada hilo tiene una cola con capacidad máxima: si está llena, `enviar` devuelve False
+      para que el webhook responda con error y Meta reintente más tarde (backpressure).
+    """
+
+    def __init__(self, workers, capacidad_por_worker):
+        self._colas = [queue.Queue(maxsize=capacidad_por_worker) for _ in range(workers)]
+        self._hilos = []
+        self._lock = threading.Lock()
+        self._detenido = False
+
+        self._en_proceso = 0
+        self._procesados = 0
+        self._errores = 0
+        self._rechazados = 0
+        self._espera_total = 0.0
+        self._espera_max = 0.0
+        self._proceso_total = 0.0
+        self._proceso_max = 0.0
+
+    def iniciar(self):
+        for numero, cola in enumerate(self._colas):
+            hilo = threading.Thread(
+                target=self._trabajar, args=(cola,), name=f"despachador-{numero}", daemon=True
+            )
+            hilo.start()
+            self._hilos.append(hilo)
+
+    def enviar(self, clave, funcion, *args, timeout=None):
+        """
+        Encola `funcion(*args)` en el hilo asignado a `clave`.
+        Devuelve False si la cola sigue llena después de `timeout` segundos o si el despachador se detuvo.
+        """
+        if self._detenido:
+            return False
+
+        cola = self._colas[zlib.crc32(str(clave).encode()) % len(self._colas)]
+        try:
+            cola.put((funcion, args, time.monotonic()), timeout=timeout)
+            return True
+        except queue.Full:
+            with self._lock:
+                self._rechazados += 1
+            return False
+
+    def detener(self, timeout=None):
+        """
+        Deja de aceptar trabajo, termina lo que ya está en cola y espera a los hilos,
+        todo dentro de `timeout` segundos en total (None = sin límite).
+        Si una cola sigue llena al vencer el plazo, lo pendiente se abandona: los hilos son daemon
+        y los trabajos de la cola persistente se vuelven a reclamar cuando vence su plazo.
+        """
+        if self._detenido:
+            return
+        self._detenido = True
+        limite = None if timeout is None else time.monotonic() + timeout
+
+        for cola in self._colas:
+            try:
+                cola.put(None, timeout=_restante(limite))  # Marca de fin, se procesa después de lo pendiente
+            except queue.Full:
+                print("⚠️ Cola del despachador llena al apagar, se abandonan sus trabajos pendientes")
+        for hilo in self._hilos:
+            hilo.join(_restante(limite))
+
+    def metricas(self):
+        """
+        Profundidad de las colas y tiempos de espera/proceso acumulados.
+        """
+        with self._lock:
+            return {
+                "workers": len(self._colas),
+                "en_cola": sum(cola.qsize() for cola in self._colas),
+                "en_proceso": self._en_proceso,
+                "procesados": self._procesados,
+                "errores": self._errores,
+                "rechazados": self._rechazados,
+                "espera_promedio": self._espera_total / self._procesados if self._procesados else 0.0,
+                "espera_max": self._espera_max,
+                "proceso_promedio": self._proceso_total / self._procesados if self._procesados else 0.0,
+                "proceso_max": self._proceso_max
+            }
+
+    def _trabajar(self, cola):
+        while True:
+            tarea = cola.get()
+            if tarea is None:
+                break
+
+            funcion, args, encolado_en = tarea
+            inicio = time.monotonic()
+            with self._lock:
+                self._en_proceso += 1
+
+            error = False
+            try:
+                funcion(*args)
+            except Exception as e:
+                error = True
+                print(f"⚠️ Error en el despachador: {e}")
+            finally:
+                fin = time.monotonic()
+                with self._lock:
+                    self._en_proceso -= 1
+                    self._procesados += 1
+                    self._errores += error
+                    self._espera_total += inicio - encolado_en
+                    self._espera_max = max(self._espera_max, inicio - encolado_en)
+                    self._proceso_total += fin - inicio
+                    self._proceso_max = max(self._proceso_max, fin - inicio)
+
+
+def _restante(limite):
+    return None if limite is None else max(0.0, limite - time.monotonic())
+
+
+_despachador = None
+_lock_despachador = threading.Lock()
+
+
+def obtener_despachador():
+    """
+    Devuelve el despachador del proceso, creándolo e iniciándolo con los valores de `Config` la primera vez.
+    """
+    global _despachador
+
+    with _lock_despachador:
+        if _despachador is None:
+            workers = max(1, Config.WEBHOOK_WORKERS)
+            capacidad = max(1, -(-Config.WEBHOOK_COLA_MAX // workers))  # Capacidad total repartida entre hilos
+            _despachador = Despachador(workers, capacidad)
+            _despachador.iniciar()
+            atexit.register(_despachador.detener, Config.WEBHOOK_APAGADO_TIMEOUT)
+        return _despachador
+
+
+def metricas_despachador():
+    """
+    Métricas del despachador de webhooks (profundidad de cola y latencias).
+    """
+    return obtener_despachador().metricas()
@@ -0,0 +1,52 @@
+from app import fechas
+
+
+class Factura:
+    """
+    Factura armada en memoria mientras se procesa un pedido: cliente, tipo, fechas y líneas
+    con el precio ya elegido. Calcula su total y arma el mensaje de WhatsApp sin volver a
+    leer la factura de la base de datos.
+    """
+
+    def __init__(self, id_cliente, nombre_cliente, fecha_entrega, es_mayorista, telefono_cliente=None, fecha=None):
+        self.id_factura = None  # Se asigna al registrarla
+        self.id_cliente = id_cliente
+        self.nombre_cliente = nombre_cliente
+        self.telefono_cliente = telefono_cliente
+        self.fecha = fecha or fechas.reloj()
+        self.fecha_entrega = fecha_entrega
+        self.es_mayorista = es_mayorista
+        self.lineas = []  # [(idProducto, nombre, cantidad, precio)]
+
+    def tipo(self):
+        return "Mayorista" if self.es_mayorista else "Institucional"
+
+    def agregar_linea(self, id_producto, nombre_producto, cantidad, precio):
+        self.lineas.append((id_producto, nombre_producto, cantidad, precio))
+
+    def lineas_para_registrar(self):
+        """
+        Líneas [(idProducto, cantidad, precio)] en el formato de `registrar_factura`.
+        """
+        return [(id_producto, cantidad, precio) for id_producto, _, cantidad, precio in self.lineas]
+
+    def total(self):
+        return sum(cantidad * precio for _, _, cantidad, precio in self.lineas)
+
+    def como_mensaje(self):
+        """
+        Mensaje de confirmación con el mismo formato que el de 'ObtenerFacturaCompleta'.
+        Si no se conoce el teléfono del cliente se omite esa línea.
+        """
+        mensaje = f"🧾 Factura #{self.id_factura}\n"
+        mensaje += f"👤 Cliente: {self.nombre_cliente}\n"
+        if self.telefono_cliente:
+            mensaje += f"📞 Teléfono: {self.telefono_cliente}\n"
+        mensaje += f"📅 Fecha: {self.fecha}\n🚚 Entrega: {self.fecha_entrega}\n"
+        mensaje += f"🛒 Tipo: {self.tipo()}\n"
+        mensaje += "📦 Detalle:\n"
+        for _, nombre_producto, cantidad, precio in self.lineas:
+            mensaje += f"- {cantidad}x {nombre_producto} (₡{precio} c/u) = ₡{cantidad * precio}\n"
+
+        mensaje += f"\n💰 Total: ₡{self.total()}"
+        return mensaje
@@ -0,0 +1,90 @@
+import re
+from datetime import date, timedelta
+
+# 📌 Expresiones de fecha compiladas una sola vez
+RE_FECHA = re.compile(r"^(\d{1,2})/(\d{1,2})(?:/(\d{4}|\d{2}))?$")
+RE_DIAS = re.compile(r"^\d+$")
+RE_RANGO = re.compile(r"^(.+?)\s+(?:a|al|hasta)\s+(.+)$")
+RE_ESPACIOS = re.compile(r"\s+")
+
+# Reloj por defecto; las funciones aceptan `hoy` para pruebas, reprocesos y benchmarks deterministas
+reloj = date.today
+
+
+def _normalizar(texto):
+    return RE_ESPACIOS.sub(" ", texto.strip().lower())
+
+
+def interpretar_fecha(texto, hoy=None):
+    """
+    Convierte una fecha escrita por el usuario en un `date`, o None si no se entiende.
+    Acepta "hoy", "ayer", "mañana", "dd/mm", "dd/mm/aa" y "dd/mm/aaaa" (sin año se usa el año actual).
+    """
+    hoy = hoy or reloj()
+    texto = _normalizar(texto)
+
+    if texto == "hoy":
+        return hoy
+    if texto == "ayer":
+        return hoy - timedelta(days=1)
+    if texto in ("mañana", "manana"):
+        return hoy + timedelta(days=1)
+
+    coincidencia = RE_FECHA.match(texto)
+    if not coincidencia:
+        return None
+
+    dia, mes, anio = coincidencia.groups()
+    if anio is None:
+        anio = hoy.year
+    elif len(anio) == 2:
+        anio = int(anio) + (2000 if int(anio) < 69 else 1900)  # Mismo pivote que strptime('%y')
+
+    try:
+        return date(int(anio), int(mes), int(dia))
+    except ValueError:
+        return None
+
+
+def interpretar_rango(texto, hoy=None):
+    """
+    Convierte una expresión de rango en (fecha_inicio, fecha_fin) como `date`, o (None, None).
+    Acepta:
+    - "hoy", "ayer", o una fecha sola
+    - "N": los últimos N días hasta hoy
+    - "esta semana", "semana pasada", "este mes", "mes pasado"
+    - "<fecha> a <fecha>", p. ej. "20/02 a hoy" o "01/03 a 15/03"
+    """
+    hoy = hoy or reloj()
+    texto = _normalizar(texto)
+
+    if RE_DIAS.match(texto):
+        return hoy - timedelta(days=int(texto)), hoy
+
+    if texto == "esta semana":
+        return hoy - timedelta(days=hoy.weekday()), hoy
+
+    if texto == "semana pasada":
+        fin = hoy - timedelta(days=hoy.weekday() + 1)
+        return fin - timedelta(days=6), fin
+
+    if texto == "este mes":
+        return hoy.replace(day=1), hoy
+
+    if texto == "mes pasado":
+        fin = hoy.replace(day=1) - timedelta(days=1)
+        return fin.replace(day=1), fin
+
+    coincidencia = RE_RANGO.match(texto)
+    if coincidencia:
+        inicio = interpretar_fecha(coincidencia.group(1), hoy)
+        fin = interpretar_fecha(coincidencia.group(2), hoy)
+        if inicio and fin and inicio <= fin:
+            return inicio, fin
+        return None, None
+
+    fecha = interpretar_fecha(texto, hoy)
+    if fecha:
+        return fecha, fecha
+
+    return None, None
@@ -0,0 +1,352 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import zipfile
+import pandas as pd
+from openpyxl import load_workbook
+from app.almacen import conexion_local
+from app.cliente_http import solicitar
+from app.config import Config
+from app.database import transaccion, llamar_sp
+from app.indices import normalizar_texto, obtener_indice_productos
+
+COLUMNAS_REQUERIDAS = ['Descripcion', 'Presentacion', 'Codigo', 'Institucional', 'Mayorista']
+TAMANO_BLOQUE_DESCARGA = 64 * 1024
+
+_tablas_creadas = False
+_lock_tablas = threading.Lock()
+
+
+def _crear_tablas():
+    global _tablas_creadas
+
+    with _lock_tablas:
+        if _tablas_creadas:
+            return
+        conexion_local().executescript("""
+            CREATE TABLE IF NOT EXISTS importaciones (
+                checksum TEXT PRIMARY KEY,
+                archivo TEXT,
+                importado_en REAL NOT NULL,
+                resumen TEXT
+            );
+            CREATE TABLE IF NOT EXISTS huellas_catalogo (
+                codigo TEXT PRIMARY KEY,
+                huella TEXT NOT NULL,
+                actualizado_en REAL NOT NULL
+            );
+        """)
+        _tablas_creadas = True
+
+
+def descargar_documento(url, headers, sufijo=""):
+    """
+    Descarga un documento por bloques a un archivo temporal en `Config.DATA_DIR`,
+    calculando su SHA-256 sin cargarlo completo en memoria.
+    Si supera `Config.IMPORTACION_MAX_BYTES` se cancela la descarga.
+    Devuelve (ruta, checksum) o (None, None) si falla.
+    """
+    response = solicitar("GET", url, headers=headers, stream=True)
+    try:
+        if response.status_code != 200:
+            print(f"⚠️ No se pudo descargar el documento: HTTP {response.status_code}")
+            return None, None
+
+        tamano_declarado = int(response.headers.get("Content-Length") or 0)
+        if tamano_declarado > Config.IMPORTACION_MAX_BYTES:
+            print(f"⚠️ Documento demasiado grande ({tamano_declarado} bytes)")
+            return None, None
+
+        os.makedirs(Config.DATA_DIR, exist_ok=True)
+        descriptor, ruta = tempfile.mkstemp(suffix=sufijo, dir=Config.DATA_DIR)
+        checksum = hashlib.sha256()
+        tamano = 0
+
+        with os.fdopen(descriptor, "wb") as archivo:
+            for bloque in response.iter_content(TAMANO_BLOQUE_DESCARGA):
+                tamano += len(bloque)
+                if tamano > Config.IMPORTACION_MAX_BYTES:
+                    break
+                checksum.update(bloque)
+                archivo.write(bloque)
+
+        if tamano > Config.IMPORTACION_MAX_BYTES:
+            os.remove(ruta)
+            print(f"⚠️ Documento demasiado grande (más de {Config.IMPORTACION_MAX_BYTES} bytes)")
+            return None, None
+
+        return ruta, checksum.hexdigest()
+    finally:
+        response.close()
+
+
+def calcular_checksum(ruta):
+    """
+    SHA-256 de un archivo leído por bloques.
+    """
+    checksum = hashlib.sha256()
+    with open(ruta, "rb") as archivo:
+        for bloque in iter(lambda: archivo.read(TAMANO_BLOQUE_DESCARGA), b""):
+            checksum.update(bloque)
+    return checksum.hexdigest()
+
+
+def ya_importado(checksum):
+    """
+    Indica si el archivo tiene el mismo contenido que la última importación correcta.
+    Solo se compara con la última: volver a subir una lista de precios anterior (para revertir precios)
+    sí se importa, y el diff por 'Codigo' aplica solo lo que cambió respecto al catálogo actual.
+    """
+    _crear_tablas()
+    fila = conexion_local().execute(
+        "SELECT checksum FROM importaciones ORDER BY importado_en DESC LIMIT 1"
+    ).fetchone()
+    return fila is not None and fila[0] == checksum
+
+
+def registrar_importacion(checksum, archivo, reporte):
+    """
+    Guarda el checksum de un archivo importado (como la última importación) para omitir reenvíos idénticos.
+    """
+    _crear_tablas()
+    resumen = {clave: reporte[clave] for clave in ("insertados", "actualizados", "sin_cambios", "rechazados")}
+    conexion_local().execute(
+        "INSERT OR REPLACE INTO importaciones (checksum, archivo, importado_en, resumen) VALUES (?, ?, ?, ?)",
+        (checksum, archivo, time.time(), json.dumps(resumen))
+    )
+
+
+def leer_columnas_excel(ruta):
+    """
+    Devuelve los nombres de columna (primera fila) de la hoja activa del Excel.
+    """
+    if not zipfile.is_zipfile(ruta):
+        return list(pd.read_excel(ruta, nrows=0).columns)
+
+    libro = load_workbook(ruta, read_only=True, data_only=True)
+    try:
+        encabezado = next(libro.active.iter_rows(max_row=1, values_only=True), ())
+        return [str(col).strip() if col is not None else "" for col in encabezado]
+    finally:
+        libro.close()
+
+
+def leer_excel_por_lotes(ruta, tamano_lote):
+    """
+    Recorre el Excel y genera DataFrames de hasta `tamano_lote` filas con el número de fila
+    del Excel como índice. Los .xlsx se leen con openpyxl en modo solo lectura, así la memoria
+    no crece con el archivo; los .xls antiguos se leen completos con pandas.
+    """
+    if not zipfile.is_zipfile(ruta):
+        df = pd.read_excel(ruta)
+        df.index = df.index + 2  # La fila 1 es el encabezado
+        yield df
+        return
+
+    libro = load_workbook(ruta, read_only=True, data_only=True)
+    try:
+        filas = libro.active.iter_rows(values_only=True)
+        encabezado = next(filas, None)
+        if encabezado is None:
+            return
+
+        columnas = [str(col).strip() if col is not None else "" for col in encabezado]
+        bloque = []
+        inicio = 2
+        for fila in filas:
+            bloque.append(fila)
+            if len(bloque) == tamano_lote:
+                yield _bloque_a_dataframe(bloque, columnas, inicio)
+                inicio += len(bloque)
+                bloque = []
+        if bloque:
+            yield _bloque_a_dataframe(bloque, columnas, inicio)
+    finally:
+        libro.close()
+
+
+def _bloque_a_dataframe(bloque, columnas, inicio):
+    df = pd.DataFrame.from_records(bloque, columns=columnas, index=range(inicio, inicio + len(bloque)))
+    # Ignorar filas completamente vacías al final de la hoja
+    return df.dropna(how="all")
+
+
+def validar_columnas(columnas):
+    """
+    Devuelve la primera columna requerida que falta en el archivo, o None si están todas.
+    """
+    for col in COLUMNAS_REQUERIDAS:
+        if col not in columnas:
+            return col
+    return None
+
+
+def normalizar_lote(df):
+    """
+    Limpia un bloque del Excel con operaciones vectorizadas de pandas.
+    El índice del DataFrame debe ser el número de fila del Excel, para el reporte.
+    Devuelve (filas válidas, filas rechazadas [{"fila", "codigo", "estado", "motivo"}]).
+    """
+    codigo = df['Codigo']
+    if pd.api.types.is_float_dtype(codigo) and (codigo.dropna() % 1 == 0).all():
+        # Excel lee los códigos numéricos como float cuando hay celdas vacías (1001 -> 1001.0)
+        codigo = codigo.astype("Int64")
+
+    limpio = pd.DataFrame({
+        'Descripcion': df['Descripcion'].astype("string").str.strip(),
+        'Presentacion': df['Presentacion'].astype("string").str.strip().str.lower().str.capitalize(),
+        'Codigo': codigo.astype("string").str.strip(),
+        'Institucional': pd.to_numeric(df['Institucional'], errors="coerce"),
+        'Mayorista': pd.to_numeric(df['Mayorista'], errors="coerce")
+    }, index=df.index)
+
+    # 📌 Motivos de rechazo, evaluados sobre columnas completas
+    faltantes = limpio[['Descripcion', 'Presentacion', 'Codigo']].isna().any(axis=1) | \
+        (limpio[['Descripcion', 'Presentacion', 'Codigo']] == "").any(axis=1)
+    precio_invalido = (limpio['Institucional'].isna() & df['Institucional'].notna()) | \
+        (limpio['Mayorista'].isna() & df['Mayorista'].notna()) | \
+        (limpio['Institucional'] < 0) | (limpio['Mayorista'] < 0)
+
+    motivos = pd.Series(pd.NA, index=df.index, dtype="string")
+    motivos[precio_invalido] = "Precio inválido"
+    motivos[faltantes] = "Faltan datos obligatorios (Descripcion, Presentacion o Codigo)"
+    rechazadas = motivos.notna()
+
+    rechazos = [
+        {"fila": int(fila), "codigo": None if pd.isna(cod) else str(cod), "estado": "rechazado", "motivo": motivo}
+        for fila, cod, motivo in zip(df.index[rechazadas], limpio['Codigo'][rechazadas], motivos[rechazadas])
+    ]
+
+    validas = limpio[~rechazadas].copy()
+    validas[['Institucional', 'Mayorista']] = validas[['Institucional', 'Mayorista']].fillna(0)
+    validas['Descripcion'] = validas['Descripcion'].str.replace("'", "''")  # Escapar comillas
+    validas['Presentacion'] = validas['Presentacion'].str.replace("'", "''")
+
+    return validas, rechazos
+
+
+def cargar_huellas():
+    """
+    Devuelve las huellas guardadas de la última importación: {Codigo: huella}.
+    """
+    _crear_tablas()
+    return dict(conexion_local().execute("SELECT codigo, huella FROM huellas_catalogo").fetchall())
+
+
+def guardar_huellas(huellas):
+    """
+    Guarda las huellas {Codigo: huella} de los productos escritos en la base de datos.
+    """
+    _crear_tablas()
+    conexion = conexion_local()
+    ahora = time.time()
+
+    conexion.execute("BEGIN")
+    try:
+        conexion.executemany(
+            "INSERT OR REPLACE INTO huellas_catalogo (codigo, huella, actualizado_en) VALUES (?, ?, ?)",
+            [(codigo, huella, ahora) for codigo, huella in huellas.items()]
+        )
+        conexion.execute("COMMIT")
+    except Exception:
+        conexion.execute("ROLLBACK")
+        raise
+
+
+def calcular_huellas(validas):
+    """
+    Huella de cada fila (descripción, presentación y ambos precios), calculada en bloque con pandas.
+    """
+    columnas = validas[['Descripcion', 'Presentacion', 'Institucional', 'Mayorista']].astype({
+        'Institucional': "float64", 'Mayorista': "float64"
+    })
+    return pd.util.hash_pandas_object(columnas, index=False).astype("string")
+
+
+def importar_catalogo(lotes, forzar=False):
+    """
+    Inserta o actualiza los artículos de uno o varios bloques (DataFrames) del Excel
+    en una sola conexión y transacción: si algo falla no queda el catálogo a medias.
+    Solo escribe los productos nuevos o que cambiaron desde la última importación según su huella
+    por `Codigo` (con `forzar=True` se reenvían todos).
+    Cada presentación distinta se resuelve una sola vez con 'InsertarPresentacion'.
+    Devuelve un reporte con los totales y el estado de cada fila (insertado, actualizado, sin cambios o rechazado).
+    """
+    indice = obtener_indice_productos()
+    existentes = {normalizar_texto(nombre) for nombre in indice["nombres"]} if indice else set()
+    huellas_anteriores = cargar_huellas()
+    huellas_nuevas = {}
+
+    filas = []
+    presentaciones = {}  # nombre -> idPresentacion (o None si no se pudo crear)
+
+    with transaccion() as cursor:
+        for lote in lotes:
+            validas, rechazos = normalizar_lote(lote)
+            filas.extend(rechazos)
+
+            # 📌 Separar las filas que no cambiaron desde la última importación
+            validas['Huella'] = calcular_huellas(validas)
+            anteriores = validas['Codigo'].map(huellas_anteriores).astype("string")
+            sin_cambios = (anteriores == validas['Huella']).fillna(False).astype(bool) & (not forzar)
+
+            filas.extend(
+                {"fila": int(fila), "codigo": codigo, "estado": "sin cambios", "motivo": None}
+                for fila, codigo in zip(validas.index[sin_cambios], validas['Codigo'][sin_cambios])
+            )
+            cambiadas = validas[~sin_cambios]
+
+            for presentacion in cambiadas['Presentacion'].unique():
+                if presentacion not in presentaciones:
+                    resultado = llamar_sp(cursor, "InsertarPresentacion", (presentacion, 0))
+                    presentaciones[presentacion] = resultado[0][0][0] if resultado and len(resultado[0]) > 0 else None
+
+            for fila, descripcion, presentacion, codigo, precio_institucional, precio_mayorista, huella in cambiadas.itertuples():
+                id_presentacion = presentaciones[presentacion]
+                if id_presentacion is None:
+                    filas.append({"fila": int(fila), "codigo": codigo, "estado": "rechazado",
+                                  "motivo": f"No se pudo obtener un ID para la presentación '{presentacion}'"})
+                    continue
+
+                llamar_sp(cursor, "InsertarProducto", (
+                    descripcion, codigo, id_presentacion, float(precio_institucional), float(precio_mayorista), 0
+                ))
+                huellas_nuevas[codigo] = huella
+
+                nombre = normalizar_texto(f"{descripcion} ({presentacion})")
+                conocido = codigo in huellas_anteriores or nombre in existentes
+                filas.append({"fila": int(fila), "codigo": codigo, "estado": "actualizado" if conocido else "insertado", "motivo": None})
+
+    # Las huellas se guardan solo después del commit en MySQL
+    guardar_huellas(huellas_nuevas)
+
+    filas.sort(key=lambda f: f["fila"])
+    return {
+        "insertados": sum(f["estado"] == "insertado" for f in filas),
+        "actualizados": sum(f["estado"] == "actualizado" for f in filas),
+        "sin_cambios": sum(f["estado"] == "sin cambios" for f in filas),
+        "rechazados": sum(f["estado"] == "rechazado" for f in filas),
+        "filas": filas
+    }
+
+
+def resumen_importacion(reporte, max_rechazos=5):
+    """
+    Texto corto para WhatsApp con el resultado de una importación.
+    """
+    mensaje = "📦 Importación de artículos\n"
+    mensaje += f"🆕 Nuevos: {reporte['insertados']}\n"
+    mensaje += f"✏️ Actualizados: {reporte['actualizados']}\n"
+    mensaje += f"⏸️ Sin cambios: {reporte['sin_cambios']}\n"
+    mensaje += f"❌ Rechazados: {reporte['rechazados']}"
+
+    rechazados = [f for f in reporte["filas"] if f["estado"] == "rechazado"]
+    for fila in rechazados[:max_rechazos]:
+        mensaje += f"\n- Fila {fila['fila']}: {fila['motivo']}"
+    if len(rechazados) > max_rechazos:
+        mensaje += f"\n... y {len(rechazados) - max_rechazos} más"
+
+    return mensaje
@@ -0,0 +1,322 @@
+import threading
+import time
+import unicodedata
+from collections import defaultdict
+import numpy as np
+from rapidfuzz import utils
+from app.cache import obtener_cache, suscribir, avisar_cambio
+from app.config import Config
+from app.database import ejecutar_sp
+
+# 📌 Índice del catálogo de productos compartido por todo el proceso
+_indice_productos = None
+_lock_productos = threading.Lock()
+
+# 📌 Versión del catálogo en la caché compartida: cada escritura la incrementa y avisa a los demás procesos,
+# que descartan su índice si es de una versión anterior (así no quedan precios viejos en otros nodos)
+_version_catalogo = 0
+
+# 📌 Índice de clientes compartido por todo el proceso
+_indice_clientes = None
+_lock_clientes = threading.Lock()
+
+
+def normalizar_texto(texto):
+    """
+    Prepara un texto para la comparación difusa: minúsculas, sin tildes ni signos y con espacios simples.
+    Se aplica igual a las opciones del índice y a las consultas.
+    """
+    texto = unicodedata.normalize("NFKD", str(texto))
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return utils.default_process(texto)
+
+
+def _construir_indice_productos():
+    """
+    Carga el catálogo con el SP 'ObtenerProductos' y prepara las estructuras para RapidFuzz.
+    Con una caché compartida usa la copia de la versión actual si otro proceso ya la cargó,
+    o deja la suya para los demás.
+    Devuelve None si la consulta falla, para no guardar un catálogo vacío por error.
+    """
+    cache = obtener_cache()
+    version, productos = _leer_catalogo_compartido(cache)
+
+    if productos is None:
+        resultados = ejecutar_sp("ObtenerProductos", ())
+
+        if resultados is None:
+            return None
+
+        productos = resultados[0] if resultados else []  # [(idProducto, nombre, precioInstitucional, precioMayorista)]
+        if cache.es_compartida and version is not None:
+            _guardar_catalogo_compartido(cache, version, productos)
+
+    indice = indice_desde_productos(productos)
+    indice["version"] = _version_catalogo if version is None else version
+    return indice
+
+
+def _clave_catalogo(version):
+    return f"catalogo:productos:{version}"
+
+
+def _leer_catalogo_compartido(cache):
+    """
+    Devuelve (versión, productos) de la caché compartida; productos es None si no hay copia de esa versión.
+    Si la caché no responde devuelve (None, None) y el catálogo se lee de la base de datos.
+    """
+    try:
+        version = cache.leer_contador("catalogo:version")
+        return version, cache.obtener(_clave_catalogo(version)) if cache.es_compartida else None
+    except Exception as e:
+        print(f"⚠️ No se pudo leer el catálogo de la caché compartida: {e}")
+        return None, None
+
+
+def _guardar_catalogo_compartido(cache, version, productos):
+    try:
+        cache.guardar(_clave_catalogo(version), [tuple(producto) for producto in productos], Config.CATALOGO_TTL_SEGUNDOS)
+    except Exception as e:
+        print(f"⚠️ No se pudo guardar el catálogo en la caché compartida: {e}")
+
+
+def indice_desde_productos(productos):
+    """
+    Arma el índice a partir de filas (idProducto, nombre, precioInstitucional, precioMayorista).
+    Si el catálogo tiene al menos `Config.MATCH_PREFILTRO_MIN_PRODUCTOS` productos, agrega también
+    el índice invertido de trigramas que usa `candidatos_productos`.
+    """
+    ids = []
+    nombres = []
+    opciones = []
+    por_id = {}
+    for id_producto, nombre, precio_institucional, precio_mayorista in productos:
+        ids.append(id_producto)
+        nombres.append(nombre)
+        opciones.append(normalizar_texto(nombre))  # Preprocesado una sola vez
+        por_id[id_producto] = (nombre, precio_institucional, precio_mayorista)
+
+    return {
+        "ids": ids,            # Posición en `opciones` -> idProducto
+        "nombres": nombres,
+        "opciones": opciones,  # Lista de opciones ya preparada para `process.extractOne`
+        "por_id": por_id,      # idProducto -> (nombre, precioInstitucional, precioMayorista)
+        "trigramas": _indexar_trigramas(opciones) if len(opciones) >= Config.MATCH_PREFILTRO_MIN_PRODUCTOS else None,
+        "creado": time.monotonic()
+    }
+
+
+def _trigramas(texto):
+    texto = f"  {texto} "  # Relleno para que el inicio de la palabra también cuente
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+def _indexar_trigramas(opciones):
+    """
+    Índice invertido trigrama -> posiciones en `opciones` (arreglo de numpy).
+    """
+    posiciones = defaultdict(list)
+    for posicion, opcion in enumerate(opciones):
+        for trigrama in _trigramas(opcion):
+            posiciones[trigrama].append(posicion)
+
+    return {trigrama: np.array(lista, dtype=np.int32) for trigrama, lista in posiciones.items()}
+
+
+def candidatos_productos(indice, consultas, limite=None):
+    """
+    Reduce el catálogo a los productos que comparten más trigramas con alguna de las consultas
+    (ya normalizadas): hasta `limite` (`Config.MATCH_CANDIDATOS`) por consulta.
+    Devuelve las posiciones candidatas ordenadas, o None si el índice no tiene prefiltro
+    (catálogo chico) y conviene puntuar todas las opciones.
+    """
+    trigramas = indice.get("trigramas")
+    if trigramas is None:
+        return None
+
+    limite = limite or Config.MATCH_CANDIDATOS
+    total = len(indice["opciones"])
+    seleccion = []
+
+    for consulta in consultas:
+        listas = [trigramas[t] for t in _trigramas(consulta) if t in trigramas]
+        if not listas:
+            continue
+
+        coincidencias = np.bincount(np.concatenate(listas), minlength=total)
+        if np.count_nonzero(coincidencias) <= limite:
+            seleccion.append(np.flatnonzero(coincidencias))
+        else:
+            seleccion.append(np.argpartition(coincidencias, -limite)[-limite:])
+
+    if not seleccion:
+        return np.zeros(0, dtype=np.intp)
+    return np.unique(np.concatenate(seleccion))
+
+
+def obtener_indice_productos():
+    """
+    Devuelve el índice del catálogo de productos, reconstruyéndolo solo si fue invalidado (aquí o en otro
+    proceso) o si su antigüedad supera `Config.CATALOGO_TTL_SEGUNDOS` (0 = sin expiración).
+    """
+    global _indice_productos
+
+    with _lock_productos:
+        indice = _indice_productos
+        ttl = Config.CATALOGO_TTL_SEGUNDOS
+        vencido = indice is not None and (
+            (ttl > 0 and time.monotonic() - indice["creado"] > ttl) or indice.get("version", 0) < _version_catalogo
+        )
+
+        if indice is None or vencido:
+            nuevo = _construir_indice_productos()
+            if nuevo is not None:
+                _indice_productos = nuevo
+                indice = nuevo
+            elif indice is not None:
+                print("⚠️ No se pudo refrescar el catálogo de productos, se usa la versión anterior")
+
+        return indice
+
+
+def invalidar_indice_productos():
+    """
+    Descarta el índice del catálogo para que la próxima búsqueda lo vuelva a cargar, en este proceso
+    y (con una caché compartida) en todos los demás.
+    Debe llamarse después de cualquier escritura sobre productos (p. ej. 'InsertarProducto').
+    """
+    global _indice_productos, _version_catalogo
+
+    with _lock_productos:
+        _indice_productos = None
+
+    cache = obtener_cache()
+    if not cache.es_compartida:
+        return
+
+    try:
+        version = cache.incrementar("catalogo:version")
+        cache.eliminar(_clave_catalogo(version - 1))
+    except Exception as e:
+        print(f"⚠️ No se pudo publicar la nueva versión del catálogo: {e}")
+        return
+
+    _version_catalogo = max(_version_catalogo, version)
+    avisar_cambio("catalogo", version)
+
+
+def _al_cambiar_catalogo(version):
+    """
+    Aviso de otro proceso: el catálogo cambió. El índice se reconstruye en la próxima búsqueda.
+    """
+    global _version_catalogo
+
+    if version is None:
+        version = obtener_cache().leer_contador("catalogo:version")
+    _version_catalogo = max(_version_catalogo, version)
+
+
+def _construir_indice_clientes():
+    """
+    Carga los clientes con el SP 'ObtenerClientes' y prepara sus nombres normalizados.
+    Devuelve None si la consulta falla.
+    """
+    resultados = ejecutar_sp("ObtenerClientes", ())
+
+    if resultados is None:
+        return None
+
+    clientes = resultados[0] if resultados else []  # [(idCliente, nombre)]
+
+    indice = {"ids": [], "nombres": [], "opciones": [], "por_id": {}, "creado": time.monotonic()}
+    for cliente in clientes:
+        _agregar_cliente(indice, cliente[0], cliente[1])
+
+    return indice
+
+
+def _agregar_cliente(indice, id_cliente, nombre_cliente):
+    indice["por_id"][id_cliente] = len(indice["ids"])  # idCliente -> posición en `opciones`
+    indice["ids"].append(id_cliente)          # Posición en `opciones` -> idCliente
+    indice["nombres"].append(nombre_cliente)
+    indice["opciones"].append(normalizar_texto(nombre_cliente))
+
+
+def obtener_indice_clientes():
+    """
+    Devuelve el índice de clientes, recargándolo solo si expiró según
+    `Config.CLIENTES_TTL_SEGUNDOS` (0 = sin expiración).
+    """
+    global _indice_clientes
+
+    with _lock_clientes:
+        indice = _indice_clientes
+        ttl = Config.CLIENTES_TTL_SEGUNDOS
+        vencido = indice is not None and ttl > 0 and time.monotonic() - indice["creado"] > ttl
+
+        if indice is None or vencido:
+            nuevo = _construir_indice_clientes()
+            if nuevo is not None:
+                _indice_clientes = nuevo
+                indice = nuevo
+            elif indice is not None:
+                print("⚠️ No se pudo refrescar la lista de clientes, se usa la versión anterior")
+
+        return indice
+
+
+def agregar_cliente_al_indice(id_cliente, nombre_cliente):
+    """
+    Agrega un cliente recién insertado al índice sin recargar toda la tabla, y avisa a los demás procesos
+    para que no lo vuelvan a crear al buscarlo por nombre.
+    Si el índice aún no se ha cargado no hace nada: la primera búsqueda lo traerá completo.
+    """
+    _agregar_cliente_si_falta(id_cliente, nombre_cliente)
+    avisar_cambio("clientes", (id_cliente, nombre_cliente))
+
+
+def _agregar_cliente_si_falta(id_cliente, nombre_cliente):
+    """
+    Reemplaza el índice por una copia con el cliente agregado: las búsquedas leen el índice sin el lock,
+    así que el que ya tienen en mano nunca cambia mientras lo recorren.
+    """
+    global _indice_clientes
+
+    with _lock_clientes:
+        indice = _indice_clientes
+        if indice is None or id_cliente in indice["por_id"]:
+            return
+
+        nuevo = {
+            "ids": list(indice["ids"]),
+            "nombres": list(indice["nombres"]),
+            "opciones": list(indice["opciones"]),
+            "por_id": dict(indice["por_id"]),
+            "creado": indice["creado"]
+        }
+        _agregar_cliente(nuevo, id_cliente, nombre_cliente)
+        _indice_clientes = nuevo
+
+
+def _al_agregar_cliente(cliente):
+    """
+    Aviso de otro proceso: se insertó un cliente (o pudieron perderse avisos y se recarga la lista).
+    """
+    if cliente is None:
+        invalidar_indice_clientes()
+    else:
+        _agregar_cliente_si_falta(*cliente)
+
+
+def invalidar_indice_clientes():
+    """
+    Descarta el índice de clientes para que la próxima búsqueda lo vuelva a cargar.
+    """
+    global _indice_clientes
+
+    with _lock_clientes:
+        _indice_clientes = None
+
+
+suscribir("catalogo", _al_cambiar_catalogo)
+suscribir("clientes", _al_agregar_cliente)
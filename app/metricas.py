@@ -0,0 +1,263 @@
+import atexit
+import bisect
+import glob
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from app.config import Config
+
+# 📌 Métricas en memoria del proceso, expuestas en formato de texto de Prometheus en `/metrics`.
+# Con `Config.METRICAS_ACTIVAS` desactivado, `contar`, `observar` y `medir` no hacen nada.
+# Con varios workers (`serve.py` llama a `preparar_multiproceso`), cada proceso vuelca sus métricas
+# a un archivo en `Config.METRICAS_DIR` cada `Config.METRICAS_VOLCADO_SEGUNDOS`, y `/metrics` suma
+# las de todos: los contadores no saltan según qué worker atienda el scrape. Los gauges de los recolectores
+# se exponen por proceso con la etiqueta `pid`.
+
+# Límites de los histogramas de duración (segundos)
+LIMITES_DURACION = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_lock = threading.Lock()
+_contadores = {}  # (nombre, etiquetas) -> valor
+_histogramas = {}  # (nombre, etiquetas) -> [conteos por límite (+Inf al final), suma, cantidad]
+_recolectores = []  # (prefijo, función que devuelve un dict de valores actuales)
+
+_directorio = None  # Directorio compartido entre procesos (None = solo este proceso)
+_pid = os.getpid()  # Proceso dueño de `_contadores` y `_histogramas`
+_archivo = None  # Archivo de volcado de este proceso
+
+
+def _clave(nombre, etiquetas):
+    return nombre, tuple(sorted(etiquetas.items()))
+
+
+def contar(nombre, valor=1, **etiquetas):
+    """
+    Suma `valor` al contador `nombre` con las etiquetas dadas.
+    """
+    if not Config.METRICAS_ACTIVAS:
+        return
+    _asegurar_volcado()
+    clave = _clave(nombre, etiquetas)
+    with _lock:
+        _contadores[clave] = _contadores.get(clave, 0) + valor
+
+
+def observar(nombre, segundos, **etiquetas):
+    """
+    Registra una duración en el histograma `nombre`.
+    """
+    if not Config.METRICAS_ACTIVAS:
+        return
+    _asegurar_volcado()
+    clave = _clave(nombre, etiquetas)
+    posicion = bisect.bisect_left(LIMITES_DURACION, segundos)
+    with _lock:
+        histograma = _histogramas.get(clave)
+        if histograma is None:
+            histograma = _histogramas[clave] = [[0] * (len(LIMITES_DURACION) + 1), 0.0, 0]
+        histograma[0][posicion] += 1
+        histograma[1] += segundos
+        histograma[2] += 1
+
+
+@contextmanager
+def medir(nombre, **etiquetas):
+    """
+    Mide la duración del bloque en el histograma `nombre` (también si el bloque lanza una excepción).
+    """
+    if not Config.METRICAS_ACTIVAS:
+        yield
+        return
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        observar(nombre, time.perf_counter() - inicio, **etiquetas)
+
+
+def registrar_recolector(prefijo, funcion):
+    """
+    Agrega una función que devuelve métricas instantáneas (p. ej. `metricas_pool`).
+    Cada valor numérico se expone como gauge `<prefijo>_<clave>` al momento del scrape.
+    """
+    with _lock:
+        if all(p != prefijo for p, _ in _recolectores):
+            _recolectores.append((prefijo, funcion))
+
+
+def _orden(elemento):
+    # Los valores de una etiqueta pueden mezclar tipos (p. ej. estado=200 y estado="error")
+    (nombre, etiquetas), _ = elemento
+    return nombre, [(k, str(v)) for k, v in etiquetas]
+
+
+def _etiquetas(etiquetas, extra=()):
+    pares = list(etiquetas) + list(extra)
+    if not pares:
+        return ""
+    return "{" + ",".join(f'{k}="{_escapar(v)}"' for k, v in pares) + "}"
+
+
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def preparar_multiproceso(directorio=None):
+    """
+    Activa las métricas compartidas entre procesos. Se llama una vez en el proceso maestro antes del fork:
+    borra los volcados de una ejecución anterior para que sus contadores no se sumen a los nuevos.
+    """
+    global _directorio
+
+    directorio = directorio or Config.METRICAS_DIR
+    os.makedirs(directorio, exist_ok=True)
+    for archivo in glob.glob(os.path.join(directorio, "*.json")):
+        os.remove(archivo)
+    _directorio = directorio
+
+
+def _asegurar_volcado():
+    """
+    En modo multiproceso, arranca (una vez por proceso) el hilo que vuelca las métricas de este proceso.
+    Lo que se heredó del maestro al hacer fork se descarta, porque ya lo cuenta el maestro.
+    """
+    global _pid, _archivo
+
+    if _directorio is None or (_archivo is not None and _pid == os.getpid()):
+        return
+
+    with _lock:
+        if _archivo is not None and _pid == os.getpid():
+            return
+        if _pid != os.getpid():
+            _contadores.clear()
+            _histogramas.clear()
+            _pid = os.getpid()
+        # El instante de inicio evita pisar el archivo de un proceso muerto que tuvo el mismo pid
+        _archivo = os.path.join(_directorio, f"{_pid}_{int(time.time() * 1000)}.json")
+
+    threading.Thread(target=_volcar_periodicamente, name="metricas-volcado", daemon=True).start()
+    atexit.register(_volcar)  # Lo contado desde el último volcado
+
+
+def _volcar_periodicamente():
+    while True:
+        time.sleep(Config.METRICAS_VOLCADO_SEGUNDOS)
+        try:
+            _volcar()
+        except Exception as e:
+            print(f"⚠️ No se pudieron volcar las métricas del proceso: {e}")
+
+
+def _volcar():
+    contadores, histogramas, gauges = _instantanea()
+    datos = {
+        "pid": _pid,
+        "escrito_en": time.time(),
+        "contadores": [[nombre, etiquetas, valor] for (nombre, etiquetas), valor in contadores.items()],
+        "histogramas": [[nombre, etiquetas, *h] for (nombre, etiquetas), h in histogramas.items()],
+        "gauges": gauges
+    }
+
+    temporal = _archivo + ".tmp"
+    with open(temporal, "w") as archivo:
+        json.dump(datos, archivo)
+    os.replace(temporal, _archivo)  # Los demás procesos nunca leen un archivo a medio escribir
+
+
+def _instantanea():
+    """
+    Copia de los contadores e histogramas de este proceso y los valores actuales de sus recolectores.
+    """
+    with _lock:
+        contadores = dict(_contadores)
+        histogramas = {clave: [list(h[0]), h[1], h[2]] for clave, h in _histogramas.items()}
+        recolectores = list(_recolectores)
+
+    gauges = {}
+    for prefijo, funcion in recolectores:
+        try:
+            valores = funcion()
+        except Exception as e:
+            print(f"⚠️ No se pudieron recolectar las métricas de {prefijo}: {e}")
+            continue
+        for clave, valor in valores.items():
+            if isinstance(valor, (int, float)):
+                gauges[f"{prefijo}_{clave}"] = valor
+
+    return contadores, histogramas, gauges
+
+
+def _sumar_otros_procesos(contadores, histogramas, gauges):
+    """
+    Suma a las métricas de este proceso las volcadas por los demás. Los contadores de procesos que ya
+    terminaron se conservan (si no, bajarían); sus gauges se omiten cuando el volcado quedó viejo.
+    """
+    vigencia = 3 * Config.METRICAS_VOLCADO_SEGUNDOS
+
+    for ruta in glob.glob(os.path.join(_directorio, "*.json")):
+        if ruta == _archivo:
+            continue
+        try:
+            with open(ruta) as archivo:
+                datos = json.load(archivo)
+        except (OSError, ValueError):
+            continue
+
+        for nombre, etiquetas, valor in datos["contadores"]:
+            clave = (nombre, tuple(tuple(par) for par in etiquetas))
+            contadores[clave] = contadores.get(clave, 0) + valor
+
+        for nombre, etiquetas, conteos, suma, cantidad in datos["histogramas"]:
+            clave = (nombre, tuple(tuple(par) for par in etiquetas))
+            actual = histogramas.setdefault(clave, [[0] * len(conteos), 0.0, 0])
+            actual[0] = [a + b for a, b in zip(actual[0], conteos)]
+            actual[1] += suma
+            actual[2] += cantidad
+
+        if time.time() - datos["escrito_en"] <= vigencia:
+            for nombre, valor in datos["gauges"].items():
+                gauges.append((nombre, (("pid", datos["pid"]),), valor))
+
+
+def exponer():
+    """
+    Devuelve todas las métricas en formato de texto de Prometheus (de todos los procesos en modo multiproceso).
+    """
+    _asegurar_volcado()
+    contadores, histogramas, valores = _instantanea()
+
+    if _directorio is None:
+        gauges = [(nombre, (), valor) for nombre, valor in valores.items()]
+    else:
+        gauges = [(nombre, (("pid", _pid),), valor) for nombre, valor in valores.items()]
+        _sumar_otros_procesos(contadores, histogramas, gauges)
+
+    lineas = []
+    tipos_escritos = set()
+
+    def tipo(nombre, tipo_metrica):
+        if nombre not in tipos_escritos:
+            lineas.append(f"# TYPE {nombre} {tipo_metrica}")
+            tipos_escritos.add(nombre)
+
+    for (nombre, etiquetas), valor in sorted(contadores.items(), key=_orden):
+        tipo(nombre, "counter")
+        lineas.append(f"{nombre}{_etiquetas(etiquetas)} {valor}")
+
+    for (nombre, etiquetas), (conteos, suma, cantidad) in sorted(histogramas.items(), key=_orden):
+        tipo(nombre, "histogram")
+        acumulado = 0
+        for limite, conteo in zip(LIMITES_DURACION + ("+Inf",), conteos):
+            acumulado += conteo
+            lineas.append(f"{nombre}_bucket{_etiquetas(etiquetas, [('le', limite)])} {acumulado}")
+        lineas.append(f"{nombre}_sum{_etiquetas(etiquetas)} {suma}")
+        lineas.append(f"{nombre}_count{_etiquetas(etiquetas)} {cantidad}")
+
+    for nombre, etiquetas, valor in sorted(gauges, key=lambda gauge: (gauge[0], str(gauge[1]))):
+        tipo(nombre, "gauge")
+        lineas.append(f"{nombre}{_etiquetas(etiquetas)} {valor}")
+
+    return "\n".join(lineas) + "\n"
@@ -0,0 +1,216 @@
+import threading
+import time
+from datetime import date, timedelta
+from app import fechas
+from app.almacen import conexion_local, ID_ALMACEN
+from app.cache import CacheLRU, suscribir, avisar_cambio
+from app.config import Config
+from app.database import ejecutar_sp
+from app.indices import obtener_indice_productos
+
+# 📌 Resumen diario por artículo guardado en el almacén local.
+# - Los días pasados se piden una sola vez a MySQL ('ObtenerReportePorArticulo' de un día) y quedan cerrados.
+# - El día de hoy se suma a medida que se registran facturas, y se vuelve a sincronizar con MySQL
+#   cada `Config.REPORTE_HOY_REFRESCO_SEGUNDOS` para corregir escrituras de otros procesos.
+# - Cada factura registrada se avisa a los demás procesos: descartan sus reportes en caché de esa fecha y,
+#   si usan otro almacén local (otro nodo), vuelven a sincronizar ese día con MySQL en el próximo reporte.
+# Se asume que el reporte agrupa por la fecha de la factura, que es el día en que se registra.
+
+_tablas_creadas = False
+_lock_tablas = threading.Lock()
+
+# 📌 Reportes ya generados por rango (fecha_inicio, fecha_fin).
+# Los rangos que terminan antes de hoy no cambian y no vencen; los que incluyen hoy
+# se descartan cuando se registran nuevas líneas de factura.
+_reportes_generados = CacheLRU(Config.REPORTE_CACHE_MAX)
+
+
+def _crear_tablas():
+    global _tablas_creadas
+
+    with _lock_tablas:
+        if _tablas_creadas:
+            return
+        conexion_local().executescript("""
+            CREATE TABLE IF NOT EXISTS resumen_diario (
+                fecha TEXT NOT NULL,
+                id_producto INTEGER NOT NULL,
+                nombre TEXT NOT NULL,
+                cantidad REAL NOT NULL,
+                PRIMARY KEY (fecha, id_producto)
+            );
+            CREATE TABLE IF NOT EXISTS dias_resumidos (
+                fecha TEXT PRIMARY KEY,
+                cerrado INTEGER NOT NULL,
+                cargado_en REAL NOT NULL
+            );
+        """)
+        _tablas_creadas = True
+
+
+def _como_fecha(valor):
+    return valor if isinstance(valor, date) else date.fromisoformat(str(valor))
+
+
+def obtener_resumen_por_articulo(fecha_inicio, fecha_fin, hoy=None):
+    """
+    Suma los resúmenes diarios del rango. Solo consulta MySQL por los días que aún no están resumidos.
+    Devuelve (cantidad de artículos, iterador de (idProducto, nombre, cantidad_total)); el iterador
+    lee las filas de a poco, sin cargarlas todas en memoria.
+    """
+    _crear_tablas()
+    hoy = hoy or fechas.reloj()
+    fecha_inicio, fecha_fin = _como_fecha(fecha_inicio), _como_fecha(fecha_fin)
+
+    _asegurar_dias(fecha_inicio, min(fecha_fin, hoy), hoy)
+
+    consulta = """
+        SELECT id_producto, nombre, SUM(cantidad) FROM resumen_diario
+        WHERE fecha BETWEEN ? AND ?
+        GROUP BY id_producto, nombre
+        HAVING SUM(cantidad) > 0
+    """
+    rango = (fecha_inicio.isoformat(), fecha_fin.isoformat())
+    conexion = conexion_local()
+
+    total = conexion.execute(f"SELECT COUNT(*) FROM ({consulta})", rango).fetchone()[0]
+    return total, conexion.execute(consulta + " ORDER BY nombre", rango)
+
+
+def _asegurar_dias(fecha_inicio, fecha_fin, hoy):
+    if fecha_inicio > fecha_fin:
+        return
+
+    resumidos = dict(
+        (fecha, (cerrado, cargado_en))
+        for fecha, cerrado, cargado_en in conexion_local().execute(
+            "SELECT fecha, cerrado, cargado_en FROM dias_resumidos WHERE fecha BETWEEN ? AND ?",
+            (fecha_inicio.isoformat(), fecha_fin.isoformat())
+        )
+    )
+
+    dia = fecha_inicio
+    while dia <= fecha_fin:
+        cerrado, cargado_en = resumidos.get(dia.isoformat(), (0, None))
+
+        if dia < hoy and not cerrado:
+            _cargar_dia(dia, cerrado=True)
+        elif dia == hoy and (cargado_en is None or time.time() - cargado_en > Config.REPORTE_HOY_REFRESCO_SEGUNDOS):
+            _cargar_dia(dia, cerrado=False)
+
+        dia += timedelta(days=1)
+
+
+def _cargar_dia(dia, cerrado):
+    """
+    Trae el resumen de un día desde MySQL y reemplaza el que hubiera en el almacén local.
+    """
+    resultados = ejecutar_sp("ObtenerReportePorArticulo", (dia.isoformat(), dia.isoformat()))
+    if resultados is None:
+        raise RuntimeError(f"No se pudo obtener el reporte del {dia.isoformat()}")
+
+    filas = resultados[0] if resultados else []
+    conexion = conexion_local()
+
+    conexion.execute("BEGIN IMMEDIATE")
+    try:
+        conexion.execute("DELETE FROM resumen_diario WHERE fecha = ?", (dia.isoformat(),))
+        conexion.executemany(
+            "INSERT INTO resumen_diario (fecha, id_producto, nombre, cantidad) VALUES (?, ?, ?, ?)",
+            [(dia.isoformat(), fila[0], fila[1], float(fila[2])) for fila in filas]
+        )
+        conexion.execute(
+            "INSERT OR REPLACE INTO dias_resumidos (fecha, cerrado, cargado_en) VALUES (?, ?, ?)",
+            (dia.isoformat(), int(cerrado), time.time())
+        )
+        conexion.execute("COMMIT")
+    except Exception:
+        conexion.execute("ROLLBACK")
+        raise
+
+
+def reporte_en_cache(fecha_inicio, fecha_fin):
+    """
+    Devuelve las partes del reporte ya generado para el rango, o None.
+    """
+    return _reportes_generados.obtener((_como_fecha(fecha_inicio), _como_fecha(fecha_fin)))
+
+
+def guardar_reporte_en_cache(fecha_inicio, fecha_fin, reporte, hoy=None):
+    """
+    Guarda las partes de un reporte generado. Si el rango incluye hoy vence a los `Config.REPORTE_HOY_REFRESCO_SEGUNDOS`,
+    para reflejar también las facturas registradas por otros procesos.
+    """
+    hoy = hoy or fechas.reloj()
+    fecha_inicio, fecha_fin = _como_fecha(fecha_inicio), _como_fecha(fecha_fin)
+    ttl = Config.REPORTE_HOY_REFRESCO_SEGUNDOS if fecha_fin >= hoy else 0  # 0 = no vence
+
+    _reportes_generados.guardar((fecha_inicio, fecha_fin), reporte, ttl_segundos=ttl)
+
+
+def invalidar_reportes_con_fecha(fecha):
+    """
+    Descarta los reportes en caché cuyo rango incluye `fecha`.
+    """
+    _reportes_generados.eliminar_si(lambda rango: rango[0] <= fecha <= rango[1])
+
+
+def _al_registrar_lineas(cambio):
+    """
+    Aviso de otro proceso: se registraron líneas de factura en `fecha`. Si el proceso usa otro almacén local,
+    el día abierto se marca para volver a traerlo de MySQL (en el mismo almacén ya se sumaron).
+    Si pudieron perderse avisos, se descartan todos los reportes que incluyen hoy.
+    """
+    if cambio is None:
+        hoy = fechas.reloj()
+        _reportes_generados.eliminar_si(lambda rango: rango[1] >= hoy)
+        return
+
+    fecha, almacen = cambio
+    invalidar_reportes_con_fecha(fecha)
+    if almacen != ID_ALMACEN:
+        _crear_tablas()
+        conexion_local().execute(
+            "UPDATE dias_resumidos SET cargado_en = 0 WHERE fecha = ? AND cerrado = 0", (fecha.isoformat(),)
+        )
+
+
+def acumular_lineas(lineas, fecha=None):
+    """
+    Suma al resumen del día las líneas [(idProducto, cantidad)] de una factura ya guardada.
+    Si el día todavía no se ha cargado no hace nada: al cargarlo desde MySQL ya las incluirá.
+    """
+    _crear_tablas()
+    fecha = fecha or fechas.reloj()
+    invalidar_reportes_con_fecha(fecha)
+    fecha = fecha.isoformat()
+    indice = obtener_indice_productos()
+    por_id = indice["por_id"] if indice else {}
+
+    conexion = conexion_local()
+    conexion.execute("BEGIN IMMEDIATE")
+    try:
+        abierto = conexion.execute(
+            "SELECT 1 FROM dias_resumidos WHERE fecha = ? AND cerrado = 0", (fecha,)
+        ).fetchone()
+
+        if abierto:
+            conexion.executemany(
+                """
+                INSERT INTO resumen_diario (fecha, id_producto, nombre, cantidad) VALUES (?, ?, ?, ?)
+                ON CONFLICT (fecha, id_producto) DO UPDATE SET cantidad = cantidad + excluded.cantidad
+                """,
+                [
+                    (fecha, id_producto, por_id.get(id_producto, (str(id_producto),))[0], float(cantidad))
+                    for id_producto, cantidad in lineas
+                ]
+            )
+        conexion.execute("COMMIT")
+    except Exception:
+        conexion.execute("ROLLBACK")
+        raise
+
+    avisar_cambio("reportes", (_como_fecha(fecha), ID_ALMACEN))
+
+
+suscribir("reportes", _al_registrar_lineas)
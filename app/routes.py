@@ -1,14 +1,33 @@
-from flask import Blueprint, request, jsonify
-import requests
+from flask import Blueprint, Response, request, jsonify
+import hashlib
+import hmac
 import os
-import threading
+from app.config import Config
+from app.cola import encolar_lote
+from app.almacen import ID_ALMACEN
+from app.cache import obtener_cache
+from app.cliente_http import solicitar
+from app.importacion import descargar_documento
 from app.services import procesar_pedido, procesar_reporte, insertar_articulos_desde_excel
-from app.database import ejecutar_sp
+from app.database import transaccion, llamar_sp, ERRORES_CONEXION
+from app.metricas import contar, medir, exponer
 import json
 
+try:
+    import orjson  # Decodificador JSON más rápido, opcional
+except ImportError:
+    orjson = None
+
 webhook_bp = Blueprint('webhook', __name__)
+metricas_bp = Blueprint('metricas', __name__)
+
+# 📌 IDs de mensajes ya registrados, en la caché compartida: evita consultar `RegistrarWebhook` por reenvíos
+# obvios y que dos nodos registren a la vez el mismo reenvío. Cada ID guarda (estado, cola que lo reservó);
+# la cola es la del almacén local, así sus reintentos (aunque el proceso se reinicie) se reconocen como propios.
+# Solo los IDs registrados por otra cola se descartan: un reenvío de Meta al mismo nodo ya lo descarta la cola.
+DUENO_COLA = ID_ALMACEN
 
-BASE_DIR = "C:\\temp" if os.name == "nt" else "/mnt/data"
+BASE_DIR = Config.DATA_DIR
 os.makedirs(BASE_DIR, exist_ok=True)
 
 @webhook_bp.route('/webhook', methods=['POST'])
@@ -16,81 +35,347 @@ def webhook():
     """
     Endpoint principal para recibir mensajes de WhatsApp y procesarlos según su tipo.
     """
-    data = request.get_json()
+    cuerpo = request.get_data()
+
+    if not firma_valida(cuerpo, request.headers.get("X-Hub-Signature-256", "")):
+        contar("webhooks_recibidos_total", resultado="firma_invalida")
+        return jsonify({"error": "Firma inválida"}), 403
+
+    data = cargar_json(cuerpo)
 
     if not data:
         return jsonify({"error": "No se recibió información"}), 400
 
+    # 📌 Guardar en la cola persistente antes de responder, para no perder el mensaje si el proceso se reinicia
+    try:
+        encolar_entrega(data)
+    except Exception:
+        return jsonify({"error": "No se pudo registrar el mensaje"}), 503  # Meta reintentará la entrega
+
     # 📌 Responder `200 OK` Inmediatamente para evitar reenvíos
-    threading.Thread(target=procesar_mensaje, args=(data,)).start()
     return jsonify({"status": "success"}), 200  # ✅ RESPUESTA RÁPIDA
 
 
-def procesar_mensaje(data):
+def firma_valida(cuerpo, encabezado):
+    """
+    Verifica el encabezado `X-Hub-Signature-256` de Meta: HMAC-SHA256 del cuerpo crudo con el app secret.
+    Si `Config.WHATSAPP_APP_SECRET` no está configurado no se valida (entornos de desarrollo).
+    """
+    if not Config.WHATSAPP_APP_SECRET:
+        return True
+
+    esperada = "sha256=" + hmac.new(Config.WHATSAPP_APP_SECRET.encode(), cuerpo, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(esperada, encabezado or "")
+
+
+def cargar_json(cuerpo):
     """
-    Procesa el mensaje de WhatsApp en un hilo separado para evitar retrasos en la respuesta.
+    Decodifica el cuerpo del webhook con orjson si está instalado (o con json). Devuelve None si no es JSON válido.
     """
     try:
-        # 📌 Validar estructura antes de acceder a los índices
-        entry = data.get("entry", [])
-        if not entry:
-            print("⚠️ Error: 'entry' no encontrado en el JSON")
-            return
+        return orjson.loads(cuerpo) if orjson else json.loads(cuerpo)
+    except ValueError:
+        return None
 
-        changes = entry[0].get("changes", [])
-        if not changes:
-            print("⚠️ Error: 'changes' no encontrado en el JSON")
-            return
 
-        value = changes[0].get("value", {})
-        contacts = value.get("contacts", [])
-        messages = value.get("messages", [])
+def encolar_entrega(data):
+    """
+    Guarda todos los mensajes de una entrega en la cola persistente, en una sola transacción.
+    Devuelve la cantidad de mensajes encolados (0 si era un callback de estado u otro evento sin mensajes)
+    y lanza la excepción si no se pudo escribir en la cola.
+    """
+    # 📌 Una entrega de Meta puede traer varias entradas, cambios y mensajes: un trabajo por mensaje
+    trabajos = [
+        (message_id, telefono, json.dumps(payload)) for message_id, telefono, payload in separar_mensajes(data)
+    ]
+    if not trabajos:
+        contar("webhooks_recibidos_total", resultado="sin_mensaje")
+        return 0
 
-        if not contacts or not messages:
-            print("⚠️ Error: 'contacts' o 'messages' no encontrados en el JSON")
-            return
+    try:
+        with medir("webhook_encolar_duracion_segundos"):
+            encolar_lote(trabajos)
+    except Exception as e:
+        contar("webhooks_recibidos_total", resultado="error")
+        print(f"⚠️ No se pudieron encolar los mensajes {[trabajo[0] for trabajo in trabajos]}: {e}")
+        raise
+
+    contar("webhooks_recibidos_total", resultado="encolado")
+    contar("mensajes_encolados_total", len(trabajos))
+    return len(trabajos)
+
+
+@metricas_bp.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Métricas del proceso en formato de texto de Prometheus.
+    """
+    return Response(exponer(), mimetype="text/plain; version=0.0.4")
+
+
+def separar_mensajes(data):
+    """
+    Recorre todas las entradas, cambios y mensajes de una entrega de Meta.
+    Por cada mensaje devuelve (message_id, telefono, payload), donde `payload` tiene la misma forma
+    que el webhook original pero con ese único mensaje y el contacto de su remitente.
+    """
+    if not isinstance(data, dict):
+        return
+
+    for entry in data.get("entry") or []:
+        for change in entry.get("changes") or []:
+            value = change.get("value") or {}
+            contactos = value.get("contacts") or []
+
+            for mensaje in value.get("messages") or []:
+                message_id = mensaje.get("id", "")
+                if not message_id:
+                    continue
+
+                telefono = mensaje.get("from") or (contactos[0].get("wa_id", "") if contactos else "")
+                contacto = next((c for c in contactos if c.get("wa_id") == telefono), contactos[0] if contactos else None)
+
+                valor = {clave: v for clave, v in value.items() if clave not in ("contacts", "messages")}
+                valor["contacts"] = [contacto] if contacto else []
+                valor["messages"] = [mensaje]
+
+                yield message_id, telefono, {
+                    "object": data.get("object"),
+                    "entry": [{"id": entry.get("id"), "changes": [{"field": change.get("field"), "value": valor}]}]
+                }
+
+
+def _leer_mensaje(data):
+    """
+    Extrae los datos del mensaje de un payload de un solo mensaje (ver `separar_mensajes`).
+    Devuelve None si no trae contacto y mensaje, o si no es texto ni documento.
+    """
+    # 📌 Validar estructura antes de acceder a los índices
+    entry = data.get("entry", [])
+    if not entry:
+        print("⚠️ Error: 'entry' no encontrado en el JSON")
+        return None
+
+    changes = entry[0].get("changes", [])
+    if not changes:
+        print("⚠️ Error: 'changes' no encontrado en el JSON")
+        return None
+
+    value = changes[0].get("value", {})
+    contacts = value.get("contacts", [])
+    messages = value.get("messages", [])
+
+    if not contacts or not messages:
+        print("⚠️ Error: 'contacts' o 'messages' no encontrados en el JSON")
+        return None
+
+    mensaje = messages[0]
+    message_type = mensaje.get("type", "")
+
+    if message_type == "text":
+        message_body = mensaje.get("text", {}).get("body", "").strip()
+    elif message_type == "document":
+        message_body = mensaje["document"].get("caption", "").strip()
+    else:
+        return None  # 🚀 No procesamos si no es texto ni documento
 
-        phone_number = contacts[0].get("wa_id", "Desconocido")
-        message_type = messages[0].get("type", "")
-        message_id = messages[0].get("id", "")
+    return {
+        "id": mensaje.get("id", ""),
+        "telefono": contacts[0].get("wa_id", "Desconocido"),
+        "tipo": message_type,
+        "cuerpo": message_body,
+        "mensaje": mensaje
+    }
 
-        if message_type == "text":
-            message_body = messages[0].get("text", {}).get("body", "").strip()
-        elif message_type == "document":
-            message_body = messages[0]["document"].get("caption", "").strip()
+
+def registrar_mensajes(payloads):
+    """
+    Registra en la base de datos los mensajes de un lote (payloads de un solo mensaje) con una sola
+    transacción de `RegistrarWebhook`, y devuelve alineado con `payloads` si cada mensaje es nuevo.
+    Si la transacción del lote falla por un mensaje (no por la conexión), se registra de a uno y en la
+    posición de cada mensaje que falle se devuelve su excepción, para que la cola reintente solo ese.
+    Los IDs ya registrados por otro nodo se descartan sin consultar la base de datos, y los que ya registró
+    esta misma cola se dan por nuevos (la cola no los vuelve a pasar por aquí salvo tras una caída).
+    Lo que no es texto ni documento no se registra.
+    Si otro nodo está registrando alguno de los mensajes, lanza una excepción para que la cola reintente el lote.
+    Si la caché compartida falla, decide solo `RegistrarWebhook`.
+    """
+    mensajes = [_leer_mensaje(data) for data in payloads]
+    nuevos = [False] * len(payloads)
+    cache = obtener_cache()
+
+    por_registrar = []
+    ocupados = []
+    for posicion, mensaje in enumerate(mensajes):
+        if mensaje is None:
+            continue
+        if not mensaje["id"]:
+            por_registrar.append(posicion)
+            continue
+
+        estado = _reservar_mensaje(cache, mensaje["id"])
+        if estado == "registrado":
+            contar("mensajes_repetidos_total", origen="cache")
+            print(f"🚀 Mensaje con ID {mensaje['id']} ya registrado por otro nodo. Ignorando.")
+        elif estado == "propio":
+            nuevos[posicion] = True  # Esta cola ya lo registró (p. ej. se cayó antes de anotarlo): se procesa
+        elif estado == "ocupado":
+            ocupados.append(mensaje["id"])
         else:
-            return  # 🚀 No procesamos si no es texto ni documento
-        
-        # 📌 Convertir `data` a un string JSON válido
-        data_json = json.dumps(data)  # Convierte `data` a un string JSON antes de enviarlo a MySQL
+            por_registrar.append(posicion)
+
+    if ocupados:
+        raise RuntimeError(f"Otro nodo está registrando los mensajes {ocupados}")
+    if not por_registrar:
+        return nuevos
+
+    # 📌 Un solo viaje a MySQL por lote; si falla la conexión, no queda registrado ninguno y la cola reintenta todo el lote
+    try:
+        existentes = _registrar_en_bd(mensajes, payloads, por_registrar)
+    except ERRORES_CONEXION:
+        raise
+    except Exception as e:
+        if len(por_registrar) == 1:
+            raise
+        print(f"⚠️ Falló el registro del lote ({e}), se registra mensaje por mensaje")
+        existentes = _registrar_de_a_uno(mensajes, payloads, por_registrar)
+
+    print(f"ℹ️ Mensajes registrados: {len(por_registrar)}")
+
+    for posicion in por_registrar:
+        if isinstance(existentes[posicion], Exception):
+            nuevos[posicion] = existentes[posicion]
+            continue
+
+        if mensajes[posicion]["id"]:
+            # Ya quedó registrado en la base de datos: un fallo de la caché no debe perder el mensaje
+            try:
+                cache.guardar(
+                    _clave_mensaje(mensajes[posicion]["id"]), ("registrado", DUENO_COLA), Config.DEDUP_TTL_SEGUNDOS
+                )
+            except Exception as e:
+                print(f"⚠️ No se pudo anotar el mensaje {mensajes[posicion]['id']} en la caché compartida: {e}")
+
+        if existentes[posicion] > 0:
+            contar("mensajes_repetidos_total", origen="base_datos")
+            print(f"🚀 Mensaje con ID {mensajes[posicion]['id']} ya procesado. Ignorando.")
+        else:
+            nuevos[posicion] = True  # ✅ Evita el doble procesamiento
+
+    return nuevos
+
+
+def _registrar_en_bd(mensajes, payloads, posiciones):
+    """
+    Llama a `RegistrarWebhook` por cada posición en una sola transacción.
+    Devuelve {posición: cantidad de registros previos con ese ID}.
+    """
+    existentes = {}
+    with transaccion() as cursor:
+        for posicion in posiciones:
+            mensaje = mensajes[posicion]
+            existe = 0
+            resultados = llamar_sp(
+                cursor, "RegistrarWebhook",
+                (mensaje["id"], mensaje["telefono"], mensaje["cuerpo"], json.dumps(payloads[posicion]), existe)
+            )
+            existentes[posicion] = resultados[0][0][0] if resultados and resultados[0] else 0
+    return existentes
+
+
+def _registrar_de_a_uno(mensajes, payloads, posiciones):
+    """
+    Registra cada mensaje en su propia transacción. Los que fallan quedan con su excepción;
+    si se cae la conexión, los que faltan quedan con ese error sin intentarlos.
+    """
+    existentes = {}
+    for numero, posicion in enumerate(posiciones):
+        try:
+            existentes.update(_registrar_en_bd(mensajes, payloads, [posicion]))
+        except ERRORES_CONEXION as e:
+            existentes.update((pendiente, e) for pendiente in posiciones[numero:])
+            break
+        except Exception as e:
+            print(f"⚠️ No se pudo registrar el mensaje {mensajes[posicion]['id']}: {e}")
+            existentes[posicion] = e
+    return existentes
 
-        # 📌 Llamar al procedimiento almacenado para verificar si el mensaje ya se procesó
-        existe = 0
-        
-        resultados = ejecutar_sp("RegistrarWebhook", (message_id, phone_number, message_body, data_json, existe))
 
-        print(f"ℹ️ Procesando mensaje: {resultados}")
+def _clave_mensaje(message_id):
+    return f"webhook:{message_id}"
 
-        if resultados and resultados[0][0][0] > 0:
-            print(f"🚀 Mensaje con ID {message_id} ya procesado. Ignorando.")
-            return  # ✅ Evita el doble procesamiento
+
+def _reservar_mensaje(cache, message_id):
+    """
+    Reserva el ID por `Config.DEDUP_RESERVA_SEGUNDOS` antes de registrarlo. Devuelve "reservado" si esta cola
+    puede registrarlo (también si ya lo había reservado ella), "propio" si esta misma cola ya lo registró,
+    "registrado" si lo registró otra cola u "ocupado" si otra cola lo está registrando en este momento.
+    Si la caché compartida falla devuelve "reservado": la base de datos sigue evitando los duplicados.
+    """
+    clave = _clave_mensaje(message_id)
+    try:
+        if cache.guardar_si_no_existe(clave, ("reservado", DUENO_COLA), Config.DEDUP_RESERVA_SEGUNDOS):
+            return "reservado"
+        actual = cache.obtener(clave)
+    except Exception as e:
+        print(f"⚠️ Caché compartida no disponible al reservar el mensaje {message_id}: {e}")
+        return "reservado"
+
+    if actual is None:
+        return "reservado"  # Venció justo ahora: `RegistrarWebhook` decide
+    estado, dueno = actual
+    if dueno == DUENO_COLA:
+        return "propio" if estado == "registrado" else "reservado"
+    return "registrado" if estado == "registrado" else "ocupado"
+
+
+def procesar_mensaje(data):
+    """
+    Registra y atiende todos los mensajes de una entrega de WhatsApp.
+    La cola persistente hace lo mismo en dos pasos: `registrar_mensajes` por lote y `atender_mensaje` por mensaje.
+    """
+    payloads = [payload for _, _, payload in separar_mensajes(data)]
+
+    for payload, nuevo in zip(payloads, registrar_mensajes(payloads)):
+        if isinstance(nuevo, Exception):
+            raise nuevo
+        if nuevo:
+            atender_mensaje(payload)
+
+
+def atender_mensaje(data):
+    """
+    Procesa un mensaje ya registrado según su contenido (reporte, pedido o carga de artículos).
+    Los errores se propagan para que la cola persistente reintente el mensaje.
+    """
+    try:
+        datos = _leer_mensaje(data)
+        if datos is None:
+            return
+
+        phone_number = datos["telefono"]
+        message_type = datos["tipo"]
+        message_body = datos["cuerpo"]
+        mensaje = datos["mensaje"]
 
         # 📌 Procesar reporte
         if message_body.lower().startswith("reporte:"):
-            procesar_reporte(message_body, phone_number)
+            with medir("mensaje_duracion_segundos", tipo="reporte"):
+                procesar_reporte(message_body, phone_number)
 
         # 📌 Procesar pedido
         elif message_body.lower().startswith("pedido:"):
-            procesar_pedido(message_body, phone_number)
+            with medir("mensaje_duracion_segundos", tipo="pedido"):
+                procesar_pedido(message_body, phone_number)
 
         # 📌 Procesar carga de artículos desde un archivo Excel
         elif message_body.lower().startswith("agregar articulo"):
             if message_type != "document":
                 return
 
-            document_id = messages[0]["document"]["id"]
-            filename = messages[0]["document"]["filename"]
-            mime_type = messages[0]["document"]["mime_type"]
+            document_id = mensaje["document"]["id"]
+            filename = mensaje["document"]["filename"]
+            mime_type = mensaje["document"]["mime_type"]
 
             if mime_type not in [
                 "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
@@ -102,18 +387,21 @@ def procesar_mensaje(data):
             if not file_url:
                 return
 
-            file_path = os.path.join(BASE_DIR, filename)
-
-            response = requests.get(file_url, headers={"Authorization": f"Bearer {os.getenv('WHATSAPP_API_TOKEN')}"})
-
-            if response.status_code == 200:
-                with open(file_path, "wb") as file:
-                    file.write(response.content)
+            # 📌 Descargar por bloques a un archivo temporal (con límite de tamaño y checksum)
+            headers = {"Authorization": f"Bearer {os.getenv('WHATSAPP_API_TOKEN')}"}
+            file_path, checksum = descargar_documento(file_url, headers, sufijo=os.path.splitext(filename)[1])
+            if not file_path:
+                return
 
-                insertar_articulos_desde_excel(file_path)
+            try:
+                with medir("mensaje_duracion_segundos", tipo="articulos"):
+                    insertar_articulos_desde_excel(file_path, checksum=checksum, phone_number=phone_number)
+            finally:
+                os.remove(file_path)
 
     except Exception as e:
         print(f"⚠️ Error procesando mensaje: {e}")
+        raise
 
 
 def obtener_url_documento(document_id):
@@ -123,7 +411,7 @@ def obtener_url_documento(document_id):
     try:
         url = f"https://graph.facebook.com/v16.0/{document_id}"
         headers = {"Authorization": f"Bearer {os.getenv('WHATSAPP_API_TOKEN')}"}
-        response = requests.get(url, headers=headers)
+        response = solicitar("GET", url, headers=headers)
 
         if response.status_code == 200:
             return response.json().get("url")
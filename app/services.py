@@ -1,55 +1,80 @@
-from flask import jsonify
-from app.database import ejecutar_sp
-from app.whatsapp import enviar_mensaje_whatsapp
-from datetime import datetime, timedelta
-from rapidfuzz import process
-
-
-import pandas as pd
-
-def insertar_articulos_desde_excel(file_path):
+from app.database import ejecutar_sp, transaccion, llamar_sp
+from app.whatsapp import enviar_mensaje_whatsapp, enviar_documento_whatsapp
+from app.importacion import (
+    validar_columnas, importar_catalogo, leer_columnas_excel, leer_excel_por_lotes,
+    calcular_checksum, ya_importado, registrar_importacion, resumen_importacion
+)
+from app.indices import (
+    normalizar_texto, obtener_indice_productos, invalidar_indice_productos, candidatos_productos,
+    obtener_indice_clientes, agregar_cliente_al_indice
+)
+from app.reportes import (
+    obtener_resumen_por_articulo, acumular_lineas, reporte_en_cache, guardar_reporte_en_cache
+)
+from app.fechas import interpretar_fecha, interpretar_rango
+from rapidfuzz import process, fuzz
+from app.config import Config
+from app.metricas import contar, medir
+from app.alias import buscar_alias, buscar_alternativa, aprender_alias
+from app.facturas import Factura
+
+
+import csv
+import os
+import tempfile
+import numpy as np
+
+def insertar_articulos_desde_excel(file_path, checksum=None, phone_number=None, forzar=False):
     """
     Procesa un archivo Excel e inserta los artículos en la base de datos.
+    Lee la hoja por bloques de `Config.IMPORTACION_LOTE` filas, omite archivos con el mismo
+    checksum que una importación anterior y solo escribe los productos nuevos o modificados.
+    Si se indica `phone_number`, envía un resumen por WhatsApp.
+    Devuelve un reporte con los artículos insertados, actualizados, sin cambios y rechazados por fila.
     """
-    try:
-        # Leer el archivo de Excel
-        df = pd.read_excel(file_path)
+    resultado = _importar_articulos(file_path, checksum, forzar)
 
-        # Verificar que contiene las columnas necesarias
-        required_columns = ['Descripcion', 'Presentacion', 'Codigo', 'Institucional', 'Mayorista']
-        for col in required_columns:
-            if col not in df.columns:
-                return {"error": f"El archivo no contiene la columna requerida: {col}"}
+    if phone_number:
+        if "error" in resultado:
+            enviar_mensaje_whatsapp(phone_number, f"❌ No se pudieron importar los artículos: {resultado['error']}")
+        elif resultado.get("omitido"):
+            enviar_mensaje_whatsapp(phone_number, "ℹ️ Este archivo ya había sido importado, no hay cambios.")
+        else:
+            enviar_mensaje_whatsapp(phone_number, resumen_importacion(resultado))
 
-        # Limpiar y normalizar los datos
-        df = df.dropna(subset=['Descripcion', 'Presentacion', 'Codigo'])  # Eliminar filas vacías
-        df['Presentacion'] = df['Presentacion'].str.strip().str.lower().str.capitalize()
+    return resultado
 
-        # Insertar presentaciones y productos en la base de datos
-        for _, row in df.iterrows():
-            descripcion = row['Descripcion'].replace("'", "''")  # Escapar comillas
-            presentacion = row['Presentacion'].replace("'", "''")
-            codigo = row['Codigo']
-            precio_institucional = row['Institucional'] if not pd.isna(row['Institucional']) else 0
-            precio_mayorista = row['Mayorista'] if not pd.isna(row['Mayorista']) else 0
 
-            # Insertar presentación y obtener ID
-            resultado = ejecutar_sp("InsertarPresentacion", (presentacion, 0))
+def _importar_articulos(file_path, checksum, forzar):
+    escribiendo = False
+    try:
+        checksum = checksum or calcular_checksum(file_path)
+        if not forzar and ya_importado(checksum):
+            print(f"ℹ️ El archivo {file_path} ya fue importado (checksum {checksum[:12]}). Se omite.")
+            return {"message": "El archivo ya había sido importado", "omitido": True}
 
-            # 📌 Asegurar que `InsertarPresentacion` devolvió un ID válido
-            if resultado and len(resultado[0]) > 0:
-                id_presentacion = resultado[0][0][0]  # Extraer el ID de la presentación
-            else:
-                return {"error": f"No se pudo obtener un ID para la presentación '{presentacion}'"}
+        # Verificar que contiene las columnas necesarias
+        faltante = validar_columnas(leer_columnas_excel(file_path))
+        if faltante:
+            return {"error": f"El archivo no contiene la columna requerida: {faltante}"}
 
-            # Insertar producto
-            ejecutar_sp("InsertarProducto", (descripcion, codigo, id_presentacion, precio_institucional, precio_mayorista,0))
+        # Leer el archivo por bloques e insertar solo lo que cambió, en una sola transacción
+        escribiendo = True
+        reporte = importar_catalogo(leer_excel_por_lotes(file_path, Config.IMPORTACION_LOTE), forzar=forzar)
+        registrar_importacion(checksum, os.path.basename(file_path), reporte)
+        print(f"📦 Importación: {reporte['insertados']} insertados, {reporte['actualizados']} actualizados, "
+              f"{reporte['sin_cambios']} sin cambios, {reporte['rechazados']} rechazados")
 
-        return {"message": "Artículos agregados correctamente"}
+        return {"message": "Artículos agregados correctamente", **reporte}
 
     except Exception as e:
         return {"error": str(e)}
 
+    finally:
+        # 📌 El catálogo cambió (aunque sea parcialmente): forzar recarga del índice en todos los procesos
+        if escribiendo:
+            invalidar_indice_productos()
+
 
 def procesar_reporte(message_body, phone_number):
     """
@@ -58,16 +83,15 @@ def procesar_reporte(message_body, phone_number):
     lines = message_body.split("\n")
     if len(lines) > 1:
         fecha_str = lines[1].strip()
-        fecha_inicio, fecha_fin = procesar_fechas_reporte(fecha_str)
+        fecha_inicio, fecha_fin = interpretar_rango(fecha_str)
 
         if fecha_inicio and fecha_fin:
-            reporte = obtener_reporte_por_articulo(fecha_inicio, fecha_fin)
-            enviar_mensaje_whatsapp(phone_number, reporte)
-            return jsonify({"message": "Reporte enviado con éxito"}), 200
+            enviar_reporte_por_articulo(fecha_inicio, fecha_fin, phone_number)
+            return {"message": "Reporte enviado con éxito"}, 200
         else:
-            return jsonify({"error": "Formato de fecha inválido"}), 400
+            return {"error": "Formato de fecha inválido"}, 400
     
-    return jsonify({"error": "Formato inválido para el mensaje de reporte."}), 400
+    return {"error": "Formato inválido para el mensaje de reporte."}, 400
 
 def procesar_pedido(message_body, phone_number):
     """
@@ -81,10 +105,10 @@ def procesar_pedido(message_body, phone_number):
     client_line = lines[1].strip().lower()  # Nombre del cliente
     fecha_entrega_str = lines[2].strip()  # Fecha de entrega
 
-    fecha_entrega = extraer_fecha_entrega(fecha_entrega_str)
+    fecha_entrega = interpretar_fecha(fecha_entrega_str)
 
     if fecha_entrega is None:
-        return jsonify({"error": "Formato de fecha de entrega inválido"}), 400
+        return {"error": "Formato de fecha de entrega inválido"}, 400
 
     # 📌 Determinar si es un cliente mayorista
     palabras_mayorista = ["mayorista", "wholesale", "distribuidor", "b2b"]
@@ -109,9 +133,9 @@ def procesar_pedido(message_body, phone_number):
     print(f"✅ Cliente encontrado: {mejor_nombre_cliente} (Similitud: {similitud_cliente}%)")
     print(f"📌 Tipo de cliente: {'Mayorista' if es_mayorista else 'Institucional'}")
 
-    # 📌 Procesar productos
-    id_factura = None
-    for line in lines[3:]:  # Procesar productos desde la cuarta línea
+    # 📌 Separar cantidad y nombre de cada línea de producto (desde la cuarta línea)
+    lineas_pedido = []
+    for line in lines[3:]:
         parts = line.split(" ", 1)
 
         # ✅ Evitar error de "list index out of range"
@@ -125,11 +149,16 @@ def procesar_pedido(message_body, phone_number):
             print(f"❌ Error: Cantidad inválida en línea -> '{line}'")  # Debugging
             continue
 
-        nombre_producto = parts[1].strip()
+        lineas_pedido.append((cantidad, parts[1].strip()))
+
+    # 📌 Buscar todos los productos del pedido en una sola pasada de coincidencia difusa
+    productos = buscar_productos_por_nombres([nombre for _, nombre in lineas_pedido])
 
-        # 📌 Buscar el producto en la base de datos con coincidencia difusa
-        producto = buscar_producto_por_nombre(nombre_producto)
+    # 📌 Armar la factura en memoria: con esto se registra y se arma la confirmación sin releerla
+    factura = Factura(id_cliente, mejor_nombre_cliente, fecha_entrega, es_mayorista)
 
+    # 📌 Procesar productos
+    for (cantidad, nombre_producto), producto in zip(lineas_pedido, productos):
         if producto is None:
             print(f"❌ Error: Producto no encontrado -> '{nombre_producto}'")  # Debugging
             continue
@@ -144,131 +173,159 @@ def procesar_pedido(message_body, phone_number):
         print(f"✅ Producto encontrado: {mejor_nombre_producto} (Similitud: {similitud_producto}%)")
         print(f"📌 Precio usado: {precio_producto} ({'Mayorista' if es_mayorista else 'Institucional'})")
 
-        if id_factura is None:
-            id_factura = crear_factura(id_cliente, fecha_entrega, es_mayorista)
+        factura.agregar_linea(id_producto, mejor_nombre_producto, cantidad, precio_producto)
 
-        insertar_linea_factura(id_factura, id_producto, cantidad, precio_producto)
+    # 📌 Guardar encabezado, líneas y total en una sola transacción
+    with medir("pedido_etapa_duracion_segundos", etapa="registro"):
+        id_factura = None
+        if factura.lineas:
+            id_factura = registrar_factura(id_cliente, fecha_entrega, es_mayorista, factura.lineas_para_registrar())
 
     if id_factura:
-        actualizar_total_factura(id_factura, phone_number)
+        factura.id_factura = id_factura
+        with medir("pedido_etapa_duracion_segundos", etapa="envio"):
+            enviar_confirmacion_factura(factura, phone_number)
         return {"message": f"Pedido registrado para {mejor_nombre_cliente} (ID: {id_cliente})"}, 200
     else:
         return {"error": "No se pudo crear la factura"}, 500
 
 
 
-def procesar_fechas_reporte(fecha_str):
+def enviar_reporte_por_articulo(fecha_inicio, fecha_fin, phone_number):
     """
-    Convierte diferentes formatos de fecha en un rango de fechas para la consulta.
+    Envía por WhatsApp el resumen de productos pedidos en un rango de fechas.
+    Si el reporte cabe en pocos mensajes se envía en partes de hasta `Config.WHATSAPP_MAX_CARACTERES`,
+    en orden; si tiene más de `Config.REPORTE_MAX_LINEAS_TEXTO` artículos se envía como archivo CSV.
     """
-    fecha_str = fecha_str.strip().lower()
-    hoy = datetime.today().strftime('%Y-%m-%d')
+    partes = reporte_en_cache(fecha_inicio, fecha_fin)
+
+    if partes is None:
+        total, filas = obtener_filas_reporte(fecha_inicio, fecha_fin)
 
-    if fecha_str == "hoy":
-        return hoy, hoy
+        if total > Config.REPORTE_MAX_LINEAS_TEXTO:
+            enviar_reporte_como_archivo(fecha_inicio, fecha_fin, filas, total, phone_number)
+            return
 
-    if "a hoy" in fecha_str:
-        fecha_inicio_str = fecha_str.split(" a hoy")[0].strip()
-        fecha_inicio = extraer_fecha_entrega(fecha_inicio_str)
-        return fecha_inicio, hoy
+        partes = list(generar_partes_reporte(fecha_inicio, fecha_fin, filas))
+        guardar_reporte_en_cache(fecha_inicio, fecha_fin, partes)
 
-    if fecha_str.isdigit():
-        dias = int(fecha_str)
-        fecha_inicio = (datetime.today() - timedelta(days=dias)).strftime('%Y-%m-%d')
-        return fecha_inicio, hoy
+    for parte in partes:
+        enviar_mensaje_whatsapp(phone_number, parte)
 
-    return None, None
 
-def obtener_reporte_por_articulo(fecha_inicio, fecha_fin):
+def obtener_filas_reporte(fecha_inicio, fecha_fin):
     """
-    Obtiene un resumen de productos pedidos en un rango de fechas, incluyendo su presentación.
+    Obtiene (cantidad, filas) del resumen de productos pedidos en un rango de fechas, incluyendo su presentación.
+    Suma los resúmenes diarios precalculados; si no están disponibles consulta el rango directo en MySQL.
     """
-    resultados = ejecutar_sp("ObtenerReportePorArticulo", (fecha_inicio, fecha_fin))
-
-    if resultados and len(resultados[0]) > 0:
-        reporte = f"📊 Reporte de pedidos desde {fecha_inicio} hasta {fecha_fin}:\n"
-        for item in resultados[0]:
-            id_producto = item[0]
-            nombre_producto = item[1]  # Ya viene en formato "Descripción (Presentación)"
-            cantidad_total = item[2]
+    try:
+        return obtener_resumen_por_articulo(fecha_inicio, fecha_fin)
+    except Exception as e:
+        print(f"⚠️ Resumen diario no disponible, se consulta el rango completo: {e}")
+        resultados = ejecutar_sp("ObtenerReportePorArticulo", (fecha_inicio, fecha_fin))
+        filas = resultados[0] if resultados else []
+        return len(filas), filas
 
-            reporte += f"- {cantidad_total}x {nombre_producto}\n"
 
-        return reporte
+def generar_partes_reporte(fecha_inicio, fecha_fin, filas, limite=None):
+    """
+    Genera el texto del reporte en partes que no superan `limite` caracteres (el máximo de WhatsApp).
+    """
+    limite = limite or Config.WHATSAPP_MAX_CARACTERES
+    encabezado = f"📊 Reporte de pedidos desde {fecha_inicio} hasta {fecha_fin}:\n"
+    continuacion = f"📊 Reporte {fecha_inicio} a {fecha_fin} (continuación):\n"
+
+    lineas = [encabezado]
+    largo = len(encabezado)
+    hay_filas = False
+
+    for item in filas:
+        id_producto = item[0]
+        nombre_producto = item[1]  # Ya viene en formato "Descripción (Presentación)"
+        linea = f"- {_formatear_cantidad(item[2])}x {nombre_producto}\n"
+        hay_filas = True
+
+        if largo + len(linea) > limite:
+            yield "".join(lineas)
+            lineas = [continuacion]
+            largo = len(continuacion)
+
+        lineas.append(linea[:limite - largo])
+        largo += len(lineas[-1])
+
+    if hay_filas:
+        yield "".join(lineas)
     else:
-        return f"No hay pedidos registrados entre {fecha_inicio} y {fecha_fin}."
+        yield f"No hay pedidos registrados entre {fecha_inicio} y {fecha_fin}."
 
 
-def procesar_fechas_reporte(fecha_str):
+def enviar_reporte_como_archivo(fecha_inicio, fecha_fin, filas, total, phone_number):
     """
-    Convierte diferentes formatos de fecha en un rango de fechas para la consulta.
+    Escribe el reporte fila por fila en un CSV temporal y lo envía como documento de WhatsApp.
     """
-    fecha_str = fecha_str.strip().lower()
-    hoy = datetime.today().strftime('%Y-%m-%d')
+    os.makedirs(Config.DATA_DIR, exist_ok=True)
+    descriptor, ruta = tempfile.mkstemp(suffix=".csv", dir=Config.DATA_DIR)
 
-    # Caso: "hoy"
-    if fecha_str == "hoy":
-        return hoy, hoy
+    try:
+        with os.fdopen(descriptor, "w", newline="", encoding="utf-8-sig") as archivo:
+            escritor = csv.writer(archivo)
+            escritor.writerow(["idProducto", "Producto", "Cantidad"])
+            for item in filas:
+                escritor.writerow([item[0], item[1], _formatear_cantidad(item[2])])
+
+        enviar_documento_whatsapp(
+            phone_number, ruta, f"reporte_{fecha_inicio}_{fecha_fin}.csv",
+            caption=f"📊 Reporte de pedidos desde {fecha_inicio} hasta {fecha_fin} ({total} artículos)"
+        )
+    finally:
+        os.remove(ruta)
 
-    # Caso: "20/02 a hoy"
-    if "a hoy" in fecha_str:
-        fecha_inicio_str = fecha_str.split(" a hoy")[0].strip()
-        fecha_inicio = extraer_fecha_entrega(fecha_inicio_str)
-        return fecha_inicio, hoy
 
-    # Caso: "3" (últimos N días)
-    if fecha_str.isdigit():
-        dias = int(fecha_str)
-        fecha_inicio = (datetime.today() - timedelta(days=dias)).strftime('%Y-%m-%d')
-        return fecha_inicio, hoy
+def _formatear_cantidad(cantidad):
+    if isinstance(cantidad, float) and cantidad.is_integer():
+        return int(cantidad)
+    return cantidad
 
-    # Si la fecha no coincide con los formatos anteriores, devolver None
-    return None, None
 
-def actualizar_total_factura(id_factura, phone_number):
+def enviar_confirmacion_factura(factura, phone_number):
     """
-    Actualiza el total de una factura y envía un mensaje de WhatsApp con los detalles.
+    Envía por WhatsApp la confirmación de una factura recién registrada, armada desde la `Factura`
+    en memoria. Con `Config.FACTURA_VERIFICAR_BD` además la relee con 'ObtenerFacturaCompleta'
+    y, si el total o las líneas no coinciden, envía la versión de la base de datos.
     """
-    try:
-        ejecutar_sp("ActualizarTotalFactura", (id_factura,))
-        factura_info = obtener_factura_completa(id_factura)
-        
-        if factura_info:
-            enviar_mensaje_whatsapp(phone_number, factura_info)
-            print(f"Factura {id_factura} actualizada y mensaje enviado a {phone_number}")
-        else:
-            print(f"No se pudo obtener la información de la factura {id_factura}")
-    except Exception as e:
-        print(f"Error al actualizar el total de la factura {id_factura}: {e}")
+    mensaje = factura.como_mensaje()
+
+    if Config.FACTURA_VERIFICAR_BD:
+        mensaje = verificar_factura(factura) or mensaje
+
+    enviar_mensaje_whatsapp(phone_number, mensaje)
+    print(f"Factura {factura.id_factura} registrada y mensaje enviado a {phone_number}")
 
-def extraer_fecha_entrega(fecha_str):
+
+def verificar_factura(factura):
     """
-    Intenta convertir diferentes formatos de fecha a un formato estándar (YYYY-MM-DD).
-    Si la fecha es "hoy", usa la fecha actual.
+    Compara la factura en memoria con la guardada. Devuelve el mensaje armado desde la base de datos
+    si hay diferencias (o no se pudo leer la factura), o None si coinciden.
     """
-    fecha_str = fecha_str.strip().lower()
+    leida = _leer_factura_completa(factura.id_factura)
+    if leida is None:
+        contar("facturas_verificadas_total", resultado="error")
+        return None
 
-    if fecha_str == "hoy":
-        return datetime.today().strftime('%Y-%m-%d')
+    _, detalle_factura, total_factura = leida
+    if len(detalle_factura) == len(factura.lineas) and abs(float(total_factura[1]) - float(factura.total())) < 0.01:
+        contar("facturas_verificadas_total", resultado="igual")
+        return None
 
-    formatos = ['%d/%m/%Y', '%d/%m/%y', '%d/%m']  
-    for formato in formatos:
-        try:
-            fecha = datetime.strptime(fecha_str, formato)
-            
-            # Si el formato es "%d/%m" y no tiene año, asumimos el año actual.
-            if formato == '%d/%m':
-                fecha = fecha.replace(year=datetime.today().year)
-            
-            return fecha.strftime('%Y-%m-%d')
-        except ValueError:
-            continue
-    
-    return None
+    contar("facturas_verificadas_total", resultado="diferente")
+    print(f"⚠️ La factura {factura.id_factura} guardada no coincide con la armada en memoria "
+          f"(total {total_factura[1]} vs {factura.total()}, líneas {len(detalle_factura)} vs {len(factura.lineas)})")
+    return obtener_factura_completa(factura.id_factura)
 
-def obtener_factura_completa(id_factura):
+
+def _leer_factura_completa(id_factura):
     """
-    Obtiene los detalles completos de la factura usando el SP 'ObtenerFacturaCompleta'.
+    Devuelve (cliente_info, detalle_factura, total_factura) de 'ObtenerFacturaCompleta', o None.
     """
     resultados = ejecutar_sp("ObtenerFacturaCompleta", (id_factura,))
 
@@ -278,84 +335,218 @@ def obtener_factura_completa(id_factura):
         total_factura = resultados[2][0] if resultados[2] else None
 
         if cliente_info and total_factura:
-            mensaje = f"🧾 Factura #{id_factura}\n"
-            mensaje += f"👤 Cliente: {cliente_info[1]}\n📞 Teléfono: {cliente_info[3]}\n"
-            mensaje += f"📅 Fecha: {cliente_info[4]}\n🚚 Entrega: {cliente_info[5]}\n"
-            mensaje += f"🛒 Tipo: {cliente_info[6]}\n"
-            mensaje += "📦 Detalle:\n"
-            for item in detalle_factura:
-                mensaje += f"- {item[3]}x {item[2]} (₡{item[4]} c/u) = ₡{item[5]}\n"
-
-            mensaje += f"\n💰 Total: ₡{total_factura[1]}"
-            return mensaje
+            return cliente_info, detalle_factura, total_factura
     return None
 
 
+def obtener_factura_completa(id_factura):
+    """
+    Obtiene los detalles completos de la factura usando el SP 'ObtenerFacturaCompleta'.
+    """
+    leida = _leer_factura_completa(id_factura)
+
+    if leida:
+        cliente_info, detalle_factura, total_factura = leida
+        mensaje = f"🧾 Factura #{id_factura}\n"
+        mensaje += f"👤 Cliente: {cliente_info[1]}\n📞 Teléfono: {cliente_info[3]}\n"
+        mensaje += f"📅 Fecha: {cliente_info[4]}\n🚚 Entrega: {cliente_info[5]}\n"
+        mensaje += f"🛒 Tipo: {cliente_info[6]}\n"
+        mensaje += "📦 Detalle:\n"
+        for item in detalle_factura:
+            mensaje += f"- {item[3]}x {item[2]} (₡{item[4]} c/u) = ₡{item[5]}\n"
+
+        mensaje += f"\n💰 Total: ₡{total_factura[1]}"
+        return mensaje
+    return None
+
 
-from rapidfuzz import process
 
 def buscar_producto_por_nombre(nombre_producto):
     """
     Busca el producto más parecido usando similitud de texto con RapidFuzz.
-    Si la similitud es menor al 30%, lo ignora.
+    Usa el índice del catálogo en memoria, por lo que no consulta la base de datos mientras esté vigente.
+    Si el texto ya tiene un alias aprendido (y el producto sigue en el catálogo) no se puntúa nada.
+    Con catálogos grandes solo puntúa los candidatos del prefiltro por trigramas.
+    Si la similitud es menor al 90%, lo ignora.
     """
-    resultados = ejecutar_sp("ObtenerProductos", ())
+    indice = obtener_indice_productos()
 
-    if not resultados or len(resultados[0]) == 0:
+    if not indice or len(indice["ids"]) == 0:
         return None  # No hay productos en la base de datos
 
-    productos = resultados[0]  # Lista de productos [(idProducto, nombre, precioInstitucional, precioMayorista)]
-
-    # Crear un diccionario con idProducto como clave y (nombre, precioInstitucional, precioMayorista) como valor
-    productos_dict = {producto[0]: (producto[1], producto[2], producto[3]) for producto in productos}
+    consulta = normalizar_texto(nombre_producto)
+    id_alias = buscar_alias("producto", consulta)
+    if id_alias in indice["por_id"]:
+        contar("alias_consultas_total", tipo="producto", resultado="acierto")
+        return _producto_con_id(indice, id_alias, 100.0)
+    contar("alias_consultas_total", tipo="producto", resultado="fallo")
 
-    # Buscar coincidencias con RapidFuzz (ahora usando el nombre formateado con la presentación)
-    mejor_coincidencia = process.extractOne(
-        nombre_producto, [p[0] for p in productos_dict.values()], score_cutoff=90
-    )
+    # Buscar coincidencias con RapidFuzz sobre los nombres ya preprocesados ("Descripción (Presentación)")
+    with medir("match_duracion_segundos", tipo="producto"):
+        posiciones = candidatos_productos(indice, [consulta])
+        opciones = indice["opciones"] if posiciones is None else [indice["opciones"][p] for p in posiciones]
+        mejor_coincidencia = process.extractOne(consulta, opciones, processor=None, score_cutoff=90)
 
     if mejor_coincidencia:
-        mejor_nombre, similitud, _ = mejor_coincidencia
-
-        # Buscar el ID del producto con el mejor nombre
-        id_producto = next(
-            (id for id, (nombre, precio_inst, precio_may) in productos_dict.items() if nombre == mejor_nombre), None
-        )
-
-        if id_producto:
-            return {
-                "idProducto": id_producto,
-                "nombreProducto": mejor_nombre,
-                "precioInstitucional": productos_dict[id_producto][1],
-                "precioMayorista": productos_dict[id_producto][2],
-                "similitud": similitud
-            }
+        _, similitud, posicion = mejor_coincidencia
+        if posiciones is not None:
+            posicion = posiciones[posicion]  # Posición dentro de los candidatos -> posición en el catálogo
+        producto = _producto_en_posicion(indice, posicion, similitud)
+        aprender_alias("producto", consulta, producto["idProducto"], similitud)
+        return producto
     #print(f"No se encontró un producto similar a '{nombre_producto}'")
     return None  
 
 
-def crear_factura(id_cliente, fecha_entrega, es_mayorista):
+def buscar_productos_por_nombres(nombres_productos):
     """
-    Crea una factura para un cliente con fecha de entrega y devuelve su ID.
+    Busca varios productos a la vez: puntúa todas las líneas del pedido contra el catálogo
+    (o contra la unión de sus candidatos por trigramas, si es grande) con una sola llamada
+    a `process.cdist` repartida en varios hilos. Las líneas con alias aprendido no se puntúan:
+    su "alternativa" es la que se guardó al aprenderlo (None si el alias es manual, se aprendió en
+    una búsqueda individual o esa opción ya no está en el catálogo).
+    Devuelve una lista alineada con `nombres_productos`; cada elemento es None si la similitud
+    es menor al 90%, o el producto encontrado con su segunda mejor opción en "alternativa".
     """
-    descripcion = "Mayorista" if es_mayorista else "Institucional"
-    
-    resultados = ejecutar_sp("CrearFactura", (id_cliente, fecha_entrega, descripcion, 0))
+    if not nombres_productos:
+        return []
+
+    indice = obtener_indice_productos()
+
+    if not indice or len(indice["ids"]) == 0:
+        return [None] * len(nombres_productos)  # No hay productos en la base de datos
+
+    consultas = [normalizar_texto(nombre) for nombre in nombres_productos]
+    encontrados = [None] * len(consultas)
 
-    if resultados is not None:
-        id_factura = resultados[0][0][0]  # ID generado por la base de datos
-        print(f"Factura insertada con ID: {id_factura}, Fecha de entrega: {fecha_entrega}, Tipo: {descripcion}")
+    # 📌 Primero los alias aprendidos: las líneas que ya se conocen no se puntúan
+    pendientes = []
+    for fila, consulta in enumerate(consultas):
+        id_alias = buscar_alias("producto", consulta)
+        if id_alias in indice["por_id"]:
+            encontrados[fila] = _producto_con_id(indice, id_alias, 100.0)
+            encontrados[fila]["alternativa"] = _alternativa_guardada(indice, consulta)
+        else:
+            pendientes.append(fila)
+
+    contar("alias_consultas_total", len(consultas) - len(pendientes), tipo="producto", resultado="acierto")
+    contar("alias_consultas_total", len(pendientes), tipo="producto", resultado="fallo")
+    if not pendientes:
+        return encontrados
+
+    por_puntuar = [consultas[fila] for fila in pendientes]
+    with medir("match_duracion_segundos", tipo="productos_lote"):
+        posiciones = candidatos_productos(indice, por_puntuar)
+        opciones = indice["opciones"] if posiciones is None else [indice["opciones"][p] for p in posiciones]
+        if not opciones:
+            return encontrados
+
+        puntajes = process.cdist(
+            por_puntuar, opciones, scorer=fuzz.WRatio, processor=None, workers=Config.MATCH_WORKERS
+        )
+
+    # 📌 Las dos mejores columnas de cada fila: mejor coincidencia y segunda opción
+    if puntajes.shape[1] > 1:
+        mejores = np.argpartition(puntajes, -2, axis=1)[:, -2:]
     else:
-        print("Error al insertar la factura.")
-        id_factura = None
+        mejores = np.zeros((len(por_puntuar), 1), dtype=np.intp)
+
+    # Columna de `puntajes` -> posición en el catálogo
+    en_catalogo = np.arange(len(opciones)) if posiciones is None else posiciones
+
+    for fila_puntajes, columnas in enumerate(mejores):
+        columnas = sorted(columnas, key=lambda c: puntajes[fila_puntajes, c], reverse=True)
+        posicion = columnas[0]
+        similitud = float(puntajes[fila_puntajes, posicion])
+
+        if similitud < 90:
+            continue
+
+        producto = _producto_en_posicion(indice, en_catalogo[posicion], similitud)
+        producto["alternativa"] = None
+        if len(columnas) > 1 and puntajes[fila_puntajes, columnas[1]] > 0:
+            alternativa = _producto_en_posicion(
+                indice, en_catalogo[columnas[1]], float(puntajes[fila_puntajes, columnas[1]])
+            )
+            producto["alternativa"] = {
+                "idProducto": alternativa["idProducto"],
+                "nombreProducto": alternativa["nombreProducto"],
+                "similitud": alternativa["similitud"]
+            }
+
+        fila = pendientes[fila_puntajes]
+        encontrados[fila] = producto
+        alternativa = producto["alternativa"]
+        aprender_alias(
+            "producto", consultas[fila], producto["idProducto"], similitud,
+            alternativa=(alternativa["idProducto"], alternativa["similitud"]) if alternativa else None
+        )
+
+    return encontrados
+
+
+def _alternativa_guardada(indice, consulta):
+    guardada = buscar_alternativa("producto", consulta)
+    if guardada is None or guardada[0] not in indice["por_id"]:
+        return None
+
+    id_producto, similitud = guardada
+    return {
+        "idProducto": id_producto,
+        "nombreProducto": indice["por_id"][id_producto][0],
+        "similitud": similitud
+    }
 
-    return id_factura
 
-def insertar_linea_factura(id_factura, id_producto, cantidad,precio_producto):
+def _producto_en_posicion(indice, posicion, similitud):
+    # La posición de la opción indica directamente el ID del producto
+    return _producto_con_id(indice, indice["ids"][posicion], similitud)
+
+
+def _producto_con_id(indice, id_producto, similitud):
+    mejor_nombre, precio_institucional, precio_mayorista = indice["por_id"][id_producto]
+
+    return {
+        "idProducto": id_producto,
+        "nombreProducto": mejor_nombre,
+        "precioInstitucional": precio_institucional,
+        "precioMayorista": precio_mayorista,
+        "similitud": similitud
+    }
+
+
+def _acumular_en_resumen(lineas):
+    # El resumen diario es solo una optimización: un fallo aquí no debe afectar la factura
+    try:
+        acumular_lineas(lineas)
+    except Exception as e:
+        print(f"⚠️ No se pudo actualizar el resumen diario: {e}")
+
+
+def registrar_factura(id_cliente, fecha_entrega, es_mayorista, lineas):
     """
-    Inserta una línea de factura.
+    Crea la factura, inserta todas sus líneas [(idProducto, cantidad, precio)] y calcula el total
+    en una sola conexión y transacción. Si algo falla no queda ninguna factura incompleta.
+    Devuelve el ID de la factura o None.
     """
-    ejecutar_sp("InsertarLineaFactura", (id_factura, id_producto, cantidad, precio_producto,0))
+    descripcion = "Mayorista" if es_mayorista else "Institucional"
+
+    try:
+        with transaccion() as cursor:
+            resultados = llamar_sp(cursor, "CrearFactura", (id_cliente, fecha_entrega, descripcion, 0))
+            id_factura = resultados[0][0][0]  # ID generado por la base de datos
+
+            for id_producto, cantidad, precio_producto in lineas:
+                llamar_sp(cursor, "InsertarLineaFactura", (id_factura, id_producto, cantidad, precio_producto, 0))
+
+            llamar_sp(cursor, "ActualizarTotalFactura", (id_factura,))
+    except Exception as e:
+        print(f"Error al registrar la factura, se revirtió la transacción: {e}")
+        return None
+
+    print(f"Factura insertada con ID: {id_factura}, Fecha de entrega: {fecha_entrega}, Tipo: {descripcion}, Líneas: {len(lineas)}")
+    _acumular_en_resumen([(id_producto, cantidad) for id_producto, cantidad, _ in lineas])
+    return id_factura
 
 
 def buscar_o_insertar_cliente(nombre_cliente, telefono):
@@ -374,6 +565,7 @@ def buscar_o_insertar_cliente(nombre_cliente, telefono):
         resultados = ejecutar_sp("InsertarCliente", (nombre_cliente, telefono, 0))
         if resultados is not None:
             id_cliente = resultados[0][0][0]  # ID generado por la base de datos
+            agregar_cliente_al_indice(id_cliente, nombre_cliente)
             print(f"Cliente insertado con ID: {id_cliente}")
         else:
             print("Error al insertar el cliente.")
@@ -385,36 +577,38 @@ def buscar_o_insertar_cliente(nombre_cliente, telefono):
 def buscar_cliente_por_nombre(nombre_cliente):
     """
     Busca el cliente más parecido usando similitud de texto con RapidFuzz.
+    Compara contra el índice de clientes en memoria (nombres en minúsculas y sin tildes),
+    salvo que el texto ya tenga un alias aprendido para un cliente que sigue existiendo.
     """
-    # Obtener la lista de clientes desde la base de datos
-    resultados = ejecutar_sp("ObtenerClientes", ())
+    indice = obtener_indice_clientes()
 
-    if not resultados or len(resultados[0]) == 0:
+    if not indice or len(indice["ids"]) == 0:
         return None  # No hay clientes en la base de datos
 
-    clientes = resultados[0]  # Lista de clientes [(idCliente, nombre)]
-
-    # Crear un diccionario con idCliente como clave y nombre como valor
-    clientes_dict = {cliente[0]: cliente[1] for cliente in clientes}
+    consulta = normalizar_texto(nombre_cliente)
+    posicion = indice["por_id"].get(buscar_alias("cliente", consulta))
+    if posicion is not None:
+        contar("alias_consultas_total", tipo="cliente", resultado="acierto")
+        return {
+            "idCliente": indice["ids"][posicion],
+            "nombreCliente": indice["nombres"][posicion],
+            "similitud": 100.0
+        }
+    contar("alias_consultas_total", tipo="cliente", resultado="fallo")
 
     # Buscar coincidencias con RapidFuzz
-    mejor_coincidencia = process.extractOne(
-        nombre_cliente, clientes_dict.values(), score_cutoff=70
-    )
+    with medir("match_duracion_segundos", tipo="cliente"):
+        mejor_coincidencia = process.extractOne(consulta, indice["opciones"], processor=None, score_cutoff=70)
 
     if mejor_coincidencia:
-        mejor_nombre, similitud, _ = mejor_coincidencia
+        _, similitud, posicion = mejor_coincidencia
+        aprender_alias("cliente", consulta, indice["ids"][posicion], similitud)
 
-        # Buscar el ID del cliente con el mejor nombre
-        id_cliente = next(
-            (id for id, nombre in clientes_dict.items() if nombre == mejor_nombre), None
-        )
+        # La posición identifica al cliente exacto, aunque haya nombres repetidos
+        return {
+            "idCliente": indice["ids"][posicion],
+            "nombreCliente": indice["nombres"][posicion],
+            "similitud": similitud
+        }
 
-        if id_cliente:
-            return {
-                "idCliente": id_cliente,
-                "nombreCliente": mejor_nombre,
-                "similitud": similitud
-            }
-
-    return None
\ No newline at end of file
+    return None
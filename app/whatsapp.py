@@ -1,5 +1,16 @@
-import requests
+import mimetypes
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from app.config import Config
+from app.cliente_http import solicitar, LimitadorTasa
+from app.metricas import contar, medir
+
+# 📌 Límite de envíos por segundo del número de WhatsApp Business (throughput de Meta)
+limitador_whatsapp = LimitadorTasa(Config.WHATSAPP_MENSAJES_POR_SEGUNDO)
+
+_ejecutor_envios = None
+_lock_ejecutor = threading.Lock()
 
 def enviar_mensaje_whatsapp(to, mensaje):
     """
@@ -18,9 +29,74 @@ def enviar_mensaje_whatsapp(to, mensaje):
             "text": {"body": mensaje}
         }
         
-        response = requests.post(url, headers=headers, json=payload)
+        with medir("graph_envio_duracion_segundos", tipo="mensaje"):
+            response = solicitar("POST", url, limitador=limitador_whatsapp, headers=headers, json=payload)
+        contar("graph_envios_total", tipo="mensaje", estado=response.status_code)
         # print(response.json())
         return response.json()
     except Exception as e:
+        contar("graph_envios_total", tipo="mensaje", estado="error")
         # print(f"Error enviando mensaje: {e}")
-        return {"error": str(e)}
\ No newline at end of file
+        return {"error": str(e)}
+
+def enviar_documento_whatsapp(to, ruta, nombre_archivo, caption=None):
+    """
+    Sube un archivo a la API de Meta y lo envía como documento de WhatsApp.
+    """
+    try:
+        base = f"https://graph.facebook.com/v21.0/{Config.WHATSAPP_PHONE_NUMBER_ID}"
+        headers = {"Authorization": f"Bearer {Config.WHATSAPP_API_TOKEN}"}
+        mime_type = mimetypes.guess_type(nombre_archivo)[0] or "application/octet-stream"
+
+        # 📌 Subir el archivo (sin reintentos: el archivo se envía en streaming y no se puede rebobinar)
+        with open(ruta, "rb") as archivo, medir("graph_envio_duracion_segundos", tipo="media"):
+            response = solicitar(
+                "POST", f"{base}/media", reintentos=0, headers=headers,
+                data={"messaging_product": "whatsapp", "type": mime_type},
+                files={"file": (os.path.basename(nombre_archivo), archivo, mime_type)}
+            )
+        media_id = response.json().get("id")
+        if not media_id:
+            return {"error": f"No se pudo subir el archivo: {response.text}"}
+
+        documento = {"id": media_id, "filename": nombre_archivo}
+        if caption:
+            documento["caption"] = caption
+        payload = {
+            "messaging_product": "whatsapp",
+            "to": to,
+            "type": "document",
+            "document": documento
+        }
+
+        with medir("graph_envio_duracion_segundos", tipo="documento"):
+            response = solicitar("POST", f"{base}/messages", limitador=limitador_whatsapp, headers=headers, json=payload)
+        contar("graph_envios_total", tipo="documento", estado=response.status_code)
+        return response.json()
+    except Exception as e:
+        contar("graph_envios_total", tipo="documento", estado="error")
+        return {"error": str(e)}
+
+def enviar_mensaje_whatsapp_async(to, mensaje):
+    """
+    Envía un mensaje de WhatsApp en segundo plano y devuelve un `Future` con la respuesta.
+    """
+    return _obtener_ejecutor().submit(enviar_mensaje_whatsapp, to, mensaje)
+
+def enviar_mensajes_whatsapp(envios):
+    """
+    Envía varios mensajes [(to, mensaje)] de forma concurrente respetando el límite de tasa.
+    Devuelve las respuestas en el mismo orden de `envios`.
+    """
+    futuros = [enviar_mensaje_whatsapp_async(to, mensaje) for to, mensaje in envios]
+    return [futuro.result() for futuro in futuros]
+
+def _obtener_ejecutor():
+    global _ejecutor_envios
+
+    with _lock_ejecutor:
+        if _ejecutor_envios is None:
+            _ejecutor_envios = ThreadPoolExecutor(
+                max_workers=Config.WHATSAPP_ENVIOS_CONCURRENTES, thread_name_prefix="envios-whatsapp"
+            )
+        return _ejecutor_envios
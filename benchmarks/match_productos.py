@@ -0,0 +1,138 @@
+"""
+Benchmark de la búsqueda difusa de productos: recorrido completo vs prefiltro por trigramas.
+
+Arma catálogos sintéticos de 1k/10k/100k productos a partir de articulos_codigos.xlsx
+(descripción x marca x variante x presentación) y busca líneas de pedido escritas como las
+escribe un cliente (minúsculas, abreviaturas, errores de tipeo) con `buscar_producto_por_nombre`.
+
+Los alias aprendidos se desactivan para medir la búsqueda difusa en las dos pasadas.
+
+Uso (desde la raíz del repositorio):
+    python -m benchmarks.match_productos --tamanos 1000 10000 100000 --consultas 300
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MARCAS = ["Monra", "Clorox", "Brillo", "Fresco", "Aroma", "Limpio", "Hogar", "Total", "Max", "Eco",
+          "Plus", "Quimex", "Sapolio", "Fabuloso", "Suli", "Blanquita", "Ultra", "Pro", "Casa", "Lider",
+          "Norte", "Sur", "Tropical", "Central", "Andina"]
+VARIANTES = ["lavanda", "limon", "pino", "floral", "manzana", "canela", "menta", "coco", "bebe", "original",
+             "marina", "frutal", "vainilla", "citrico", "rosas", "eucalipto", "naranja", "uva", "fresa", "neutro",
+             "industrial", "concentrado", "premium", "economico", "extra"]
+ABREVIATURAS = {"galon": "gal", "pichinga": "pich", "unidad": "ud", "litro": "ltr", "kilo": "kg"}
+
+
+def generar_catalogo(tamano, semilla=0):
+    """
+    Devuelve filas (idProducto, nombre, precioInstitucional, precioMayorista) con nombres
+    "Descripción Marca variante (Presentación)" únicos.
+    """
+    import pandas as pd
+
+    df = pd.read_excel(os.path.join(RAIZ, "articulos_codigos.xlsx")).dropna(subset=["Descripcion", "Presentacion"])
+    bases = [(str(d).strip(), str(p).strip().capitalize()) for d, p in zip(df["Descripcion"], df["Presentacion"])]
+
+    combinaciones = [(b, m, v) for b in range(len(bases)) for m in range(len(MARCAS)) for v in range(len(VARIANTES))]
+    random.Random(semilla).shuffle(combinaciones)
+
+    productos = []
+    for id_producto, (b, m, v) in enumerate(combinaciones[:tamano], start=1):
+        descripcion, presentacion = bases[b]
+        productos.append((id_producto, f"{descripcion} {MARCAS[m]} {VARIANTES[v]} ({presentacion})", 1000.0, 800.0))
+    return productos
+
+
+def escribir_como_cliente(nombre, aleatorio):
+    """
+    Convierte el nombre de catálogo en una línea de pedido plausible.
+    """
+    texto = nombre.lower().replace("(", "").replace(")", "")
+    for palabra, abreviatura in ABREVIATURAS.items():
+        if aleatorio.random() < 0.5:
+            texto = texto.replace(palabra, abreviatura)
+
+    if aleatorio.random() < 0.5 and len(texto) > 6:
+        # Error de tipeo: dos letras intercambiadas
+        i = aleatorio.randrange(1, len(texto) - 2)
+        texto = texto[:i] + texto[i + 1] + texto[i] + texto[i + 2:]
+    return texto
+
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, round(p / 100 * (len(ordenados) - 1)))]
+
+
+def medir_busquedas(buscar, consultas):
+    resultados, tiempos = [], []
+    for consulta, _ in consultas:
+        inicio = time.perf_counter()
+        producto = buscar(consulta)
+        tiempos.append(time.perf_counter() - inicio)
+        resultados.append(producto["idProducto"] if producto else None)
+    return resultados, tiempos
+
+
+def ejecutar(tamano, cantidad_consultas, indices, services):
+    productos = generar_catalogo(tamano)
+    aleatorio = random.Random(tamano)
+    consultas = [(escribir_como_cliente(p[1], aleatorio), p[0]) for p in aleatorio.sample(productos, cantidad_consultas)]
+
+    inicio = time.perf_counter()
+    indice = indices.indice_desde_productos(productos)
+    construccion = time.perf_counter() - inicio
+
+    # 📌 Recorrido completo: el mismo índice sin trigramas
+    indices._indice_productos = dict(indice, trigramas=None)
+    completos, tiempos_completo = medir_busquedas(services.buscar_producto_por_nombre, consultas)
+
+    indices._indice_productos = indice
+    if indice["trigramas"] is None:
+        indices._indice_productos = dict(indice, trigramas=indices._indexar_trigramas(indice["opciones"]))
+    filtrados, tiempos_filtro = medir_busquedas(services.buscar_producto_por_nombre, consultas)
+
+    esperados = [id_producto for _, id_producto in consultas]
+    return {
+        "productos": tamano,
+        "construccion_indice_s": round(construccion, 2),
+        "completo_p50_ms": round(percentil(tiempos_completo, 50) * 1000, 3),
+        "completo_p95_ms": round(percentil(tiempos_completo, 95) * 1000, 3),
+        "prefiltro_p50_ms": round(percentil(tiempos_filtro, 50) * 1000, 3),
+        "prefiltro_p95_ms": round(percentil(tiempos_filtro, 95) * 1000, 3),
+        "acierto_completo": round(sum(a == b for a, b in zip(completos, esperados)) / len(esperados), 3),
+        "acierto_prefiltro": round(sum(a == b for a, b in zip(filtrados, esperados)) / len(esperados), 3),
+        "igual_a_completo": round(sum(a == b for a, b in zip(filtrados, completos)) / len(esperados), 3)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compara la búsqueda de productos con y sin prefiltro por trigramas.")
+    parser.add_argument("--tamanos", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--consultas", type=int, default=300, help="Líneas de pedido buscadas por catálogo")
+    args = parser.parse_args()
+
+    directorio = tempfile.mkdtemp(prefix="bench_match_")
+    os.environ["DATA_DIR"] = directorio
+    os.environ["ALMACEN_LOCAL_PATH"] = os.path.join(directorio, "almacen_local.db")
+    os.environ["CATALOGO_TTL_SEGUNDOS"] = "0"
+    # Sin alias aprendidos: si no, la primera pasada los guarda y la segunda solo mide su consulta
+    os.environ["ALIAS_SIMILITUD_MIN"] = "101"
+
+    import app.indices as indices
+    import app.services as services
+
+    columnas = ["productos", "construccion_indice_s", "completo_p50_ms", "completo_p95_ms", "prefiltro_p50_ms",
+                "prefiltro_p95_ms", "acierto_completo", "acierto_prefiltro", "igual_a_completo"]
+    print(" | ".join(columnas))
+    for tamano in args.tamanos:
+        resultado = ejecutar(tamano, args.consultas, indices, services)
+        print(" | ".join(str(resultado[c]) for c in columnas), flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,396 @@
+"""
+Benchmark de extremo a extremo del camino /webhook -> cola -> atender_mensaje -> procesar_pedido.
+
+Reenvía payloads grabados (TEST.json, archivos .jsonl con un payload por línea) a la app de Flask
+con una tasa y concurrencia configurables. MySQL se reemplaza por una base de datos en memoria
+a nivel de conexión (todas las llamadas pasan por el pool real) y la Graph API por una sesión HTTP falsa.
+
+Uso (desde la raíz del repositorio):
+    python -m benchmarks.replay_webhook --payloads TEST.json --mensajes 500 --concurrencia 8 --tasa 200
+"""
+import argparse
+import copy
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def cargar_payloads(rutas):
+    """
+    Lee payloads de webhook desde archivos .json (objeto o lista) o .jsonl (uno por línea).
+    Ignora las entradas que no tienen la forma de un webhook de WhatsApp.
+    """
+    payloads = []
+    for ruta in rutas:
+        with open(ruta, encoding="utf-8") as archivo:
+            if ruta.endswith(".jsonl"):
+                datos = [json.loads(linea) for linea in archivo if linea.strip()]
+            else:
+                datos = json.load(archivo)
+                datos = datos if isinstance(datos, list) else [datos]
+        payloads.extend(d for d in datos if isinstance(d, dict) and d.get("entry"))
+    return payloads
+
+
+def con_ids_unicos(payload, numero):
+    """
+    Copia el payload cambiando el ID de cada mensaje para que no se descarte como repetido.
+    Devuelve (payload, [ids]).
+    """
+    payload = copy.deepcopy(payload)
+    ids = []
+    for entry in payload.get("entry", []):
+        for change in entry.get("changes", []):
+            for mensaje in change.get("value", {}).get("messages", []):
+                mensaje["id"] = f"{mensaje.get('id', 'wamid')}-bench-{numero}-{len(ids)}"
+                ids.append(mensaje["id"])
+    return payload, ids
+
+
+def generar_pedidos(plantilla, nombres_productos, cantidad, lineas_por_pedido=3, semilla=0):
+    """
+    Crea `cantidad` payloads de pedido a partir de `plantilla`, con productos tomados del catálogo
+    tal como están escritos, para ejercitar también el registro y el envío de facturas.
+    """
+    aleatorio = random.Random(semilla)
+    pedidos = []
+    for _ in range(cantidad):
+        lineas = [f"{aleatorio.randint(1, 20)} {nombre}"
+                  for nombre in aleatorio.sample(nombres_productos, min(lineas_por_pedido, len(nombres_productos)))]
+        payload = copy.deepcopy(plantilla)
+        mensaje = payload["entry"][0]["changes"][0]["value"]["messages"][0]
+        mensaje["type"] = "text"
+        mensaje["text"] = {"body": "pedido:\nSuper la Macacona\nmañana\n" + "\n".join(lineas)}
+        pedidos.append(payload)
+    return pedidos
+
+
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    posicion = min(len(ordenados) - 1, max(0, round(p / 100 * (len(ordenados) - 1))))
+    return ordenados[posicion]
+
+
+class BaseDatosFalsa:
+    """
+    Implementación en memoria de los procedimientos almacenados que usa la app.
+    """
+
+    def __init__(self, ruta_catalogo, latencia):
+        self.latencia = latencia
+        self.lock = threading.Lock()
+        self.llamadas = Counter()
+        self.commits = 0
+        self.webhooks = set()
+        self.clientes = [(1, "Super la Macacona"), (2, "Pulpería Doña Ana"), (3, "Hotel Central")]
+        self.presentaciones = {}
+        self.productos = {}  # codigo -> [id, nombre, precio institucional, precio mayorista]
+        self.facturas = {}
+        self.lineas = []
+
+        if ruta_catalogo and os.path.exists(ruta_catalogo):
+            import pandas as pd
+            df = pd.read_excel(ruta_catalogo).dropna(subset=["Descripcion", "Presentacion", "Codigo"])
+            df[["Institucional", "Mayorista"]] = df[["Institucional", "Mayorista"]].fillna(0)
+            for fila in df.itertuples(index=False):
+                nombre = f"{str(fila.Descripcion).strip()} ({str(fila.Presentacion).strip().capitalize()})"
+                self.productos[str(fila.Codigo)] = [
+                    len(self.productos) + 1, nombre, float(fila.Institucional), float(fila.Mayorista)
+                ]
+
+    def ejecutar(self, nombre_sp, parametros):
+        if self.latencia:
+            time.sleep(self.latencia)
+        with self.lock:
+            self.llamadas[nombre_sp] += 1
+            return getattr(self, f"_sp_{nombre_sp}")(*parametros)
+
+    def _sp_RegistrarWebhook(self, message_id, telefono, cuerpo, payload, existe):
+        if message_id in self.webhooks:
+            return [[(1,)]]
+        self.webhooks.add(message_id)
+        return [[(0,)]]
+
+    def _sp_ObtenerProductos(self):
+        return [[(p[0], p[1], p[2], p[3]) for p in self.productos.values()]]
+
+    def _sp_ObtenerClientes(self):
+        return [list(self.clientes)]
+
+    def _sp_InsertarCliente(self, nombre, telefono, salida):
+        self.clientes.append((len(self.clientes) + 1, nombre))
+        return [[(len(self.clientes),)]]
+
+    def _sp_InsertarPresentacion(self, nombre, salida):
+        self.presentaciones.setdefault(nombre, len(self.presentaciones) + 1)
+        return [[(self.presentaciones[nombre],)]]
+
+    def _sp_InsertarProducto(self, descripcion, codigo, id_presentacion, institucional, mayorista, salida):
+        presentacion = next(n for n, i in self.presentaciones.items() if i == id_presentacion)
+        producto = self.productos.setdefault(str(codigo), [len(self.productos) + 1, None, 0, 0])
+        producto[1:] = [f"{descripcion} ({presentacion})", institucional, mayorista]
+        return [[(producto[0],)]]
+
+    def _sp_CrearFactura(self, id_cliente, fecha_entrega, tipo, salida):
+        id_factura = len(self.facturas) + 1
+        self.facturas[id_factura] = {"cliente": id_cliente, "entrega": fecha_entrega, "tipo": tipo,
+                                     "fecha": date.today(), "total": 0}
+        return [[(id_factura,)]]
+
+    def _sp_InsertarLineaFactura(self, id_factura, id_producto, cantidad, precio, salida):
+        self.lineas.append((id_factura, id_producto, cantidad, precio))
+        return [[(len(self.lineas),)]]
+
+    def _sp_ActualizarTotalFactura(self, id_factura):
+        self.facturas[id_factura]["total"] = sum(l[2] * l[3] for l in self.lineas if l[0] == id_factura)
+        return []
+
+    def _sp_ObtenerFacturaCompleta(self, id_factura):
+        factura = self.facturas[id_factura]
+        nombres = {p[0]: p[1] for p in self.productos.values()}
+        cliente = dict(self.clientes).get(factura["cliente"], "")
+        detalle = [(i, l[0], nombres.get(l[1]), l[2], l[3], l[2] * l[3])
+                   for i, l in enumerate(self.lineas) if l[0] == id_factura]
+        return [
+            [(id_factura, cliente, None, "", factura["fecha"], factura["entrega"], factura["tipo"])],
+            detalle,
+            [(id_factura, factura["total"])]
+        ]
+
+    def _sp_ObtenerReportePorArticulo(self, fecha_inicio, fecha_fin):
+        inicio, fin = str(fecha_inicio), str(fecha_fin)
+        nombres = {p[0]: p[1] for p in self.productos.values()}
+        totales = Counter()
+        for id_factura, id_producto, cantidad, _ in self.lineas:
+            if inicio <= str(self.facturas[id_factura]["fecha"]) <= fin:
+                totales[id_producto] += cantidad
+        return [[(id_producto, nombres.get(id_producto), cantidad) for id_producto, cantidad in totales.items()]]
+
+
+class _Resultado:
+    def __init__(self, filas):
+        self.filas = filas
+
+    def fetchall(self):
+        return self.filas
+
+
+class CursorFalso:
+    def __init__(self, base):
+        self.base = base
+        self.resultados = []
+
+    def callproc(self, nombre_sp, parametros):
+        self.resultados = self.base.ejecutar(nombre_sp, parametros)
+
+    def stored_results(self):
+        return iter([_Resultado(filas) for filas in self.resultados])
+
+    def close(self):
+        pass
+
+
+class ConexionFalsa:
+    def __init__(self, base):
+        self.base = base
+
+    def cursor(self):
+        return CursorFalso(self.base)
+
+    def start_transaction(self):
+        pass
+
+    def commit(self):
+        with self.base.lock:
+            self.base.commits += 1
+
+    def rollback(self):
+        pass
+
+    def ping(self, reconnect=False):
+        pass
+
+    def close(self):
+        pass
+
+
+class RespuestaFalsa:
+    status_code = 200
+    headers = {}
+    text = '{"messages": [{"id": "wamid.bench"}]}'
+
+    def json(self):
+        return {"messages": [{"id": "wamid.bench"}], "id": "media.bench", "url": "https://example.invalid/doc"}
+
+    def close(self):
+        pass
+
+
+class SesionGraphFalsa:
+    """
+    Reemplaza la sesión HTTP compartida: responde 200 a todo después de `latencia` segundos.
+    """
+
+    def __init__(self, latencia):
+        self.latencia = latencia
+        self.llamadas = Counter()
+        self.lock = threading.Lock()
+
+    def request(self, metodo, url, **kwargs):
+        if self.latencia:
+            time.sleep(self.latencia)
+        with self.lock:
+            self.llamadas[metodo] += 1
+        return RespuestaFalsa()
+
+
+def ejecutar(args):
+    # 📌 Aislar el almacén local y la cola en un directorio temporal antes de importar la app
+    directorio = tempfile.mkdtemp(prefix="bench_webhook_")
+    os.environ["DATA_DIR"] = directorio
+    os.environ["ALMACEN_LOCAL_PATH"] = os.path.join(directorio, "almacen_local.db")
+
+    import app.cliente_http as cliente_http
+    import app.database as database
+    import app.routes as routes
+    from app import create_app
+
+    base = BaseDatosFalsa(args.catalogo, args.latencia_db_ms / 1000)
+    database.get_db_connection = lambda: ConexionFalsa(base)
+    sesion = SesionGraphFalsa(args.latencia_graph_ms / 1000)
+    cliente_http._sesion = sesion
+
+    # 📌 Medir el fin de cada mensaje envolviendo `atender_mensaje` antes de que arranque el consumidor
+    terminados = {}
+    condicion = threading.Condition()
+    procesar_original = routes.atender_mensaje
+
+    def procesar_medido(data):
+        try:
+            procesar_original(data)
+        finally:
+            fin = time.perf_counter()
+            with condicion:
+                for entry in data.get("entry", []):
+                    for change in entry.get("changes", []):
+                        for mensaje in change.get("value", {}).get("messages", []):
+                            terminados[mensaje.get("id")] = fin
+                condicion.notify_all()
+
+    routes.atender_mensaje = procesar_medido
+    app = create_app()
+
+    payloads = cargar_payloads(args.payloads)
+    if not payloads:
+        raise SystemExit("No se encontraron payloads de webhook en los archivos indicados")
+    if args.pedidos_sinteticos:
+        nombres = [p[1] for p in base.productos.values()]
+        payloads += generar_pedidos(payloads[0], nombres, args.pedidos_sinteticos)
+
+    from app.cliente_http import LimitadorTasa
+    limitador = LimitadorTasa(args.tasa, rafaga=max(1, args.concurrencia)) if args.tasa > 0 else None
+
+    enviados = {}
+    latencias_ack = []
+    estados = Counter()
+    lock = threading.Lock()
+    local = threading.local()
+
+    def enviar(numero):
+        if not hasattr(local, "cliente"):
+            local.cliente = app.test_client()
+        # Varios mensajes en una misma entrega, como hace Meta con remitentes que escriben en ráfaga
+        payload = {"object": "whatsapp_business_account", "entry": []}
+        for posicion in range(numero * args.mensajes_por_entrega, (numero + 1) * args.mensajes_por_entrega):
+            payload["entry"] += copy.deepcopy(payloads[posicion % len(payloads)])["entry"]
+        payload, ids = con_ids_unicos(payload, numero)
+        if limitador:
+            limitador.esperar()
+
+        inicio = time.perf_counter()
+        respuesta = local.cliente.post("/webhook", json=payload)
+        ack = time.perf_counter() - inicio
+
+        with lock:
+            latencias_ack.append(ack)
+            estados[respuesta.status_code] += 1
+            if respuesta.status_code == 200:
+                for id_mensaje in ids:
+                    enviados[id_mensaje] = inicio
+
+    inicio_total = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrencia) as ejecutor:
+        list(ejecutor.map(enviar, range(-(-args.mensajes // args.mensajes_por_entrega))))
+
+    # 📌 Esperar a que el consumidor termine todo lo aceptado
+    limite = time.monotonic() + args.timeout
+    with condicion:
+        while not set(enviados) <= set(terminados) and time.monotonic() < limite:
+            condicion.wait(limite - time.monotonic())
+    fin_total = time.perf_counter()
+
+    latencias = [terminados[i] - enviados[i] for i in enviados if i in terminados]
+    duracion = fin_total - inicio_total
+    llamadas_sp = sum(base.llamadas.values())
+
+    return {
+        "mensajes_enviados": len(enviados),
+        "respuestas": dict(estados),
+        "mensajes_procesados": len(latencias),
+        "duracion_s": round(duracion, 3),
+        "mensajes_por_segundo": round(len(latencias) / duracion, 2) if duracion else 0.0,
+        "ack_ms": {"p50": round(percentil(latencias_ack, 50) * 1000, 2),
+                   "p99": round(percentil(latencias_ack, 99) * 1000, 2)},
+        "extremo_a_extremo_ms": {p: round(percentil(latencias, int(p[1:])) * 1000, 2) for p in ("p50", "p95", "p99")},
+        "facturas": len(base.facturas),
+        "llamadas_sp_total": llamadas_sp,
+        "llamadas_sp_por_mensaje": round(llamadas_sp / len(latencias), 2) if latencias else 0.0,
+        "llamadas_sp_por_factura": round(llamadas_sp / len(base.facturas), 2) if base.facturas else None,
+        "llamadas_sp": dict(base.llamadas),
+        "commits_db": base.commits,
+        "llamadas_graph": dict(sesion.llamadas)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reenvía webhooks grabados y mide el camino completo de un pedido.")
+    parser.add_argument("--payloads", nargs="+", default=[os.path.join(RAIZ, "TEST.json")],
+                        help="Archivos .json o .jsonl con payloads de webhook")
+    parser.add_argument("--catalogo", default=os.path.join(RAIZ, "articulos_codigos.xlsx"),
+                        help="Excel con el catálogo que carga la base de datos falsa")
+    parser.add_argument("--pedidos-sinteticos", type=int, default=0,
+                        help="Agregar N pedidos con productos del catálogo, usando el primer payload como plantilla")
+    parser.add_argument("--mensajes", type=int, default=200, help="Cantidad de webhooks a enviar")
+    parser.add_argument("--mensajes-por-entrega", type=int, default=1,
+                        help="Mensajes agrupados en cada POST (Meta puede juntar varios en una entrega)")
+    parser.add_argument("--concurrencia", type=int, default=8, help="Hilos enviando webhooks a la vez")
+    parser.add_argument("--tasa", type=float, default=0, help="Webhooks por segundo (0 = sin límite)")
+    parser.add_argument("--latencia-db-ms", type=float, default=0, help="Latencia simulada por procedimiento")
+    parser.add_argument("--latencia-graph-ms", type=float, default=0, help="Latencia simulada por llamada a la Graph API")
+    parser.add_argument("--timeout", type=float, default=120, help="Segundos máximos esperando el procesamiento")
+    parser.add_argument("--json", action="store_true", help="Imprimir el resultado como JSON")
+    args = parser.parse_args()
+
+    resultado = ejecutar(args)
+
+    if args.json:
+        print(json.dumps(resultado, indent=2, ensure_ascii=False))
+        return
+
+    print("\n📈 Resultado del benchmark")
+    for clave, valor in resultado.items():
+        print(f"  {clave}: {valor}")
+
+
+if __name__ == "__main__":
+    main()
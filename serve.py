@@ -0,0 +1,64 @@
+"""
+Servidor de producción: gunicorn con varios procesos y la app precargada en el proceso maestro.
+`run.py` sigue siendo el servidor de desarrollo de Flask.
+
+    python serve.py
+
+Se configura con `Config` (SERVIDOR_MODO, SERVIDOR_WORKERS, SERVIDOR_HILOS, SERVIDOR_TIMEOUT, ...).
+En modo "asgi" el webhook lo atiende `app.asgi` con workers de uvicorn.
+Las métricas de `/metrics` suman las de todos los workers (ver `app.metricas.preparar_multiproceso`).
+"""
+from gunicorn.app.base import BaseApplication
+from app import create_app, iniciar_procesamiento
+from app.config import Config
+from app.metricas import preparar_multiproceso
+
+
+class Servidor(BaseApplication):
+    def __init__(self, aplicacion, opciones):
+        self.aplicacion = aplicacion
+        self.opciones = opciones
+        super().__init__()
+
+    def load_config(self):
+        for clave, valor in self.opciones.items():
+            self.cfg.set(clave, valor)
+
+    def load(self):
+        return self.aplicacion
+
+
+def post_worker_init(worker):
+    # 📌 Los hilos no sobreviven al fork: cada worker arranca su propio consumidor de la cola.
+    # La cola reclama con leases en SQLite, así que varios procesos pueden consumirla a la vez.
+    iniciar_procesamiento()
+
+
+def main():
+    if Config.METRICAS_ACTIVAS:
+        preparar_multiproceso()  # Antes de precargar la app y hacer fork
+
+    opciones = {
+        "bind": f"0.0.0.0:{Config.FLASK_RUN_PORT}",
+        "workers": Config.SERVIDOR_WORKERS,
+        "timeout": Config.SERVIDOR_TIMEOUT,
+        "keepalive": Config.SERVIDOR_KEEPALIVE,
+        "preload_app": True,  # Importa la app (rapidfuzz, pandas, ...) una vez antes del fork
+        "post_worker_init": post_worker_init
+    }
+
+    if Config.SERVIDOR_MODO == "asgi":
+        from app.asgi import app
+        opciones["worker_class"] = "uvicorn.workers.UvicornWorker"
+    else:
+        app = create_app(iniciar_hilos=False)
+        opciones["worker_class"] = "gthread"
+        opciones["threads"] = Config.SERVIDOR_HILOS
+
+    print(f"Iniciando gunicorn ({Config.SERVIDOR_MODO}) en el puerto {Config.FLASK_RUN_PORT} "
+          f"con {Config.SERVIDOR_WORKERS} workers...")
+    Servidor(app, opciones).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+from contextlib import contextmanager
+from unittest import mock
+from mysql.connector.errors import DataError
+
+# 📌 Almacén local aislado, antes de importar la app (Config lee el entorno al importarse)
+_directorio = tempfile.mkdtemp(prefix="test_cola_")
+os.environ["DATA_DIR"] = _directorio
+os.environ["ALMACEN_LOCAL_PATH"] = os.path.join(_directorio, "almacen_local.db")
+os.environ["METRICAS_ACTIVAS"] = "0"
+os.environ["COLA_BACKOFF_BASE"] = "0.05"
+os.environ["COLA_INTERVALO_SEGUNDOS"] = "0.05"
+
+from app import cola, routes  # noqa: E402
+
+
+def payload_texto(message_id, telefono, cuerpo):
+    return {
+        "object": "whatsapp_business_account",
+        "entry": [{"changes": [{"field": "messages", "value": {
+            "contacts": [{"wa_id": telefono}],
+            "messages": [{"id": message_id, "from": telefono, "type": "text", "text": {"body": cuerpo}}]
+        }}]}]
+    }
+
+
+def estado_trabajo(message_id):
+    fila = cola.conexion_local().execute("SELECT estado FROM cola_webhooks WHERE message_id = ?", (message_id,)).fetchone()
+    return fila[0] if fila else None
+
+
+def esperar(condicion, timeout=5):
+    limite = time.monotonic() + timeout
+    while time.monotonic() < limite:
+        if condicion():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+class ConsumidorColaTest(unittest.TestCase):
+    def test_reporte_se_envia_una_vez_y_queda_hecho(self):
+        # Regresión: `procesar_reporte` devolvía `jsonify(...)`, que falla fuera del contexto de Flask;
+        # la cola lo reintentaba, el cliente recibía el reporte 5 veces y el trabajo quedaba 'fallido'.
+        cola.encolar("wamid.reporte-1", "50688887777", json.dumps(payload_texto("wamid.reporte-1", "50688887777", "reporte:\nhoy")))
+
+        with mock.patch("app.services.enviar_reporte_por_articulo") as enviar:
+            consumidor = cola.ConsumidorCola(routes.atender_mensaje, registrar=lambda payloads: [True] * len(payloads))
+            consumidor.iniciar()
+            try:
+                terminado = esperar(lambda: estado_trabajo("wamid.reporte-1") in ("hecho", "fallido"))
+                time.sleep(0.3)  # Tiempo para que apareciera un reintento
+            finally:
+                consumidor.detener(5)
+
+        self.assertTrue(terminado)
+        self.assertEqual(enviar.call_count, 1)
+        self.assertEqual(estado_trabajo("wamid.reporte-1"), "hecho")
+
+    def test_trabajo_que_espera_en_el_despachador_no_se_reclama_otra_vez(self):
+        # Regresión: el plazo vencía mientras el trabajo esperaba en el despachador o se ejecutaba,
+        # y la cola lo volvía a reclamar y procesar (facturas duplicadas).
+        ejecutados = []
+
+        def procesar(data):
+            time.sleep(0.8)
+            ejecutados.append(data["entry"][0]["changes"][0]["value"]["messages"][0]["id"])
+
+        cola.encolar_lote([
+            (f"wamid.plazo-{n}", f"5068000000{n}", json.dumps(payload_texto(f"wamid.plazo-{n}", f"5068000000{n}", "hola")))
+            for n in range(3)
+        ])
+
+        with mock.patch.object(cola.Config, "COLA_PLAZO_SEGUNDOS", 1), mock.patch.object(cola.Config, "WEBHOOK_ENCOLAR_TIMEOUT", 0.05):
+            consumidor = cola.ConsumidorCola(procesar)
+            consumidor._registrar_lote = lambda trabajos: trabajos
+            with mock.patch.object(cola, "obtener_despachador", return_value=_despachador_de_un_hilo()):
+                consumidor.iniciar()
+                try:
+                    esperar(lambda: len(ejecutados) >= 3, timeout=10)
+                    time.sleep(1.5)  # Tiempo para que apareciera una segunda copia
+                finally:
+                    consumidor.detener(5)
+
+        self.assertEqual(sorted(ejecutados), ["wamid.plazo-0", "wamid.plazo-1", "wamid.plazo-2"])
+
+    def test_un_mensaje_que_falla_al_registrarse_no_arrastra_al_lote(self):
+        # Regresión: un solo mensaje inválido deshacía la transacción del lote y la cola reintentaba
+        # (y terminaba descartando) todos los mensajes del lote.
+        registrados = []
+
+        @contextmanager
+        def transaccion_falsa():
+            pendientes = []
+            yield pendientes
+            registrados.extend(pendientes)  # Commit
+
+        def llamar_sp_falso(cursor, nombre_sp, parametros):
+            if parametros[2] == "malo":
+                raise DataError("Data too long for column 'cuerpo'")
+            cursor.append(parametros[0])
+            return [[(0,)]]
+
+        ids = ["wamid.lote-1", "wamid.lote-2", "wamid.lote-3"]
+        cuerpos = ["hola", "malo", "hola"]
+        cola.encolar_lote([
+            (message_id, "50687776666", json.dumps(payload_texto(message_id, "50687776666", cuerpo)))
+            for message_id, cuerpo in zip(ids, cuerpos)
+        ])
+
+        with mock.patch.object(routes, "transaccion", transaccion_falsa), mock.patch.object(routes, "llamar_sp", llamar_sp_falso):
+            trabajos = [trabajo for trabajo in cola.reclamar(50) if trabajo["message_id"] in ids]
+            pendientes = cola.ConsumidorCola(routes.atender_mensaje, registrar=routes.registrar_mensajes)._registrar_lote(trabajos)
+
+        self.assertEqual(registrados, ["wamid.lote-1", "wamid.lote-3"])
+        self.assertEqual([trabajo["message_id"] for trabajo in pendientes], ["wamid.lote-1", "wamid.lote-3"])
+        estados = dict(cola.conexion_local().execute(
+            "SELECT message_id, estado FROM cola_webhooks WHERE message_id LIKE 'wamid.lote-%'"
+        ).fetchall())
+        self.assertEqual(estados["wamid.lote-2"], "pendiente")  # Solo el mensaje inválido se reintenta
+        for trabajo in trabajos:
+            cola.completar(trabajo["id"])
+
+    def test_una_caida_de_la_cache_compartida_no_pierde_mensajes(self):
+        # Regresión: un error de la caché al reservar hacía fallar el lote, y uno después del commit de
+        # `RegistrarWebhook` perdía el mensaje (el reintento lo encontraba ya registrado y lo ignoraba).
+        registrados = []
+
+        @contextmanager
+        def transaccion_falsa():
+            pendientes = []
+            yield pendientes
+            registrados.extend(pendientes)
+
+        def llamar_sp_falso(cursor, nombre_sp, parametros):
+            cursor.append(parametros[0])
+            return [[(0,)]]
+
+        cache = mock.Mock()
+        cache.guardar_si_no_existe.side_effect = ConnectionError("Redis no responde")
+        cache.obtener.side_effect = ConnectionError("Redis no responde")
+        cache.guardar.side_effect = ConnectionError("Redis no responde")
+
+        payloads = [payload_texto(f"wamid.cache-{n}", "50685554444", "hola") for n in range(2)]
+        with mock.patch.object(routes, "obtener_cache", return_value=cache), \
+                mock.patch.object(routes, "transaccion", transaccion_falsa), mock.patch.object(routes, "llamar_sp", llamar_sp_falso):
+            nuevos = routes.registrar_mensajes(payloads)
+
+        self.assertEqual(nuevos, [True, True])
+        self.assertEqual(registrados, ["wamid.cache-0", "wamid.cache-1"])
+
+
+def _despachador_de_un_hilo():
+    from app.despachador import Despachador
+    despachador = Despachador(1, 10)
+    despachador.iniciar()
+    return despachador
+
+
+if __name__ == "__main__":
+    unittest.main()